@@ -1,3 +1,6 @@
+import collections
+import getpass
+import hashlib
 import os
 import unittest
 import vtk, qt, ctk, slicer
@@ -5,8 +8,33 @@ import re
 import numpy as np
 from slicer.ScriptedLoadableModule import *
 import logging
-import math
-from scipy.spatial.transform import Rotation
+from AirwayLandmarksLib.cohortstats import group_by_file, group_by_pattern, summarize_results_files
+from AirwayLandmarksLib.geometry import (
+  FH_LANDMARK_NAMES,
+  MEASURE_LANDMARK_NAMES,
+  IncrementalMeasures,
+  angle,
+  calculate_measures_array,
+  distance_3D,
+  distance_sag,
+  fh_rotation_matrix,
+  measures_available,
+  project,
+)
+from AirwayLandmarksLib.journal import PlacementJournal, last_session, read_journal, replay_journal
+from AirwayLandmarksLib.midsagittal import MID_SAG_LANDMARK_NAMES, BILATERAL_PAIRS, MidSagittalPlaneFit, plane_slice_to_ras
+from AirwayLandmarksLib.normative import NormativeTable, normalize_sex, parse_dicom_age
+from AirwayLandmarksLib.propagation import propagate_points
+from AirwayLandmarksLib.refinement import snap_point
+from AirwayLandmarksLib.sampling import sphere_statistics, trilinear
+from AirwayLandmarksLib.results import MeasureResults
+from AirwayLandmarksLib.resultsdb import ResultsDatabase
+from AirwayLandmarksLib.resultscsv import ResultsCSVStore, ResultsFileLockTimeout, ResultsHeaderMismatch
+from AirwayLandmarksLib.timing import CALL_TIMINGS, timed
+from AirwayLandmarksLib.worklist import PrefetchCache, read_case, read_worklist
+
+# Node reference from each CT volume to its own FH transform
+FH_TRANSFORM_REFERENCE_ROLE = 'AirwayLandmarks.FHTransform'
 
 #
 # Airway Landmarks
@@ -51,7 +79,7 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     pn = self.parameterNode
     
 
-    fhLandmarkStringsList = ['Left ear FH', 'Right ear FH', 'Left orbit FH']
+    fhLandmarkStringsList = list(FH_LANDMARK_NAMES)
     FHLandmarksNodeName = 'FH_Landmarks'
     tempLandmarkNodeName = 'TempLandmark'
     landmarksNodeName = 'Airway_Landmarks'
@@ -121,6 +149,30 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     # Idea is to have a table widget which will indicate and track the landmarks to connect
     # Start with FH points, which should be in a separate table
 
+    # Worklist, cases loaded one after another with the next one read in the background
+    worklistCollapsibleButton = ctk.ctkCollapsibleButton()
+    worklistCollapsibleButton.text = 'Worklist'
+    worklistCollapsibleButton.collapsed = True
+    self.layout.addWidget(worklistCollapsibleButton)
+    self.worklistFormLayout = qt.QFormLayout(worklistCollapsibleButton)
+    self.worklistPathLineEdit = ctk.ctkPathLineEdit()
+    self.worklistPathLineEdit.filters = ctk.ctkPathLineEdit.Files
+    self.worklistPathLineEdit.nameFilters = ['CSV files (*.csv)']
+    self.worklistPathLineEdit.setToolTip('Worklist CSV file (columns Volume, and optionally FH Landmarks, Landmarks, Name), one case per row')
+    self.worklistFormLayout.addRow('Worklist', self.worklistPathLineEdit)
+    self.worklistStatusLabel = qt.QLabel('No worklist loaded')
+    self.worklistFormLayout.addRow(self.worklistStatusLabel)
+    self.previousCaseButton = qt.QPushButton('Previous Case')
+    self.nextCaseButton = qt.QPushButton('Next Case')
+    self.nextCaseButton.setToolTip('Save this case\'s landmarks and move on to the next case')
+    worklistButtonsLayout = qt.QHBoxLayout()
+    worklistButtonsLayout.addWidget(self.previousCaseButton)
+    worklistButtonsLayout.addWidget(self.nextCaseButton)
+    self.worklistFormLayout.addRow(worklistButtonsLayout)
+    # Polls for cases read in the background, to make their nodes between user actions
+    self.worklistTimer = qt.QTimer()
+    self.worklistTimer.setInterval(500)
+
     # FH Points
     reorientCollapsibleButton = ctk.ctkCollapsibleButton()
     reorientCollapsibleButton.text = 'Reorientation'
@@ -151,12 +203,16 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     self.reorientFormLayout.addRow('FH Points', self.FHLandmarksNodeSelector)
 
     # Build the FH table 
+    self.tableModels = [] # the table views do not own their models, so keep them alive here
     self.fhTable = self.buildLandmarkTable(fhLandmarkStringsList)
     self.logic.fitTableSize(self.fhTable)
     self.reorientFormLayout.addRow(self.fhTable)
     # add the reorient button
     self.reorientButton = qt.QPushButton('Reorient')
     self.reorientFormLayout.addRow(self.reorientButton)
+    self.recoverButton = qt.QPushButton('Recover Landmarks from Journal')
+    self.recoverButton.setToolTip('Rebuild the FH and landmark points of the selected CT volume from its placement journal (e.g. after a crash)')
+    self.reorientFormLayout.addRow(self.recoverButton)
     
     if self.FHLandmarksNode is None:
       # There was no matching node at start up, create it
@@ -184,6 +240,40 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     # Main Landmark table
     self.landmarksTable = self.buildLandmarkTable(landmarkStrings,mid_sag_bool_dict=landmarkMidSagDict, include_sag_col=True)
     self.landmarksFormLayout.addRow(self.landmarksTable)
+
+    # Optional snapping of clicks onto a nearby image feature
+    self.snapModeComboBox = qt.QComboBox()
+    self.snapModeComboBox.addItems(['Off', 'Edge', 'Bright', 'Dark'])
+    self.snapModeComboBox.setToolTip('Move each placed point to the strongest edge, brightest or darkest spot within the snap radius (sub-voxel)')
+    self.landmarksFormLayout.addRow('Snap clicks to', self.snapModeComboBox)
+    self.snapRadiusSpinBox = qt.QDoubleSpinBox()
+    self.snapRadiusSpinBox.minimum = 0.5
+    self.snapRadiusSpinBox.maximum = 10.0
+    self.snapRadiusSpinBox.singleStep = 0.5
+    self.snapRadiusSpinBox.value = 2.0
+    self.snapRadiusSpinBox.suffix = ' mm'
+    self.snapRadiusSpinBox.setToolTip('How far from the click to look for the feature to snap to')
+    self.landmarksFormLayout.addRow('Snap radius', self.snapRadiusSpinBox)
+
+    # 4D: sequence browser whose frames each get their own set of landmarks
+    self.sequenceBrowserSelector = slicer.qMRMLNodeComboBox()
+    self.sequenceBrowserSelector.nodeTypes = ['vtkMRMLSequenceBrowserNode']
+    self.sequenceBrowserSelector.noneEnabled = True
+    self.sequenceBrowserSelector.addEnabled = False
+    self.sequenceBrowserSelector.removeEnabled = False
+    self.sequenceBrowserSelector.setMRMLScene( slicer.mrmlScene )
+    self.sequenceBrowserSelector.setCurrentNode(None)
+    self.sequenceBrowserSelector.setToolTip('For 4D CT, choose the sequence browser of the CT sequence to mark landmarks on each frame')
+    self.landmarksFormLayout.addRow('Sequence (4D)', self.sequenceBrowserSelector)
+    self.bindSequenceButton = qt.QPushButton('Bind Landmarks to Sequence Frames')
+    self.bindSequenceButton.setToolTip('Keep a separate copy of the landmark points for each frame of the sequence')
+    self.landmarksFormLayout.addRow(self.bindSequenceButton)
+    self.propagateButton = qt.QPushButton('Propagate Landmarks to Next Frame')
+    self.propagateButton.setToolTip('Propose positions for the landmarks on the next frame by template matching (proposals are left unlocked for review)')
+    self.landmarksFormLayout.addRow(self.propagateButton)
+    self.sequenceBrowserNode = None
+    self.sequenceBrowserObservation = None
+    self.sequenceItemNumber = None
     self.logic.fitTableSize(self.landmarksTable)
     if self.landmarksNode is None:
       self.landmarksNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', landmarksNodeName)
@@ -198,8 +288,34 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     self.calculateFormLayout = qt.QFormLayout(calculateCollapsibleButton)
     self.calculateLandmarkMeasuresButton = qt.QPushButton('Calculate Landmark Measures')
     self.calculateFormLayout.addRow(self.calculateLandmarkMeasuresButton)
+    self.calculateAllFramesButton = qt.QPushButton('Calculate Landmark Measures for All Frames')
+    self.calculateAllFramesButton.setToolTip('Calculate the measures for every frame of the bound 4D sequence')
+    self.calculateFormLayout.addRow(self.calculateAllFramesButton)
+    self.liveMeasuresCheckBox = qt.QCheckBox('Update measures live')
+    self.liveMeasuresCheckBox.checked = True
+    self.liveMeasuresCheckBox.setToolTip('Recalculate the measures as landmarks are placed or moved')
+    self.calculateFormLayout.addRow(self.liveMeasuresCheckBox)
+    # Normative reference, for z-scores and percentiles against age (and sex) norms
+    self.normsPathLineEdit = ctk.ctkPathLineEdit()
+    self.normsPathLineEdit.filters = ctk.ctkPathLineEdit.Files
+    self.normsPathLineEdit.nameFilters = ['CSV files (*.csv)']
+    self.normsPathLineEdit.setToolTip('Optional normative table CSV (columns Measure, Sex, Age, Mean, SD) to score the measures against')
+    self.calculateFormLayout.addRow('Norms', self.normsPathLineEdit)
+    self.ageLineEdit = qt.QLineEdit()
+    self.ageLineEdit.setToolTip('Patient age in years (filled in from DICOM where available)')
+    self.calculateFormLayout.addRow('Age (years)', self.ageLineEdit)
+    self.sexComboBox = qt.QComboBox()
+    self.sexComboBox.addItems(['Unknown', 'M', 'F'])
+    self.calculateFormLayout.addRow('Sex', self.sexComboBox)
     self.measuresText = qt.QTextEdit()
     self.calculateFormLayout.addRow(self.measuresText)
+    # Landmark changes are collected here and applied by a single shot timer, so a burst of
+    # point modified events (like dragging a point) causes at most one recompute per UI frame
+    self.pendingMeasureLabels = set() # None means all landmarks
+    self.landmarksNodeObservations = []
+    self.liveMeasuresTimer = qt.QTimer()
+    self.liveMeasuresTimer.setSingleShot(True)
+    self.liveMeasuresTimer.setInterval(16) # about one frame at 60 Hz
 
     # Export
     exportCollapsibleButton = ctk.ctkCollapsibleButton()
@@ -210,19 +326,95 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     self.exportFormLayout.addRow(self.createCSVButton)
     self.addToCSVButton = qt.QPushButton('Add to CSV')
     self.exportFormLayout.addRow(self.addToCSVButton)
+    self.databasePathLineEdit = ctk.ctkPathLineEdit()
+    self.databasePathLineEdit.filters = ctk.ctkPathLineEdit.Files
+    self.databasePathLineEdit.nameFilters = ['SQLite databases (*.sqlite *.db)']
+    self.databasePathLineEdit.setToolTip('Results database file (created if it does not exist yet)')
+    self.exportFormLayout.addRow('Database', self.databasePathLineEdit)
+    self.annotatorLineEdit = qt.QLineEdit(getpass.getuser())
+    self.annotatorLineEdit.setToolTip('Name recorded with each measurement added to the database')
+    self.exportFormLayout.addRow('Annotator', self.annotatorLineEdit)
+    self.addToDatabaseButton = qt.QPushButton('Add to Database')
+    self.addToDatabaseButton.setToolTip('Record the measures and landmark positions in the results database')
+    self.exportDatabaseCSVButton = qt.QPushButton('Export Database to CSV')
+    self.exportDatabaseCSVButton.setToolTip('Write a results CSV with the latest measurement of each volume in the database')
+    databaseButtonsLayout = qt.QHBoxLayout()
+    databaseButtonsLayout.addWidget(self.addToDatabaseButton)
+    databaseButtonsLayout.addWidget(self.exportDatabaseCSVButton)
+    self.exportFormLayout.addRow(databaseButtonsLayout)
+    self.cohortGroupByLineEdit = qt.QLineEdit()
+    self.cohortGroupByLineEdit.setToolTip('Optional grouping: "file" to group by results file, or a regular expression whose first group (found in the volume name) is the group')
+    self.exportFormLayout.addRow('Group by', self.cohortGroupByLineEdit)
+    self.cohortStatsButton = qt.QPushButton('Cohort Statistics from CSVs')
+    self.cohortStatsButton.setToolTip('Summarize the measures in one or more results CSV files')
+    self.exportFormLayout.addRow(self.cohortStatsButton)
+    self.cohortStatsText = qt.QTextEdit()
+    self.cohortStatsText.readOnly = True
+    self.exportFormLayout.addRow(self.cohortStatsText)
+
+    # Diagnostics, timing of the callbacks and helpers (off unless switched on here)
+    diagnosticsCollapsibleButton = ctk.ctkCollapsibleButton()
+    diagnosticsCollapsibleButton.text = 'Diagnostics'
+    diagnosticsCollapsibleButton.collapsed = True
+    self.layout.addWidget(diagnosticsCollapsibleButton)
+    self.diagnosticsFormLayout = qt.QFormLayout(diagnosticsCollapsibleButton)
+    self.timingCheckBox = qt.QCheckBox('Time callbacks')
+    self.timingCheckBox.checked = CALL_TIMINGS.enabled
+    self.timingCheckBox.setToolTip('Keep rolling timings of the landmark, table, reorient, calculate and CSV callbacks')
+    self.diagnosticsFormLayout.addRow(self.timingCheckBox)
+    self.profileCheckBox = qt.QCheckBox('Profile timed calls (cProfile)')
+    self.profileCheckBox.checked = CALL_TIMINGS.profiling
+    self.profileCheckBox.setToolTip('Also run the timed calls under cProfile (slower, include the profile in the JSON export)')
+    self.diagnosticsFormLayout.addRow(self.profileCheckBox)
+    self.diagnosticsText = qt.QTextEdit()
+    self.diagnosticsText.readOnly = True
+    self.diagnosticsText.setFont(qt.QFont('Courier'))
+    self.diagnosticsFormLayout.addRow(self.diagnosticsText)
+    self.refreshDiagnosticsButton = qt.QPushButton('Refresh')
+    self.resetDiagnosticsButton = qt.QPushButton('Reset')
+    self.exportDiagnosticsButton = qt.QPushButton('Export JSON')
+    diagnosticsButtonsLayout = qt.QHBoxLayout()
+    diagnosticsButtonsLayout.addWidget(self.refreshDiagnosticsButton)
+    diagnosticsButtonsLayout.addWidget(self.resetDiagnosticsButton)
+    diagnosticsButtonsLayout.addWidget(self.exportDiagnosticsButton)
+    self.diagnosticsFormLayout.addRow(diagnosticsButtonsLayout)
     
 
     # Connect callbacks
+    self.worklistPathLineEdit.connect('currentPathChanged(QString)', self.onWorklistPathChanged)
+    self.previousCaseButton.connect('clicked(bool)', self.onPreviousCaseButtonClick)
+    self.nextCaseButton.connect('clicked(bool)', self.onNextCaseButtonClick)
+    self.worklistTimer.connect('timeout()', self.onWorklistTimeout)
     self.CTVolumeSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onCTVolumeSelectorChange)
-    self.fhTable.connect('cellClicked(int,int)',lambda row,col: self.onTableCellClicked(row,col,self.fhTable))
+    self.fhTable.connect('clicked(QModelIndex)',lambda index: self.onTableCellClicked(index.row(),index.column(),self.fhTable))
     self.tempLandmarkNode.AddObserver(self.tempLandmarkNode.PointPositionDefinedEvent, self.onLandmarkClick)
-    self.reorientButton.connect('clicked(bool)',self.onReorientButtonClick)
-    self.landmarksTable.connect('cellClicked(int,int)',lambda row,col: self.onTableCellClicked(row,col,self.landmarksTable))
-    self.calculateLandmarkMeasuresButton.connect('clicked(bool)', self.onCalculateButtonClick)
+    self.sceneEndSaveObserverTag = slicer.mrmlScene.AddObserver(slicer.mrmlScene.EndSaveEvent, self.onSceneEndSave)
+    # Timed slots go through a lambda, as PythonQt would pass the timing wrapper the clicked(bool) argument too
+    self.reorientButton.connect('clicked(bool)', lambda checked: self.onReorientButtonClick())
+    self.recoverButton.connect('clicked(bool)',self.onRecoverButtonClick)
+    self.landmarksTable.connect('clicked(QModelIndex)',lambda index: self.onTableCellClicked(index.row(),index.column(),self.landmarksTable))
+    self.calculateLandmarkMeasuresButton.connect('clicked(bool)', lambda checked: self.onCalculateButtonClick())
+    self.liveMeasuresCheckBox.connect('toggled(bool)', self.onLiveMeasuresToggled)
+    self.liveMeasuresTimer.connect('timeout()', self.onLiveMeasuresTimeout)
+    self.normsPathLineEdit.connect('currentPathChanged(QString)', self.onNormsChanged)
+    self.ageLineEdit.connect('editingFinished()', self.onNormsChanged)
+    self.sexComboBox.connect('currentIndexChanged(int)', self.onNormsChanged)
+    self.sequenceBrowserSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onSequenceBrowserSelectorChange)
+    self.bindSequenceButton.connect('clicked(bool)', self.onBindSequenceButtonClick)
+    self.propagateButton.connect('clicked(bool)', self.onPropagateButtonClick)
+    self.calculateAllFramesButton.connect('clicked(bool)', self.onCalculateAllFramesButtonClick)
     self.FHLandmarksNodeSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onFHLandmarksNodeSelectorChange)
     self.landmarksNodeSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onLandmarksNodeSelectorChange)
     self.createCSVButton.connect('clicked(bool)', self.onCreateCSVButtonClick)
     self.addToCSVButton.connect('clicked(bool)', self.onAddToCSVButtonClick)
+    self.addToDatabaseButton.connect('clicked(bool)', self.onAddToDatabaseButtonClick)
+    self.exportDatabaseCSVButton.connect('clicked(bool)', self.onExportDatabaseCSVButtonClick)
+    self.cohortStatsButton.connect('clicked(bool)', self.onCohortStatsButtonClick)
+    self.timingCheckBox.connect('toggled(bool)', self.onTimingToggled)
+    self.profileCheckBox.connect('toggled(bool)', self.onProfileToggled)
+    self.refreshDiagnosticsButton.connect('clicked(bool)', self.onRefreshDiagnosticsButtonClick)
+    self.resetDiagnosticsButton.connect('clicked(bool)', self.onResetDiagnosticsButtonClick)
+    self.exportDiagnosticsButton.connect('clicked(bool)', self.onExportDiagnosticsButtonClick)
 
 
     '''
@@ -234,12 +426,12 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     interactionNode = slicer.app.applicationLogic().GetInteractionNode()
     interactionNode.SetCurrentInteractionMode(interactionNode.Place) # activate placement mode
     # Set the first cell as active and call as if clicked on
-    self.fhTable.setCurrentItem(self.fhTable.item(0,0))
+    self.fhTable.setCurrentIndex(self.fhTable.model().index(0,0))
     self.fhTable.setFocus() # not sure if this is needed
     '''
     # OR we could just
     self.onTableCellClicked(0,0,self.fhTable)
-    self.fhTable.setCurrentItem(self.fhTable.item(0,0))
+    self.fhTable.setCurrentIndex(self.fhTable.model().index(0,0))
     self.fhTable.setFocus() # not sure if this is needed
 
     self.onCTVolumeSelectorChange() # to initialize parameter node
@@ -276,9 +468,69 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     '''Runs whenever the module is closed or about to be reloaded'''
     #print('Running cleanup')  
     self.disableKeyboardShortcuts()
+    self.liveMeasuresTimer.stop()
+    self.worklistTimer.stop()
+    self.logic.closeWorklist()
+    self.removeLandmarksNodeObservers()
+    self.observeSequenceBrowser(None)
+    slicer.mrmlScene.RemoveObserver(self.sceneEndSaveObserverTag)
+    self.logic.cleanup()
+    self.logic.closeJournals()
+    self.logic.closeResultsDatabases()
     self.shortcutH.delete()
     self.shortcutM.delete()
 
+  def onWorklistPathChanged(self, path):
+    if not os.path.isfile(path):
+      return
+    try:
+      worklist = self.logic.loadWorklist(path)
+    except (OSError, ValueError) as e:
+      slicer.util.warningDisplay('Could not read worklist "%s": %s' % (path, e))
+      return
+    if not worklist.cases:
+      slicer.util.warningDisplay('There are no cases in worklist "%s"' % path)
+      self.logic.closeWorklist()
+      return
+    self.activateWorklistCase(0)
+    self.worklistTimer.start()
+
+  def onPreviousCaseButtonClick(self):
+    if self.logic.worklist is not None:
+      self.activateWorklistCase(self.logic.worklist.currentIndex - 1)
+
+  def onNextCaseButtonClick(self):
+    if self.logic.worklist is not None:
+      self.activateWorklistCase(self.logic.worklist.currentIndex + 1)
+
+  def onWorklistTimeout(self):
+    if self.logic.worklist is not None:
+      self.logic.worklist.loadReadyCases()
+
+  @timed()
+  def activateWorklistCase(self, index):
+    # Switch the selectors to a worklist case's nodes (already loaded, if it was prefetched)
+    worklist = self.logic.worklist
+    if worklist is None or not 0 <= index < len(worklist.cases):
+      return
+    try:
+      volNode, FHLandmarksNode, landmarksNode = worklist.goTo(index)
+    except Exception as e:
+      slicer.util.warningDisplay('Could not load case "%s": %s' % (worklist.cases[index].name, e))
+      return
+    # Selecting the nodes refills the tables
+    self.CTVolumeSelector.setCurrentNode(volNode)
+    self.FHLandmarksNodeSelector.setCurrentNode(FHLandmarksNode)
+    self.landmarksNodeSelector.setCurrentNode(landmarksNode)
+    # A case reoriented before is still under its own FH transform, so nothing needs redoing
+    slicer.util.setSliceViewerLayers(background=volNode, fit=True)
+    self.worklistStatusLabel.text = 'Case %d of %d: %s' % (index + 1, len(worklist.cases), worklist.currentCase.name)
+    self.previousCaseButton.enabled = index > 0
+    self.nextCaseButton.enabled = index < len(worklist.cases) - 1
+    # Carry on placing where this case was left off
+    if self.logic.selectNextUnfilledRow(self.fhTable) is None:
+      self.logic.selectNextUnfilledRow(self.landmarksTable)
+
   def onCTVolumeSelectorChange(self):
     # update parameter node 'vol_id'
     new_vol_node = self.CTVolumeSelector.currentNode()
@@ -286,6 +538,11 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
       self.parameterNode.SetParameter('vol_id','')
     else:
       self.parameterNode.SetParameter('vol_id', new_vol_node.GetID())
+      age, sex = self.logic.getPatientAgeAndSex(new_vol_node)
+      if age is not None:
+        self.ageLineEdit.text = '%0.1f' % age
+      if sex!='':
+        self.sexComboBox.setCurrentText(sex)
     # TODO also change this volume to the displayed background layer volume? Probably a good idea
 
   def onFHLandmarksNodeSelectorChange(self):
@@ -310,6 +567,136 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     self.logic.regularizeLandmarksNode(new_landmarks_node)
     self.landmarksNode = new_landmarks_node
     self.logic.updateLandmarkTableFromNode(self.landmarksTable, self.landmarksNode)
+    self.observeLandmarksNode(self.landmarksNode)
+    self.sequenceItemNumber = None
+
+  def observeLandmarksNode(self, landmarksNode):
+    # Watch the landmarks node for point changes so that the live measures follow them
+    self.removeLandmarksNodeObservers()
+    if landmarksNode is not None:
+      self.landmarksNodeObservations = [
+        (landmarksNode, landmarksNode.AddObserver(landmarksNode.PointModifiedEvent, self.onLandmarkPointModified)),
+        (landmarksNode, landmarksNode.AddObserver(landmarksNode.PointAddedEvent, self.onLandmarkPointAddedOrRemoved)),
+        (landmarksNode, landmarksNode.AddObserver(landmarksNode.PointRemovedEvent, self.onLandmarkPointAddedOrRemoved)),
+        (landmarksNode, landmarksNode.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.onLandmarkPointAddedOrRemoved)),
+      ]
+    self.scheduleLiveMeasuresUpdate(None)
+
+  def removeLandmarksNodeObservers(self):
+    for node, tag in self.landmarksNodeObservations:
+      node.RemoveObserver(tag)
+    self.landmarksNodeObservations = []
+
+  @vtk.calldata_type(vtk.VTK_INT)
+  def onLandmarkPointModified(self, caller, event, cpIdx):
+    # Fires for every mouse move while dragging, so only note which landmark changed
+    if cpIdx is None or cpIdx<0 or cpIdx>=caller.GetNumberOfControlPoints():
+      self.scheduleLiveMeasuresUpdate(None)
+    else:
+      self.scheduleLiveMeasuresUpdate(caller.GetNthControlPointLabel(cpIdx))
+
+  def onLandmarkPointAddedOrRemoved(self, caller, event):
+    # Indices shift when points are added or removed, and reorienting moves every point, so
+    # resync every landmark
+    self.scheduleLiveMeasuresUpdate(None)
+
+  def scheduleLiveMeasuresUpdate(self, landmarkLabel):
+    # Queue a changed landmark (None for all of them) for the next live measures update
+    if not self.liveMeasuresCheckBox.checked:
+      return
+    if landmarkLabel is None:
+      self.pendingMeasureLabels = None
+    elif self.pendingMeasureLabels is not None:
+      self.pendingMeasureLabels.add(landmarkLabel)
+    if not self.liveMeasuresTimer.isActive():
+      self.liveMeasuresTimer.start()
+
+  def onLiveMeasuresTimeout(self):
+    changedLabels = self.pendingMeasureLabels
+    self.pendingMeasureLabels = set()
+    if self.landmarksNode is None:
+      return
+    planeChanged = self.logic.update_midsagittal_plane(self.landmarksNode, changedLabels)
+    landmarksSequence = self.getLandmarksSequence()
+    if landmarksSequence is not None:
+      # 4D, the current frame's measures come from the per-frame cache, which is only
+      # recomputed if this frame's landmarks have changed
+      frame = self.sequenceBrowserNode.GetSelectedItemNumber()
+      self.showMeasureResults(self.logic.calculate_sequence_measures(landmarksSequence, self.landmarksNode, frames=[frame]))
+      return
+    recomputed = self.logic.update_measures(self.landmarksNode, changedLabels)
+    if len(recomputed)==0 and not planeChanged:
+      return # only landmarks which neither the measures nor the mid-sagittal plane use changed
+    self.showMeasureResults(self.logic.get_live_measure_results(self.landmarksNode))
+
+  def onLiveMeasuresToggled(self, checked):
+    if checked:
+      self.scheduleLiveMeasuresUpdate(None) # catch up on anything missed while off
+
+  def onSequenceBrowserSelectorChange(self):
+    self.observeSequenceBrowser(self.sequenceBrowserSelector.currentNode())
+    self.scheduleLiveMeasuresUpdate(None)
+
+  def observeSequenceBrowser(self, browserNode):
+    # Follow frame changes of the 4D sequence browser
+    if self.sequenceBrowserObservation is not None:
+      node, tag = self.sequenceBrowserObservation
+      node.RemoveObserver(tag)
+      self.sequenceBrowserObservation = None
+    self.sequenceBrowserNode = browserNode
+    self.sequenceItemNumber = None
+    if browserNode is not None:
+      tag = browserNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onSequenceBrowserModified)
+      self.sequenceBrowserObservation = (browserNode, tag)
+      self.sequenceItemNumber = browserNode.GetSelectedItemNumber()
+
+  def getLandmarksSequence(self):
+    # The sequence holding the per-frame landmarks, or None if not in 4D mode
+    return self.logic.getLandmarksSequence(self.sequenceBrowserNode, self.landmarksNode)
+
+  def onSequenceBrowserModified(self, caller, event):
+    itemNumber = caller.GetSelectedItemNumber()
+    if itemNumber==self.sequenceItemNumber:
+      return
+    self.sequenceItemNumber = itemNumber
+    if self.getLandmarksSequence() is not None:
+      # The landmarks node now shows this frame's points
+      self.logic.updateLandmarkTableFromNode(self.landmarksTable, self.landmarksNode)
+      self.scheduleLiveMeasuresUpdate(None)
+
+  def onBindSequenceButtonClick(self):
+    if self.sequenceBrowserNode is None or self.landmarksNode is None:
+      slicer.util.warningDisplay('Select a sequence browser and a landmarks node first!')
+      return
+    self.logic.bindLandmarksToSequence(self.sequenceBrowserNode, self.landmarksNode)
+    self.logic.updateLandmarkTableFromNode(self.landmarksTable, self.landmarksNode)
+    self.scheduleLiveMeasuresUpdate(None)
+
+  def onPropagateButtonClick(self):
+    if self.getLandmarksSequence() is None:
+      slicer.util.warningDisplay('Bind the landmarks to a sequence first!')
+      return
+    try:
+      proposed = self.logic.propagateLandmarksToNextFrame(self.sequenceBrowserNode, self.landmarksNode, self.CTVolumeSelector.currentNode())
+    except ValueError as e:
+      slicer.util.warningDisplay(str(e))
+      return
+    message = 'Proposed %d landmarks on the next frame, check them before locking' % len(proposed)
+    logging.info(message)
+    slicer.util.showStatusMessage(message, 5000)
+    self.logic.updateLandmarkTableFromNode(self.landmarksTable, self.landmarksNode)
+    self.logic.selectNextUnfilledRow(self.landmarksTable)
+    self.scheduleLiveMeasuresUpdate(None)
+
+  def onCalculateAllFramesButtonClick(self):
+    landmarksSequence = self.getLandmarksSequence()
+    if landmarksSequence is None:
+      slicer.util.warningDisplay('Bind the landmarks to a sequence first!')
+      return
+    results = self.logic.calculate_sequence_measures(landmarksSequence, self.landmarksNode)
+    self.measuresText.setText(results.series_report_str())
+    self.parameterNode.SetParameter('report_str', results.series_report_str())
+    self.parameterNode.SetParameter('measure_results', results.to_json())
 
   def enableKeyboardShortcuts(self):
     '''Connect 'h' to show/hide landmarks and 'm' to toggle fiducial placement mode'''
@@ -346,76 +733,150 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
   def onQKeyPressed(self):
     print('Q pressed!')
 
+  @timed()
   def onCalculateButtonClick(self):
     # Triggers calculation of landmark measures given current landmark positions
-    report_str = self.logic.calculate_measures(self.landmarksNode)
+    self.logic.update_midsagittal_plane(self.landmarksNode)
+    self.showMeasureResults(self.logic.calculate_measure_results(self.landmarksNode), sampleIntensities=True)
+
+  def onNormsChanged(self, *args):
+    self.scheduleLiveMeasuresUpdate(None) # rescore
+
+  def getPatientAge(self):
+    # Age entered in years, or NaN if blank or not a number
+    try:
+      return float(self.ageLineEdit.text)
+    except ValueError:
+      return np.nan
+
+  def showMeasureResults(self, results, sampleIntensities=False):
+    # Display measures in the measures panel and keep them for the export buttons.  The image
+    # intensities at the landmarks are only sampled when asked for (on Calculate), never on
+    # live updates, which must stay cheap
+    self.logic.add_normative_scores(results, self.normsPathLineEdit.currentPath,
+      [self.getPatientAge()]*len(results), [self.sexComboBox.currentText]*len(results))
+    if sampleIntensities and self.CTVolumeSelector.currentNode() is not None:
+      self.logic.add_landmark_intensities(results, self.landmarksNode, self.CTVolumeSelector.currentNode())
+    report_str = results.report_str()
+    if self.landmarksNode is not None:
+      report_str += self.logic.getMidSagittalPlaneFit(self.landmarksNode).report_str()
     self.measuresText.setText(report_str)
     self.parameterNode.SetParameter('report_str', report_str)
+    self.parameterNode.SetParameter('measure_results', results.to_json())
+
+  def getMeasureResults(self):
+    # The most recently calculated measures (kept in the parameter node), or None
+    results_json = self.parameterNode.GetParameter('measure_results')
+    if results_json=='':
+      slicer.util.warningDisplay('Calculate landmark measures first!')
+      return None
+    return MeasureResults.from_json(results_json)
+
+  def getResultsVolumeNames(self, results):
+    # Volume name for each case in results, with the frame added for 4D results
+    vol_id = self.parameterNode.GetParameter('vol_id')
+    try:
+      vol_name = slicer.util.getNode(vol_id).GetName()
+    except slicer.util.MRMLNodeNotFoundException:
+      vol_name = 'NoneSelected'
+    if len(results)==1:
+      return [vol_name]
+    return ['%s %s' % (vol_name, case_name) for case_name in results.case_names]
 
   def onCreateCSVButtonClick(self):
     # Button clicked to create new csv file
     csvPathAndName = qt.QFileDialog().getSaveFileName() 
     if csvPathAndName != '':
-      report_str = self.parameterNode.GetParameter('report_str')
-      vol_id = self.parameterNode.GetParameter('vol_id')
-      try:
-        vol_name = slicer.util.getNode(vol_id).GetName()
-      except slicer.util.MRMLNodeNotFoundException:
-        vol_name = 'NoneSelected'
-      self.logic.create_csv(csvPathAndName, report_str, vol_name)
+      results = self.getMeasureResults()
+      if results is None:
+        return
+      self.logic.create_csv(csvPathAndName, results, self.getResultsVolumeNames(results))
 
   def onAddToCSVButtonClick(self):
     # Button clicked to add line to existing csv file
     csvPathAndName = qt.QFileDialog().getOpenFileName()
     if csvPathAndName != '':
-      report_str = self.parameterNode.GetParameter('report_str')
-      vol_id = self.parameterNode.GetParameter('vol_id')
-      try:
-        vol_name = slicer.util.getNode(vol_id).GetName()
-      except slicer.util.MRMLNodeNotFoundException:
-        vol_name = 'NoneSelected'
-      self.logic.add_to_csv(csvPathAndName, report_str, vol_name)
+      results = self.getMeasureResults()
+      if results is None:
+        return
+      self.logic.add_to_csv(csvPathAndName, results, self.getResultsVolumeNames(results))
+
+  def onAddToDatabaseButtonClick(self):
+    databasePath = self.databasePathLineEdit.currentPath
+    if databasePath=='':
+      slicer.util.warningDisplay('Choose a results database file first!')
+      return
+    results = self.getMeasureResults()
+    if results is None:
+      return
+    landmarks = None
+    notes = None
+    if len(results)==1:
+      positions = self.logic.getLandmarkPositions(self.FHLandmarksNode)
+      positions.update(self.logic.getLandmarkPositions(self.landmarksNode))
+      landmarks = [positions]
+    else:
+      notes = results.case_names # frames of a 4D series, whose landmarks are not all in the current nodes
+    measurementIds = self.logic.add_to_database(databasePath, results, self.getResultsVolumeNames(results),
+      annotator=self.annotatorLineEdit.text, landmarks=landmarks, notes=notes)
+    if measurementIds is not None:
+      logging.info('Added %d measurement(s) to "%s"' % (len(measurementIds), databasePath))
+
+  def onExportDatabaseCSVButtonClick(self):
+    databasePath = self.databasePathLineEdit.currentPath
+    if not os.path.isfile(databasePath):
+      slicer.util.warningDisplay('Choose an existing results database file first!')
+      return
+    csvPathAndName = qt.QFileDialog().getSaveFileName()
+    if csvPathAndName != '':
+      nVolumes = self.logic.export_database_csv(databasePath, csvPathAndName)
+      if nVolumes is not None:
+        logging.info('Wrote the latest measures of %d volume(s) to "%s"' % (nVolumes, csvPathAndName))
+
+  def onCohortStatsButtonClick(self):
+    csvPathsAndNames = qt.QFileDialog.getOpenFileNames(None, 'Results CSV files', '', 'CSV files (*.csv)')
+    if len(csvPathsAndNames)==0:
+      return
+    statistics = self.logic.summarize_results_csvs(csvPathsAndNames, self.cohortGroupByLineEdit.text.strip())
+    if statistics is not None:
+      self.cohortStatsText.setText(statistics.report_str())
+
+  def onTimingToggled(self, checked):
+    CALL_TIMINGS.enabled = checked
+
+  def onProfileToggled(self, checked):
+    CALL_TIMINGS.set_profiling(checked)
+
+  def onRefreshDiagnosticsButtonClick(self):
+    self.diagnosticsText.setText(CALL_TIMINGS.report_str())
+
+  def onResetDiagnosticsButtonClick(self):
+    CALL_TIMINGS.reset()
+    self.onRefreshDiagnosticsButtonClick()
+
+  def onExportDiagnosticsButtonClick(self):
+    jsonPathAndName = qt.QFileDialog().getSaveFileName()
+    if jsonPathAndName != '':
+      if not jsonPathAndName.endswith('.json'):
+        jsonPathAndName += '.json'
+      CALL_TIMINGS.write_json(jsonPathAndName)
 
   def buildLandmarkTable(self,landmarkStringsList, mid_sag_bool_dict={}, include_sag_col=False):
-    table = qt.QTableWidget()
-    rowCount = len(landmarkStringsList)
-    table.setRowCount(rowCount)
-    if include_sag_col:
-      colHeaders = ['Landmark','Mid-Sag','R','A','S','Reset']
-    else:
-      colHeaders = ['Landmark','R','A','S','Reset']
-    colCount = len(colHeaders)
-    table.setColumnCount(colCount)
-    table.setHorizontalHeaderLabels(colHeaders)
-    for row in range(rowCount):
-      landmarkName = landmarkStringsList[row]
-      for col in range(colCount):
-        cell = qt.QTableWidgetItem()
-        table.setItem(row,col,cell)
-        if col==0:
-          cell.setText(landmarkName)
-          cell.setFlags(qt.Qt.ItemIsSelectable + qt.Qt.ItemIsEnabled) # enabled and selectable, but not editable (41 would allow drop onto)
-        elif include_sag_col and col==1:
-          # sag col
-          forceMidSag = mid_sag_bool_dict[landmarkName]
-          if forceMidSag:
-            cell.setCheckState(qt.Qt.Checked)
-          else:
-            cell.setCheckState(qt.Qt.Unchecked)
-          cell.setFlags(qt.Qt.ItemIsEnabled) # could also do qt.Qt.ItemIsUserCheckable + qt.Qt.ItemIsEnable
-        elif col==colCount-1:
-          # Last column is reset column
-          cell.setText('[X]')
-          cell.setFlags(qt.Qt.ItemIsSelectable + qt.Qt.ItemIsEnabled)
-        else:
-          # Other columns (RAS)
-          cell.setFlags(qt.Qt.ItemIsSelectable + qt.Qt.ItemIsEnabled)#qt.Qt.NoItemFlags) 
+    # A table view over a LandmarkTableModel, which only formats the cells of visible rows
+    midSagBools = [mid_sag_bool_dict[name] for name in landmarkStringsList] if include_sag_col else None
+    model = LandmarkTableModel(landmarkStringsList, midSagBools)
+    self.tableModels.append(model)
+    table = qt.QTableView()
+    table.setModel(model)
+    table.verticalHeader().setSectionResizeMode(qt.QHeaderView.Fixed) # every row the same height, no per-row measuring
     return table
 
 
     
+  @timed()
   def onTableCellClicked(self,row,col,table):
-    landmarkName = table.item(row,0).text()
+    model = table.model()
+    landmarkName = model.landmarkName(row)
     self.tempLandmarkNode.SetMarkupLabelFormat(landmarkName)
     if table == self.fhTable:
       self.currentRealLandmarksNode = self.FHLandmarksNode
@@ -428,21 +889,40 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     interactionNode = slicer.app.applicationLogic().GetInteractionNode()
     interactionNode.SetCurrentInteractionMode(interactionNode.Place) # activate placement mode
     interactionNode.SwitchToPersistentPlaceMode() # make it persistent
+    # Mid-sag landmark, jump the sagittal view to the mid-sagittal plane
+    if table == self.landmarksTable and col!=model.resetColumn and model.isMidSag(row):
+      self.jumpToMidSagittalPlane()
     # If reset clicked, do the reset
-    if col==(table.columnCount-1):
-      # Remove existing coordinates from real landmark node
-      for cpIdx in range(self.currentRealLandmarksNode.GetNumberOfControlPoints()):
-        label = self.currentRealLandmarksNode.GetNthControlPointLabel(cpIdx)
-        if label==landmarkName:
-          print('Resetting '+landmarkName)
-          self.currentRealLandmarksNode.RemoveNthControlPoint(cpIdx)
-          # Clear out table coordinates
-          self.logic.updateLandmarkTableEntry(table, landmarkName, landmarkPosition=None)
+    if col==model.resetColumn:
+      # Remove existing coordinates from real landmark node (every copy, in case of duplicates)
+      cpIdx = self.logic.getControlPointIndex(self.currentRealLandmarksNode, landmarkName)
+      while cpIdx is not None:
+        print('Resetting '+landmarkName)
+        self.currentRealLandmarksNode.RemoveNthControlPoint(cpIdx)
+        self.journalLandmark(self.currentRealLandmarksNode, landmarkName, None)
+        # Clear out table coordinates
+        self.logic.updateLandmarkTableEntry(table, landmarkName, landmarkPosition=None)
+        cpIdx = self.logic.getControlPointIndex(self.currentRealLandmarksNode, landmarkName)
 
 
     
 
 
+  def jumpToMidSagittalPlane(self):
+    if self.landmarksNode is None:
+      return
+    if not self.liveMeasuresCheckBox.checked:
+      self.logic.update_midsagittal_plane(self.landmarksNode) # not being kept up to date, catch up
+    plane = self.logic.getMidSagittalPlaneFit(self.landmarksNode).plane
+    if plane is None:
+      message = 'Place more mid-sagittal or bilateral landmarks to fit the mid-sagittal plane'
+      logging.info(message)
+      slicer.util.showStatusMessage(message, 5000)
+      return
+    sliceNode = slicer.app.layoutManager().sliceWidget('Yellow').mrmlSliceNode()
+    self.logic.jumpSliceToPlane(sliceNode, *plane)
+
+  @timed()
   def onLandmarkClick(self,caller,event):
     # event is NoEvent
     # Caller is the temp landmark node, I believe
@@ -456,17 +936,16 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     # Get the temp control point position
     pos = [0]*3
     tempNode.GetNthControlPointPositionWorld(0,pos)
+    snapMode = self.snapModeComboBox.currentText.lower()
+    if snapMode!='off':
+      pos = self.logic.snapToImageFeature(self.CTVolumeSelector.currentNode(), pos, self.snapRadiusSpinBox.value, snapMode)
     realNode = self.currentRealLandmarksNode
     
     # Get the landmark name
     landmarkName = tempNode.GetNthControlPointLabel(0)
     print('Landmark name: '+landmarkName)
     # Check if the real landmark node already has a control point with this name
-    replaceCpIdx = None
-    for cpIdx in range(realNode.GetNumberOfControlPoints()):
-      cpLabel = realNode.GetNthControlPointLabel(cpIdx)
-      if cpLabel==landmarkName:
-        replaceCpIdx = cpIdx # replace this one
+    replaceCpIdx = self.logic.getControlPointIndex(realNode, landmarkName)
     if replaceCpIdx is not None:
       realNode.SetNthControlPointPositionWorld(replaceCpIdx, *pos)
       cpIdx = replaceCpIdx
@@ -476,6 +955,9 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
       realNode.SetNthControlPointLabel(cpIdx, landmarkName)
     # Either way, lock the point so you don't accidentally move it with the mouse
     realNode.SetNthControlPointLocked(cpIdx, True)
+    localPos = [0]*3
+    realNode.GetNthControlPointPosition(cpIdx, localPos)
+    self.journalLandmark(realNode, landmarkName, localPos)
     # Update the landmark table with the position
     successFH = self.logic.updateLandmarkTableEntry(self.fhTable, landmarkName, pos)
     if not successFH:
@@ -500,60 +982,64 @@ class AirwayLandmarksWidget(ScriptedLoadableModuleWidget):
     #print(caller)
     #print(event)
 
+  def journalLandmark(self, markupsNode, landmarkName, localPos):
+    # Record a placement (or a reset, if localPos is None) in the current volume's journal
+    volNode = self.CTVolumeSelector.currentNode()
+    if volNode is None:
+      return
+    nodeRole = 'FH' if markupsNode == self.FHLandmarksNode else 'landmarks'
+    journal = self.logic.getJournal(volNode)
+    if localPos is None:
+      journal.reset(nodeRole, landmarkName)
+    else:
+      journal.place(nodeRole, landmarkName, localPos)
+
+  def onSceneEndSave(self, caller, event):
+    # Once the current FH and airway landmarks have been saved their journal has nothing left to recover
+    volNode = self.CTVolumeSelector.currentNode()
+    markupsNodes = [node for node in (self.FHLandmarksNode, self.landmarksNode) if node is not None]
+    if volNode is None or not markupsNodes:
+      return
+    if all(node.GetStorageNode() is not None and not node.GetModifiedSinceRead() for node in markupsNodes):
+      self.logic.truncateJournal(volNode)
+
+  def onRecoverButtonClick(self):
+    volNode = self.CTVolumeSelector.currentNode()
+    if volNode is None:
+      slicer.util.warningDisplay('Select the CT volume to recover the landmarks of first!')
+      return
+    recovered = self.logic.recoverFromJournal(volNode)
+    if recovered is None:
+      slicer.util.warningDisplay('There is no placement journal for "%s"' % volNode.GetName())
+      return
+    FHLandmarksNode, landmarksNode, reoriented = recovered
+    # Selecting the new nodes refills the tables
+    self.FHLandmarksNodeSelector.setCurrentNode(FHLandmarksNode)
+    self.landmarksNodeSelector.setCurrentNode(landmarksNode)
+    if reoriented:
+      self.onReorientButtonClick()
+
+  @timed()
   def onReorientButtonClick(self):
     # User clicked FH reorient button, do the reorientation
-    # Tricky part is handling what should happen with all existing lanmarks
-    # I think what should happen is a hardened transform of them into new FH image space
-    # This will keep them synchronized with the image even if FH reorientation is done repeatedly
-    # TODO: In terms of the FH transform, we want that to represent the transform from the ORIGINAL orientation
-    # (from DICOM or from initial load), so that needs to be made cumulative somehow, not just reflecting
-    # the most recent FH reorientation
+    # The volume and all the landmarks nodes sit under one cumulative FH transform from the
+    # ORIGINAL image space (from DICOM or from initial load), which is recalculated from the
+    # FH points each time, so repeated reorientation neither adds nodes nor accumulates round-off
     print('Reorienting...')
-    points_FH_Transform = make_FH_transform(self.FHLandmarksNode)
-    # Apply transform to the CT volume
     volNode = self.CTVolumeSelector.currentNode()
     if volNode is None:
       raise Exception('No CT volume selected')
-
     try:
-      volTransform = slicer.util.getNode('volume_FH_Transform')
-    except slicer.util.MRMLNodeNotFoundException:
-      volTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode','volume_FH_Transform')
-
-    if volNode.GetTransformNodeID() is None:
-      # No existing transform, just use the new one
-      matrix = vtk.vtkMatrix4x4()
-      points_FH_Transform.GetMatrixTransformToParent(matrix)
-      volTransform.SetMatrixTransformToParent(matrix)
-    else:
-      #need to compose old and new transforms
-      oldVolTransform = slicer.util.getNode(volNode.GetTransformNodeID())
-      oldTransformMatrix = vtk.vtkMatrix4x4()
-      oldVolTransform.GetMatrixTransformToParent(oldTransformMatrix)
-      newTransformMatrix = vtk.vtkMatrix4x4()
-      points_FH_Transform.GetMatrixTransformToParent(newTransformMatrix)
-      combinedTransformMatrix = vtk.vtkMatrix4x4()
-      vtk.vtkMatrix4x4().Multiply4x4(oldTransformMatrix, newTransformMatrix, combinedTransformMatrix)
-      volTransform.SetMatrixTransformToParent(combinedTransformMatrix)
-    volNode.SetAndObserveTransformNodeID(volTransform.GetID())
-
-    # Apply points transform to all existing landmarks so that they move with the volume
-    self.FHLandmarksNode.SetAndObserveTransformNodeID(points_FH_Transform.GetID())
-    self.landmarksNode.SetAndObserveTransformNodeID(points_FH_Transform.GetID())
-    # Harden to make change permanent
-    slicer.vtkSlicerTransformLogic().hardenTransform(self.FHLandmarksNode)
-    slicer.vtkSlicerTransformLogic().hardenTransform(self.landmarksNode)
-    # Update the tables 
-    for cpIdx in range(self.FHLandmarksNode.GetNumberOfControlPoints()):
-      landmarkName = self.FHLandmarksNode.GetNthControlPointLabel(cpIdx)
-      newPos = [0]*3
-      self.FHLandmarksNode.GetNthControlPointPositionWorld(cpIdx,newPos)
-      self.logic.updateLandmarkTableEntry(self.fhTable, landmarkName, newPos)
-    for cpIdx in range(self.landmarksNode.GetNumberOfControlPoints()):
-      landmarkName = self.landmarksNode.GetNthControlPointLabel(cpIdx)
-      newPos = [0]*3
-      self.landmarksNode.GetNthControlPointPositionWorld(cpIdx,newPos)
-      self.logic.updateLandmarkTableEntry(self.landmarksTable, landmarkName, newPos)
+      changed = self.logic.reorientToFH(volNode, self.FHLandmarksNode, [self.landmarksNode])
+    except ValueError as e:
+      slicer.util.warningDisplay(str(e))
+      return
+    if not changed:
+      return # FH points have not moved since the last reorientation
+    self.logic.getJournal(volNode).reorient()
+    # Update the tables, one batched refresh each
+    self.logic.updateLandmarkTableEntries(self.fhTable, self.logic.getLandmarkPositions(self.FHLandmarksNode))
+    self.logic.updateLandmarkTableEntries(self.landmarksTable, self.logic.getLandmarkPositions(self.landmarksNode))
 
  
   '''
@@ -584,6 +1070,62 @@ class AirwayLandmarksLogic(ScriptedLoadableModuleLogic):
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
+  def __init__(self):
+    ScriptedLoadableModuleLogic.__init__(self)
+    self.controlPointLabelIndexes = {} # markups node -> ControlPointLabelIndex
+    self.resultsStores = {} # csv filename -> ResultsCSVStore
+    self.resultsDatabases = {} # database filename -> ResultsDatabase
+    self.incrementalMeasures = {} # landmarks node -> IncrementalMeasures
+    self.midSagittalFits = {} # landmarks node -> MidSagittalPlaneFit
+    self.maxVisibleTableRows = 40 # taller landmark tables scroll
+    self.journals = {} # journal filename -> PlacementJournal
+    self.normativeTable = None # ((filename, modified time), NormativeTable)
+    self.sequenceMeasureCache = {} # landmarks sequence ID -> {frame: (cache key, values, available)}
+    self.worklist = None # CaseWorklist
+    self.worklistCacheSize = 3 # cases whose nodes are kept loaded (current, previous and next)
+    # Per-node caches are dropped as soon as their node leaves the scene (e.g. a worklist case is evicted)
+    self.sceneObserverTag = slicer.mrmlScene.AddObserver(slicer.mrmlScene.NodeRemovedEvent, self.onNodeRemoved)
+
+  def cleanup(self):
+    # Stop observing the scene and all markups nodes
+    slicer.mrmlScene.RemoveObserver(self.sceneObserverTag)
+    self.clearControlPointLabelIndexes()
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, event, node):
+    self.forgetNode(node)
+
+  def forgetNode(self, node):
+    # Drop everything cached for a node (its label lookup, live measures and mid-sagittal fit, sequence measures)
+    labelIndex = self.controlPointLabelIndexes.pop(node, None)
+    if labelIndex is not None:
+      labelIndex.removeObservers()
+    self.incrementalMeasures.pop(node, None)
+    self.midSagittalFits.pop(node, None)
+    if node is not None:
+      self.sequenceMeasureCache.pop(node.GetID(), None)
+
+  def getControlPointLabelIndex(self, markupsNode):
+    # Get (creating if needed) the cached label to control point index lookup for this node
+    labelIndex = self.controlPointLabelIndexes.get(markupsNode)
+    if labelIndex is None:
+      labelIndex = ControlPointLabelIndex(markupsNode)
+      self.controlPointLabelIndexes[markupsNode] = labelIndex
+    return labelIndex
+
+  def getControlPointIndex(self, markupsNode, label):
+    '''Return the index of the control point with the given label in markupsNode, or None if
+    there is no such point (or no node).  If several points share the label, the last one wins.'''
+    if markupsNode is None:
+      return None
+    return self.getControlPointLabelIndex(markupsNode).indexOf(label)
+
+  def clearControlPointLabelIndexes(self):
+    # Stop observing all markups nodes and drop the cached lookups
+    for labelIndex in self.controlPointLabelIndexes.values():
+      labelIndex.removeObservers()
+    self.controlPointLabelIndexes = {}
+
   def setMarkupScales(self, markups_node, glyphScale=2, textScale=2):
     markups_node.GetDisplayNode().SetGlyphScale(glyphScale)
     markups_node.GetDisplayNode().SetTextScale(textScale)
@@ -599,254 +1141,620 @@ class AirwayLandmarksLogic(ScriptedLoadableModuleLogic):
       elif label=='Epigottis (superior tip)':
         landmarksNode.SetNthControlPointLabel(cpIdx, 'Epiglottis (superior tip)')
 
+  def volumeIdentity(self, volNode):
+    # What identifies a volume across sessions: the file it was loaded from, else its DICOM instance UIDs, else its name
+    storageNode = volNode.GetStorageNode()
+    source = storageNode.GetFileName() if storageNode is not None and storageNode.GetFileName() else volNode.GetAttribute('DICOM.instanceUIDs')
+    return {'volume': volNode.GetName(), 'source': source or ''}
+
+  def journalFilename(self, volNode):
+    # Placement journal file of a volume, kept in the Slicer temporary directory; volumes of the
+    # same name loaded from different files get different journals
+    identity = self.volumeIdentity(volNode)
+    safeName = re.sub(r'[^\w.-]', '_', identity['volume'])
+    sourceHash = hashlib.sha1(identity['source'].encode('utf-8')).hexdigest()[:10]
+    return os.path.join(slicer.app.temporaryPath, 'AirwayLandmarksJournals', '%s_%s.jsonl' % (safeName, sourceHash))
+
+  def getJournal(self, volNode):
+    filename = self.journalFilename(volNode)
+    journal = self.journals.get(filename)
+    if journal is None:
+      journal = PlacementJournal(filename, identity=self.volumeIdentity(volNode))
+      self.journals[filename] = journal
+    return journal
+
+  def truncateJournal(self, volNode):
+    # The volume's landmarks have been saved, so its journal has nothing left to recover
+    filename = self.journalFilename(volNode)
+    if filename in self.journals:
+      self.journals[filename].truncate()
+    elif os.path.exists(filename):
+      open(filename, mode='w').close()
+
+  def closeJournals(self):
+    # Finish writing and close all open journals
+    for journal in self.journals.values():
+      journal.close()
+    self.journals = {}
+
+  def recoverFromJournal(self, volNode):
+    '''Replay the last session of the placement journal of volNode onto new FH and landmark
+    nodes.  Returns (FH node, landmarks node, whether the landmarks had been reoriented), or
+    None if there is nothing to recover for this volume.  The new nodes go under the volume's
+    transform, if any, so if the volume has not been reoriented (e.g. it was reloaded after a
+    crash) the reorientation needs redoing.'''
+    filename = self.journalFilename(volNode)
+    if filename in self.journals:
+      self.journals[filename].flush()
+    records = read_journal(filename)
+    identity, sessionRecords = last_session(records)
+    if not sessionRecords or (identity is not None and identity!=self.volumeIdentity(volNode)):
+      return None
+    positions, reoriented = replay_journal(records)
+    newNodes = []
+    for nodeRole, nodeName in (('FH', 'FH_Landmarks'), ('landmarks', 'Airway_Landmarks')):
+      markupsNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', slicer.mrmlScene.GenerateUniqueName(nodeName+'_Recovered'))
+      # Journal positions are local coordinates, i.e. in the same space as the volume under any FH transform
+      markupsNode.SetAndObserveTransformNodeID(volNode.GetTransformNodeID())
+      wasModifying = markupsNode.StartModify()
+      for label, pos in positions.get(nodeRole, {}).items():
+        cpIdx = markupsNode.AddControlPoint(vtk.vtkVector3d(*pos))
+        markupsNode.SetNthControlPointLabel(cpIdx, label)
+        markupsNode.SetNthControlPointLocked(cpIdx, True)
+      markupsNode.EndModify(wasModifying)
+      newNodes.append(markupsNode)
+    return newNodes[0], newNodes[1], reoriented
+
+  def loadWorklist(self, filename):
+    # Replace the current worklist (saving its current case) with the cases in a worklist CSV file
+    self.closeWorklist()
+    self.worklist = CaseWorklist(read_worklist(filename), capacity=self.worklistCacheSize, saved=self.truncateJournal)
+    return self.worklist
+
+  def closeWorklist(self):
+    if self.worklist is not None:
+      self.worklist.close()
+      self.worklist = None
+
+  def getFHTransformNode(self, volNode):
+    '''The cumulative FH transform (original image space -> FH space) of one volume, created on
+    first use.  Every volume has its own, so reorienting one case never moves another case's
+    volume or landmarks, and a markups node attached to it is only ever put in this volume's
+    frame.  A volume left under a (shared) FH transform by an older version adopts that one.
+    A volume under a linear transform without an FH points hash, such as the shared
+    volume_FH_Transform of the versions which hardened the landmarks into FH space, gets its
+    own transform starting from that one's matrix: the volume stays where it is, and the
+    hardened landmarks are mapped back to image space when they are attached to it.'''
+    transformNode = volNode.GetNodeReference(FH_TRANSFORM_REFERENCE_ROLE)
+    if transformNode is None:
+      parentNode = volNode.GetParentTransformNode()
+      if parentNode is not None and parentNode.GetAttribute('AirwayLandmarks.FHPointsHash') is not None:
+        transformNode = parentNode
+      else:
+        transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode',
+          slicer.mrmlScene.GenerateUniqueName(volNode.GetName()+'_FH_Transform'))
+        if parentNode is not None and parentNode.IsLinear():
+          matrix = vtk.vtkMatrix4x4()
+          parentNode.GetMatrixTransformToWorld(matrix)
+          transformNode.SetMatrixTransformToParent(matrix)
+          volNode.SetAndObserveTransformNodeID(transformNode.GetID())
+      volNode.SetNodeReferenceID(FH_TRANSFORM_REFERENCE_ROLE, transformNode.GetID())
+    return transformNode
+
+  def attachToTransform(self, markupsNode, transformNode):
+    # Put a markups node under transformNode without moving its points in world space (so
+    # landmarks hardened by older versions of this module are carried over correctly)
+    if markupsNode is None or markupsNode.GetTransformNodeID()==transformNode.GetID():
+      return
+    worldPositions = []
+    for cpIdx in range(markupsNode.GetNumberOfControlPoints()):
+      pos = [0]*3
+      markupsNode.GetNthControlPointPositionWorld(cpIdx, pos)
+      worldPositions.append(pos)
+    markupsNode.SetAndObserveTransformNodeID(transformNode.GetID())
+    for cpIdx, pos in enumerate(worldPositions):
+      markupsNode.SetNthControlPointPositionWorld(cpIdx, *pos)
+
+  def reorientToFH(self, volNode, FHLandmarksNode, landmarksNodes):
+    '''Reorient the volume and landmarks to Frankfurt Horizontal. Everything is placed under
+    the volume's own FH transform, whose matrix is computed from the FH points in original image
+    space, so nothing is hardened and no new nodes are made.  Does nothing if the FH points are
+    unchanged since the last reorientation.  Returns True if the transform was updated.
+    Raises ValueError if the FH points cannot define a plane.'''
+    if FHLandmarksNode is None:
+      raise ValueError('No FH points node selected')
+    fhTransform = self.getFHTransformNode(volNode)
+    for node in [FHLandmarksNode] + list(landmarksNodes):
+      self.attachToTransform(node, fhTransform)
+    # Local control point coordinates are now in original image space
+    fhPointsHash = self.hashControlPoints(FHLandmarksNode)
+    alreadyApplied = (volNode.GetTransformNodeID()==fhTransform.GetID()
+      and fhTransform.GetAttribute('AirwayLandmarks.FHPointsHash')==fhPointsHash)
+    if alreadyApplied:
+      return False
+    make_FH_transform(FHLandmarksNode, fhTransform)
+    fhTransform.SetAttribute('AirwayLandmarks.FHPointsHash', fhPointsHash)
+    volNode.SetAndObserveTransformNodeID(fhTransform.GetID())
+    return True
+
+  def hashControlPoints(self, markupsNode):
+    # Hash of a markups node's local control point coordinates, to tell if any point has moved
+    positions = np.zeros((markupsNode.GetNumberOfControlPoints(), 3))
+    for cpIdx in range(markupsNode.GetNumberOfControlPoints()):
+      pos = [0]*3
+      markupsNode.GetNthControlPointPosition(cpIdx, pos)
+      positions[cpIdx] = pos
+    return hashlib.sha1(positions.tobytes()).hexdigest()
+
   def calculate_measures(self, landmarks_node):
     '''Calculate all possible airway measures.  If a needed landmark point is missing, just
     report Not Available in the result'''
-    def get_landmark(landmark_name):
-      # find landmark with given name in landmarks node, or return None if not found
-      N = landmarks_node.GetNumberOfControlPoints()
-      found = False
-      for idx in range(N):
-        cur_name = landmarks_node.GetNthControlPointLabel(idx)
-        if cur_name==landmark_name:
-          found = True
-          pos = [0]*3
-          landmarks_node.GetNthControlPointPositionWorld(idx,pos)
-      if found:
-        return pos
-      else: 
-        logging.info('Landmark "%s" not found!!' % (landmark_name))
-        return None
-    tongue_superior = get_landmark('Tongue (superior aspect)')
-    tongue_anterior = get_landmark('Tongue (anterior aspect)')
-    vallecula = get_landmark('Vallecula (inferior aspect)')
-    ans = get_landmark('Anterior Nasal Spine')
-    hyoid = get_landmark('Hyoid (central point)')
-    c2 = get_landmark('C2 (anterior inferior aspect)')
-    c3 = get_landmark('C3 (anterior aspect)')
-    pog = get_landmark('Pogonion')
-    nasion = get_landmark('Nasion')
-    basion = get_landmark('Basion')
-    left_condylion = get_landmark('Left condylion')
-    left_gonion = get_landmark('Left gonion')
-    right_condylion = get_landmark('Right condylion')
-    right_gonion = get_landmark('Right gonion')
-
-    R=0
-    A=1
-    S=2
-
-    report_str = ''
-    def make_report_line(measure_name, measure_value, units, number_format="%0.1f"):
-      if measure_value is None:
-        str = '%s: NotAvailable\n' % measure_name
-      else:
-        str = '%s: %s %s\n' % (measure_name, number_format % measure_value, units)
-      return str
-
-    # Tongue height
-    tongue_height = None
-    if all_not_none(tongue_superior, vallecula):
-      tongue_height = tongue_superior[S] - vallecula[S]
-    report_str += make_report_line("Tongue height", tongue_height, "mm")
-    # Tongue anterior position
-    tongue_anterior_pos = None
-    if all_not_none(tongue_anterior, ans):
-      tongue_anterior_pos = ans[A] - tongue_anterior[A] 
-    report_str += make_report_line("Tongue anterior position", tongue_anterior_pos, "mm", number_format="%+0.1f")
-    # Tongue superior position
-    tongue_superior_pos = None
-    if all_not_none(tongue_superior, ans):
-      tongue_superior_pos = ans[S] - tongue_superior[S]
-    report_str += make_report_line("Tongue superior position (relative to anterior nasal spine)", tongue_superior_pos, "mm", number_format="%+0.1f")
-    # Hyoid posterior distance
-    hyoid_posterior_distance = None
-    if all_not_none(hyoid, c2, c3):
-      # Need to find shortest distance from line connecting c2 and c3 to hyoid center
-      # Can be reformulated as subtracting the projection of h-c2 onto c2-c3 from h-c2
-      line_vector = np.subtract(c3,c2) # vector pointing along line
-      h_to_c2 = np.subtract(c2, hyoid)
-      proj = project(h_to_c2, line_vector) # projection of h_to_c2 onto line connecting c2 and c3
-      perp = h_to_c2 - proj # component perpedicular to line
-      hyoid_posterior_distance = np.linalg.norm(perp) 
-    report_str += make_report_line("Hyoid posterior distance (relative to C2-C3)", hyoid_posterior_distance, 'mm')
-    # Hyoid anterior distance
-    hyoid_anterior_distance = None
-    if all_not_none(hyoid, pog):
-      hyoid_anterior_distance = distance_sag(hyoid, pog) # sagittal plane distance
-    report_str += make_report_line("Hyoid anterior distance (relative to pogonion)", hyoid_anterior_distance, 'mm')
-    # Hyoid craniocaudal position
-    hyoid_craniocaudal_position = None
-    if all_not_none(hyoid, ans):
-      hyoid_craniocaudal_position = hyoid[S] -ans[S]
-    report_str += make_report_line("Hyoid craniocaudal position (relative to anterior nasal spine)", hyoid_craniocaudal_position, 'mm', number_format="%+0.1f")
-    # Nasion to Basion
-    nasion_to_basion_distance = None
-    if all_not_none(nasion, basion):
-      nasion_to_basion_distance = distance_3D(nasion, basion)
-    report_str += make_report_line("Nasion to Basion distance", nasion_to_basion_distance, 'mm')
-    # Left Mandibular Ramus Height
-    left_mandib_ramus_height = None
-    if all_not_none(left_condylion, left_gonion):
-      left_mandib_ramus_height = distance_3D(left_condylion, left_gonion)
-    report_str += make_report_line('Left mandibular ramus height', left_mandib_ramus_height, 'mm')
-    # Right Mandibular Ramus Height
-    right_mandib_ramus_height = None
-    if all_not_none(right_condylion, right_gonion):
-      right_mandib_ramus_height = distance_3D(right_condylion, right_gonion)
-    report_str += make_report_line('Right mandibular ramus height', right_mandib_ramus_height, 'mm')
-    # Inferior Pogonial Angle
-    inferior_pognial_angle = None
-    if all_not_none(left_gonion, right_gonion, pog):
-      inferior_pognial_angle = angle(np.subtract(left_gonion, pog), np.subtract(right_gonion, pog))
-    report_str += make_report_line('Inferior pogonial angle', inferior_pognial_angle, 'degrees')
-    # Bigonial Distance
-    bigonial_distance = None
-    if all_not_none(left_gonion, right_gonion):
-      bigonial_distance = distance_3D(left_gonion, right_gonion)
-    report_str += make_report_line('Bigonial distance', bigonial_distance, 'mm')
-    # Left Mandibular Body Length
-    left_mandib_body_len = None
-    if all_not_none(left_gonion, pog):
-      left_mandib_body_len = distance_3D(left_gonion, pog)
-    report_str += make_report_line('Left mandibular body length', left_mandib_body_len, 'mm')
-    # Right Mandibular Body Length
-    right_mandib_body_len = None
-    if all_not_none(right_gonion, pog):
-      right_mandib_body_len = distance_3D(right_gonion, pog)
-    report_str += make_report_line('Right mandibular body length', right_mandib_body_len, 'mm')
-    # Left Mandibular Total Length
-    left_mandib_total_len = None
-    if all_not_none(left_condylion, pog):
-      left_mandib_total_len = distance_3D(left_condylion, pog)
-    report_str += make_report_line('Left mandibular total length (condylion to pogonion line)', left_mandib_total_len, 'mm')
-    # Right Mandibular Total Length
-    right_mandib_total_len = None
-    if all_not_none(right_condylion, pog):
-      right_mandib_total_len = distance_3D(right_condylion, pog)
-    report_str += make_report_line('Right mandibular total length (condylion to pogonion line)', right_mandib_total_len, 'mm')
-    # Left Gonial Angle Substitute
-    left_gonial_angle_substitute = None
-    if all_not_none(left_condylion, left_gonion, pog):
-      left_gonial_angle_substitute = angle(np.subtract(left_gonion, left_condylion), np.subtract(left_gonion, pog))
-    report_str += make_report_line("Left gonial angle substitute (condyl-gon-pog)", left_gonial_angle_substitute, 'degrees')
-    # Right Gongial Angle Substitute
-    right_gonial_angle_substitute = None
-    if all_not_none(right_condylion, right_gonion, pog):
-      right_gonial_angle_substitute = angle(np.subtract(right_gonion, right_condylion), np.subtract(right_gonion, pog))
-    report_str += make_report_line("Right gonial angle substitute (condyl-gon-pog)", right_gonial_angle_substitute, 'degrees')
-    
-
+    report_str = self.calculate_measure_results(landmarks_node).report_str()
     logging.info(report_str)
-
     return report_str
 
-
-  def create_csv(self, filename, report_str, volume_name):
-    # create csv of airway measure values and fill first row of data
+  def calculate_measure_results(self, landmarks_node, volume_name=''):
+    '''Calculate all possible airway measures as a MeasureResults for a single case.
+    Measures which need a missing landmark point are marked not available.'''
+    coords, missing = self.get_landmark_array(landmarks_node, MEASURE_LANDMARK_NAMES)
+    # A single case is just a cohort of one, so this matches the batch results exactly
+    values = calculate_measures_array(coords[np.newaxis], missing[np.newaxis])
+    available = measures_available(missing[np.newaxis])
+    return MeasureResults(values, available, case_names=[volume_name])
+
+  def update_measures(self, landmarks_node, changed_labels=None):
+    '''Bring the live (incrementally updated) measures for this landmarks node up to date.
+    Only measures depending on changed_labels are recomputed; None means resync every
+    measure landmark. Returns the indices of the recomputed measures.'''
+    incremental = self.incrementalMeasures.get(landmarks_node)
+    if incremental is None:
+      incremental = IncrementalMeasures()
+      self.incrementalMeasures[landmarks_node] = incremental
+      changed_labels = None # first time, fill everything in
+    if changed_labels is None:
+      changed_labels = MEASURE_LANDMARK_NAMES
+    return incremental.set_landmarks(self.getNamedLandmarkPositions(landmarks_node, changed_labels))
+
+  def getNamedLandmarkPositions(self, landmarks_node, labels):
+    # {label: world position, or None if not placed} for the given labels
+    landmarkPositions = {}
+    for label in labels:
+      cpIdx = self.getControlPointIndex(landmarks_node, label)
+      if cpIdx is None:
+        landmarkPositions[label] = None
+      else:
+        pos = [0]*3
+        landmarks_node.GetNthControlPointPositionWorld(cpIdx, pos)
+        landmarkPositions[label] = pos
+    return landmarkPositions
+
+  def getMidSagittalPlaneFit(self, landmarks_node):
+    # The (incrementally updated) mid-sagittal plane fit for this landmarks node
+    if landmarks_node not in self.midSagittalFits:
+      self.update_midsagittal_plane(landmarks_node)
+    return self.midSagittalFits[landmarks_node]
+
+  def update_midsagittal_plane(self, landmarks_node, changed_labels=None):
+    '''Bring the mid-sagittal plane fit for this landmarks node up to date with changed_labels
+    (None means resync all of the mid-sag and bilateral landmarks).  Returns True if the plane
+    may have moved.'''
+    fit = self.midSagittalFits.get(landmarks_node)
+    if fit is None:
+      fit = MidSagittalPlaneFit()
+      self.midSagittalFits[landmarks_node] = fit
+      changed_labels = None # first time, fill everything in
+    if changed_labels is None:
+      changed_labels = MID_SAG_LANDMARK_NAMES + [name for pair in BILATERAL_PAIRS for name in pair[1:]]
+    return fit.set_landmarks(self.getNamedLandmarkPositions(landmarks_node, changed_labels))
+
+  def jumpSliceToPlane(self, sliceNode, origin, normal):
+    # Reorient and move a slice view onto a plane, keeping its up direction as far as possible
+    sliceToRas = sliceNode.GetSliceToRAS()
+    newSliceToRas = plane_slice_to_ras(slicer.util.arrayFromVTKMatrix(sliceToRas), origin, normal)
+    slicer.util.updateVTKMatrixFromArray(sliceToRas, newSliceToRas)
+    sliceNode.UpdateMatrices()
+
+  def get_live_measure_results(self, landmarks_node, volume_name=''):
+    # Current live measures for this landmarks node (see update_measures) as a MeasureResults
+    incremental = self.incrementalMeasures.get(landmarks_node)
+    if incremental is None:
+      self.update_measures(landmarks_node)
+      incremental = self.incrementalMeasures[landmarks_node]
+    return MeasureResults(incremental.values, incremental.available, case_names=[volume_name])
+
+  def getLandmarksSequence(self, browserNode, landmarksNode):
+    # The sequence holding landmarksNode's per-frame points in browserNode, or None if not bound
+    if browserNode is None or landmarksNode is None:
+      return None
+    return browserNode.GetSequenceNode(landmarksNode)
+
+  def bindLandmarksToSequence(self, browserNode, landmarksNode):
+    '''Give each frame of the browser's sequence its own set of landmarks: a markups sequence is
+    added with landmarksNode as its proxy, and edits are saved back to the current frame.  The
+    current points go into the current frame and the other frames start out empty.'''
+    landmarksSequence = self.getLandmarksSequence(browserNode, landmarksNode)
+    if landmarksSequence is not None:
+      return landmarksSequence # already bound
+    masterSequence = browserNode.GetMasterSequenceNode()
+    landmarksSequence = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceNode', landmarksNode.GetName()+'_Sequence')
+    landmarksSequence.SetIndexName(masterSequence.GetIndexName())
+    landmarksSequence.SetIndexUnit(masterSequence.GetIndexUnit())
+    landmarksSequence.SetIndexType(masterSequence.GetIndexType())
+    emptyNode = slicer.vtkMRMLMarkupsFiducialNode()
+    currentItem = browserNode.GetSelectedItemNumber()
+    for itemIdx in range(masterSequence.GetNumberOfDataNodes()):
+      frameNode = landmarksNode if itemIdx==currentItem else emptyNode
+      landmarksSequence.SetDataNodeAtValue(frameNode, masterSequence.GetNthIndexValue(itemIdx))
+    browserNode.AddSynchronizedSequenceNode(landmarksSequence)
+    browserNode.AddProxyNode(landmarksNode, landmarksSequence, False)
+    browserNode.SetSaveChanges(landmarksSequence, True)
+    return landmarksSequence
+
+  def propagateLandmarksToNextFrame(self, browserNode, landmarksNode, volumeNode, templateRadiusMm=5.0, searchRadiusMm=5.0, workers=None):
+    '''Propose positions on the next frame for the landmarks placed on the current frame, by
+    matching a patch around each landmark in this frame's CT against the next frame's CT (see
+    AirwayLandmarksLib.propagation), then step the browser on to the next frame and add the
+    proposals there, unlocked so they can be reviewed and moved.  Landmarks which are already
+    placed on the next frame are left alone.  Returns {label: match score} for the proposals.'''
+    landmarksSequence = self.getLandmarksSequence(browserNode, landmarksNode)
+    volumeSequence = browserNode.GetSequenceNode(volumeNode) if volumeNode is not None else None
+    if landmarksSequence is None or volumeSequence is None:
+      raise ValueError('The landmarks and the CT volume must both be frames of the selected sequence!')
+    itemNumber = browserNode.GetSelectedItemNumber()
+    if itemNumber+1 >= browserNode.GetNumberOfItems():
+      raise ValueError('Already on the last frame!')
+    masterSequence = browserNode.GetMasterSequenceNode()
+    fixedVolume = volumeSequence.GetDataNodeAtValue(masterSequence.GetNthIndexValue(itemNumber))
+    movingVolume = volumeSequence.GetDataNodeAtValue(masterSequence.GetNthIndexValue(itemNumber+1))
+    # Landmark local coordinates are in the original image space of the frame volumes
+    labels = []
+    ras = []
+    for cpIdx in range(landmarksNode.GetNumberOfControlPoints()):
+      pos = [0]*3
+      landmarksNode.GetNthControlPointPosition(cpIdx, pos)
+      labels.append(landmarksNode.GetNthControlPointLabel(cpIdx))
+      ras.append(pos)
+    if not labels:
+      return {}
+    rasToIjk = vtk.vtkMatrix4x4()
+    fixedVolume.GetRASToIJKMatrix(rasToIjk)
+    rasToIjk = slicer.util.arrayFromVTKMatrix(rasToIjk)
+    ijkToRas = vtk.vtkMatrix4x4()
+    movingVolume.GetIJKToRASMatrix(ijkToRas)
+    ijkToRas = slicer.util.arrayFromVTKMatrix(ijkToRas)
+    ijk = np.array(ras) @ rasToIjk[:3,:3].T + rasToIjk[:3,3]
+    # Radii in voxels along each array axis (arrays are K, J, I)
+    spacing = np.array(fixedVolume.GetSpacing())[::-1]
+    templateRadius = np.maximum(np.ceil(templateRadiusMm/spacing), 1).astype(int)
+    searchRadius = np.maximum(np.ceil(searchRadiusMm/spacing), 1).astype(int)
+    kji, scores = propagate_points(slicer.util.arrayFromVolume(fixedVolume), slicer.util.arrayFromVolume(movingVolume),
+      ijk[:,::-1], templateRadius, searchRadius, workers=workers)
+    newRas = kji[:,::-1] @ ijkToRas[:3,:3].T + ijkToRas[:3,3]
+    # The proxy landmarks node shows the next frame's points from here on
+    browserNode.SetSelectedItemNumber(itemNumber+1)
+    placed = set(landmarksNode.GetNthControlPointLabel(cpIdx) for cpIdx in range(landmarksNode.GetNumberOfControlPoints()))
+    proposed = {}
+    wasModifying = landmarksNode.StartModify()
+    for label, pos, score in zip(labels, newRas, scores):
+      if np.isnan(score) or label in placed or label in proposed:
+        continue
+      cpIdx = landmarksNode.AddControlPoint(vtk.vtkVector3d(*pos))
+      landmarksNode.SetNthControlPointLabel(cpIdx, label)
+      landmarksNode.SetNthControlPointLocked(cpIdx, False)
+      proposed[label] = score
+    landmarksNode.EndModify(wasModifying)
+    return proposed
+
+  def getWorldToIJKMatrix(self, volumeNode):
+    '''4x4 matrix from world RAS to volumeNode's IJK, through volume RAS (undoing the FH
+    reorientation, or any other linear transform the volume is under), or None if the volume
+    is under a non-linear transform.'''
+    worldToRas = np.eye(4)
+    transformNode = volumeNode.GetParentTransformNode()
+    if transformNode is not None:
+      if not transformNode.IsTransformToWorldLinear():
+        return None
+      worldToRasMatrix = vtk.vtkMatrix4x4()
+      transformNode.GetMatrixTransformFromWorld(worldToRasMatrix)
+      worldToRas = slicer.util.arrayFromVTKMatrix(worldToRasMatrix)
+    rasToIjk = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIjk)
+    return slicer.util.arrayFromVTKMatrix(rasToIjk) @ worldToRas
+
+  @timed()
+  def sample_landmark_intensities(self, landmarks_node, volumeNode, sphereRadiusMm=2.0):
+    '''Image intensities of volumeNode at every control point of landmarks_node, all at once:
+    returns (labels, values, sphere means, sphere SDs), the value trilinearly interpolated at
+    the point and the mean and SD of the voxels within sphereRadiusMm of it (NaN outside the
+    volume, or for a volume under a non-linear transform).'''
+    labels = [landmarks_node.GetNthControlPointLabel(cpIdx) for cpIdx in range(landmarks_node.GetNumberOfControlPoints())]
+    nans = np.full(len(labels), np.nan)
+    if not labels or volumeNode is None or volumeNode.GetImageData() is None:
+      return labels, nans, nans, nans
+    worldToIjk = self.getWorldToIJKMatrix(volumeNode)
+    if worldToIjk is None:
+      return labels, nans, nans, nans
+    worldPositions = slicer.util.arrayFromMarkupsControlPoints(landmarks_node, world=True)
+    kji = (worldPositions @ worldToIjk[:3,:3].T + worldToIjk[:3,3])[:,::-1] # arrays are K, J, I
+    array = slicer.util.arrayFromVolume(volumeNode) # a view, only the sampled voxels are read
+    values = trilinear(array, kji)
+    means, sds = sphere_statistics(array, kji, sphereRadiusMm, np.array(volumeNode.GetSpacing())[::-1])
+    return labels, values, means, sds
+
+  def add_landmark_intensities(self, results, landmarks_node, volumeNode, sphereRadiusMm=2.0):
+    # Add the intensities at the landmarks to a single case MeasureResults (for the report). Returns results
+    if landmarks_node is not None and len(results)==1:
+      labels, values, means, sds = self.sample_landmark_intensities(landmarks_node, volumeNode, sphereRadiusMm)
+      results.add_landmark_intensities(labels, values[np.newaxis], means[np.newaxis], sds[np.newaxis])
+    return results
+
+  @timed()
+  def snapToImageFeature(self, volumeNode, worldPos, radiusMm, mode='edge'):
+    '''Snap a world RAS position to the strongest feature of volumeNode within radiusMm of it
+    (see AirwayLandmarksLib.refinement), reading only a small box of the volume around it.
+    Returns the snapped world position, or worldPos itself if the volume is under a non-linear
+    transform or the position is outside the volume.'''
+    if volumeNode is None or volumeNode.GetImageData() is None:
+      return worldPos
+    worldToIjk = self.getWorldToIJKMatrix(volumeNode)
+    if worldToIjk is None:
+      return worldPos
+    ijk = worldToIjk[:3,:3] @ np.asarray(worldPos, dtype=float) + worldToIjk[:3,3]
+    # Arrays are K, J, I
+    kji, value = snap_point(slicer.util.arrayFromVolume(volumeNode), ijk[::-1], radiusMm,
+      np.array(volumeNode.GetSpacing())[::-1], mode)
+    if np.isnan(value):
+      return worldPos
+    ijkToWorld = np.linalg.inv(worldToIjk)
+    return list(ijkToWorld[:3,:3] @ kji[::-1] + ijkToWorld[:3,3])
+
+  def calculate_sequence_measures(self, landmarksSequence, proxyNode, frames=None):
+    '''Calculate the measures for frames (default: all) of a bound landmarks sequence as a
+    MeasureResults with one case per frame, named by its index value.  Frame landmarks are
+    stored in original image space, so they are put through the proxy landmarks node's
+    transform (the FH transform) first.  Per-frame results are cached, and only frames whose
+    landmarks (or the transform) changed since they were last measured are recomputed, all
+    in one vectorized pass.'''
+    if frames is None:
+      frames = range(landmarksSequence.GetNumberOfDataNodes())
+    frames = list(frames)
+    toWorld = np.eye(4)
+    transformNode = proxyNode.GetParentTransformNode() if proxyNode is not None else None
+    if transformNode is not None:
+      matrix = vtk.vtkMatrix4x4()
+      transformNode.GetMatrixTransformToWorld(matrix)
+      toWorld = slicer.util.arrayFromVTKMatrix(matrix)
+    cache = self.sequenceMeasureCache.setdefault(landmarksSequence.GetID(), {})
+    staleFrames = []
+    cacheKeys = {}
+    for frame in frames:
+      cacheKeys[frame] = (landmarksSequence.GetNthDataNode(frame).GetMTime(), toWorld.tobytes())
+      cached = cache.get(frame)
+      if cached is None or cached[0]!=cacheKeys[frame]:
+        staleFrames.append(frame)
+    if staleFrames:
+      coords = np.full((len(staleFrames), len(MEASURE_LANDMARK_NAMES), 3), np.nan)
+      missing = np.ones(coords.shape[:2], dtype=bool)
+      for row, frame in enumerate(staleFrames):
+        coords[row], missing[row] = self.get_landmark_array(landmarksSequence.GetNthDataNode(frame), MEASURE_LANDMARK_NAMES, world=False)
+      coords = coords @ toWorld[:3,:3].T + toWorld[:3,3]
+      values = calculate_measures_array(coords, missing)
+      available = measures_available(missing)
+      for row, frame in enumerate(staleFrames):
+        cache[frame] = (cacheKeys[frame], values[row], available[row])
+    values = np.array([cache[frame][1] for frame in frames]).reshape(len(frames), -1)
+    available = np.array([cache[frame][2] for frame in frames]).reshape(len(frames), -1)
+    indexName = landmarksSequence.GetIndexName()
+    caseNames = ['%s=%s' % (indexName, landmarksSequence.GetNthIndexValue(frame)) for frame in frames]
+    return MeasureResults(values, available, case_names=caseNames)
+
+  def calculate_measures_batch(self, coords, missing=None, landmark_names=None):
+    '''Calculate all airway measures for a whole cohort in one vectorized pass. See
+    calculate_measures_array() for the argument and return value conventions.'''
+    return calculate_measures_array(coords, missing=missing, landmark_names=landmark_names)
+
+  def get_landmark_array(self, landmarks_node, landmark_names, world=True):
+    '''Gather the world (or, if world is False, local) positions of the named landmarks from
+    a markups node into an (L x 3) array, along with an (L,) boolean mask which is True for
+    landmarks which are not present in the node (their coordinates are left as NaN).'''
+    coords = np.full((len(landmark_names), 3), np.nan)
+    missing = np.ones(len(landmark_names), dtype=bool)
+    for row, landmark_name in enumerate(landmark_names):
+      cpIdx = self.getControlPointIndex(landmarks_node, landmark_name)
+      if cpIdx is None:
+        logging.info('Landmark "%s" not found!!' % (landmark_name))
+        continue
+      pos = [0]*3
+      if world:
+        landmarks_node.GetNthControlPointPositionWorld(cpIdx, pos)
+      else:
+        landmarks_node.GetNthControlPointPosition(cpIdx, pos)
+      coords[row] = pos
+      missing[row] = False
+    return coords, missing
+
+
+  def getResultsStore(self, filename):
+    # Results CSV store for this file, kept so its volume name index carries over between calls
+    store = self.resultsStores.get(filename)
+    if store is None:
+      store = ResultsCSVStore(filename)
+      self.resultsStores[filename] = store
+    return store
+
+  @timed()
+  def create_csv(self, filename, results, volume_name):
+    # create csv of airway measure values (from a MeasureResults) and fill first row of data
+    # (volume_name can also be a list of names, one per case in results)
     # Ensure extension is .csv
     if len(filename)<4 or filename[-4:]!='.csv':
       filename += '.csv'
-    import csv
-    colNames = [rl.split(': ')[0] for rl in report_str.splitlines()]
-    colNames.append('Volume Name')
-    colVals = [rl.split(': ')[1] for rl in report_str.splitlines()]
-    units = [val.split(' ')[1] for val in colVals]
-    vals = [val.split(' ')[0] for val in colVals]
-    vals.append(volume_name)
-    with open(filename, mode='w', newline='') as f:
-      writer = csv.writer(f)
-      writer.writerow(colNames)
-      writer.writerow(units)
-      writer.writerow(vals)
-
-  def add_to_csv(self, filename, report_str, volume_name):
-    # to add one line of values to existing csv file
+    try:
+      self.getResultsStore(filename).create(results, volume_names=as_name_list(volume_name))
+    except ResultsFileLockTimeout as e:
+      slicer.util.warningDisplay(str(e))
+
+  @timed()
+  def add_to_csv(self, filename, results, volume_name):
+    # to add one line of values (from a MeasureResults) to existing csv file, superseding
+    # the existing line if this volume has already been measured
+    return self.add_many_to_csv(filename, results, as_name_list(volume_name))
+
+  @timed()
+  def add_many_to_csv(self, filename, results, volume_names=None):
+    '''Add one row per case of results to an existing csv file, under a file lock and in a
+    single write, each superseding any earlier row of the same volume.  Returns (number of
+    new volumes, number of volumes measured again), or None if nothing could be written.'''
     # Ensure filename exists
-    import os.path
     if not os.path.exists(filename):
       slicer.util.warningDisplay('File "%s" does not exist!'%(filename))
-      return
-    import csv
-    colVals = [rl.split(': ')[1] for rl in report_str.splitlines()]
-    v = [val.split(' ')[0] for val in colVals]
-    v.append(volume_name)
-    with open(filename, mode='a', newline='') as f:
-      writer = csv.writer(f)
-      writer.writerow(v)
-  
+      return None
+    try:
+      return self.getResultsStore(filename).upsert(results, volume_names=volume_names)
+    except ResultsHeaderMismatch as e:
+      slicer.util.warningDisplay(str(e))
+    except ResultsFileLockTimeout as e:
+      slicer.util.warningDisplay(str(e))
+    return None
+
+  def getResultsDatabase(self, filename):
+    # Results database for this file (created if new), kept open between calls
+    database = self.resultsDatabases.get(filename)
+    if database is None:
+      database = ResultsDatabase(filename)
+      self.resultsDatabases[filename] = database
+    return database
+
+  def closeResultsDatabases(self):
+    for database in self.resultsDatabases.values():
+      database.close()
+    self.resultsDatabases = {}
+
+  @timed()
+  def add_to_database(self, filename, results, volume_names, annotator='', landmarks=None, notes=None):
+    '''Add a measurement for each case of results to a results database, in one transaction,
+    with the landmark positions they were calculated from (a {label: RAS} dict per case).
+    Returns the new measurement ids, or None if nothing could be written.'''
+    import sqlite3
+    try:
+      return self.getResultsDatabase(filename).add_results(results, volume_names, annotator=annotator, landmarks=landmarks, notes=notes)
+    except sqlite3.Error as e:
+      slicer.util.warningDisplay('Could not write to results database "%s": %s' % (filename, e))
+    return None
+
+  def export_database_csv(self, filename, csvFilename):
+    # Results CSV of the latest measurement of each volume in a results database, or None on failure
+    import sqlite3
+    try:
+      return self.getResultsDatabase(filename).export_csv(csvFilename)
+    except sqlite3.Error as e:
+      slicer.util.warningDisplay('Could not read results database "%s": %s' % (filename, e))
+    return None
+
+  def getNormativeTable(self, filename):
+    # Normative table from a CSV file, loaded once and again only if the file changes (None without a file)
+    if not filename or not os.path.isfile(filename):
+      return None
+    key = (filename, os.path.getmtime(filename))
+    if self.normativeTable is None or self.normativeTable[0]!=key:
+      try:
+        self.normativeTable = (key, NormativeTable.from_csv(filename))
+      except (KeyError, ValueError) as e:
+        slicer.util.warningDisplay('Could not read normative table "%s": %s' % (filename, e))
+        return None
+    return self.normativeTable[1]
+
+  def add_normative_scores(self, results, normsFilename, ages, sexes=None):
+    '''Add z-scores and percentiles against the norms in normsFilename to a MeasureResults,
+    for all of its cases in one pass (ages in years, NaN if unknown).  Returns results.'''
+    normativeTable = self.getNormativeTable(normsFilename)
+    if normativeTable is not None:
+      results.add_normative_scores(normativeTable, ages, sexes)
+    return results
+
+  def getPatientAgeAndSex(self, volNode):
+    # (age in years or None, 'M'/'F'/'') from the DICOM header of a volume loaded from DICOM
+    instanceUIDs = volNode.GetAttribute('DICOM.instanceUIDs') if volNode is not None else None
+    if not instanceUIDs or slicer.dicomDatabase is None:
+      return None, ''
+    instanceUID = instanceUIDs.split()[0]
+    age = parse_dicom_age(slicer.dicomDatabase.instanceValue(instanceUID, '0010,1010'))
+    sex = normalize_sex(slicer.dicomDatabase.instanceValue(instanceUID, '0010,0040'))
+    return age, sex
+
+  def summarize_results_csvs(self, filenames, group_by=''):
+    '''Streaming summary statistics (see AirwayLandmarksLib.cohortstats) over results CSV files,
+    optionally grouped: group_by is '' for no grouping, 'file' to group by results file, or a
+    regular expression whose first group, searched for in the volume name, is the group.'''
+    if group_by=='':
+      group_key = None
+    elif group_by=='file':
+      group_key = group_by_file
+    else:
+      try:
+        group_key = group_by_pattern(group_by)
+      except re.error as e:
+        slicer.util.warningDisplay('Group by "%s" is not a valid regular expression: %s' % (group_by, e))
+        return None
+    try:
+      return summarize_results_files(filenames, group_key=group_key)
+    except ResultsHeaderMismatch as e:
+      slicer.util.warningDisplay(str(e))
+      return None
 
   def updateLandmarkTableEntry(self, table, landmarkName, landmarkPosition):
     """ Checks through given table for a row that starts with landmarkName.
     If found, the supplied position is filled in, and function returns True.
     If not found, the function returns False
     """
-    foundLandmarkName=False
-    numberFormat = '%0.1f'
-    Scol = table.columnCount-2 # 2nd from last
-    Acol = table.columnCount-3 # 3rd from last
-    Rcol = table.columnCount-4 # 4th from last
-    for rowIdx in range(table.rowCount):
-      rowLandmarkName = table.item(rowIdx,0).text()
-      #print('%s==%s'%(landmarkName,rowLandmarkName))
-      if rowLandmarkName==landmarkName:
-        foundLandmarkName = True
-        if landmarkPosition is None:
-          # Reset position text to empty strings
-          table.item(rowIdx,Scol).setText('')
-          table.item(rowIdx,Acol).setText('')
-          table.item(rowIdx,Rcol).setText('')
-        else:
-          # Match! Fill in position
-          R,A,S = landmarkPosition  
-          table.item(rowIdx,Scol).setText(numberFormat % S)
-          table.item(rowIdx,Acol).setText(numberFormat % A)
-          table.item(rowIdx,Rcol).setText(numberFormat % R)
+    notFound = self.updateLandmarkTableEntries(table, {landmarkName: landmarkPosition})
+    return len(notFound)==0
+
+  @timed()
+  def updateLandmarkTableEntries(self, table, landmarkPositions):
+    """ Fill in many rows of a landmark table at once. landmarkPositions maps
+    landmark name to RAS position (None clears the row). The table model is
+    updated in one go, so the view repaints (its visible rows) and is resized
+    just once. Returns the set of landmark names which have no row in this table.
+    """
+    notFound = table.model().setLandmarkPositions(landmarkPositions)
     self.fitTableSize(table)
-    return foundLandmarkName
+    return notFound
 
-  def updateLandmarkTableFromNode(self, table, landmarks_node):
-    # Loop over table entries and fill from landmarks node.  
-    # Note that this will omit any extra points which are present in the landmarks_node but not present in the table
-    node_landmark_labels = []
+  def getTableRowIndex(self, table):
+    # Landmark name -> row lookup for a landmark table
+    return table.model().rowIndex
+
+  def getLandmarkPositions(self, landmarks_node):
+    # Return {label: world position} for every control point in the node
+    positions = {}
     if landmarks_node is not None:
       for cpIdx in range(landmarks_node.GetNumberOfControlPoints()):
-        node_landmark_labels.append(landmarks_node.GetNthControlPointLabel(cpIdx))
-    for rowIdx in range(table.rowCount):
-      rowLandmarkName = table.item(rowIdx,0).text()
-      try:
-        idx = node_landmark_labels.index(rowLandmarkName)
         pos = [0]*3
-        landmarks_node.GetNthControlPointPositionWorld(idx, pos)
-        #self.updateLandmarkTableEntry(table, rowLandmarkName, pos)
-      except AttributeError:
-        # landmarks_node must be None, clear table row
-        pos = None
-      except ValueError:
-        # rowLandmarkName not found in list of node landmark labels
-        # Clear the table row...
-        pos = None
-      self.updateLandmarkTableEntry(table, rowLandmarkName, landmarkPosition=pos)
-   
-    
-    
+        landmarks_node.GetNthControlPointPositionWorld(cpIdx, pos)
+        positions[landmarks_node.GetNthControlPointLabel(cpIdx)] = pos
+    return positions
+
+  @timed()
+  def updateLandmarkTableFromNode(self, table, landmarks_node):
+    # Fill every table row from the landmarks node in one batched update.
+    # Note that this will omit any extra points which are present in the landmarks_node but not present in the table.
+    # Each row's point is found through the cached label lookup, so only the table's landmarks are read from the node;
+    # rows not found among the node landmark labels (or with no node) are cleared
+    landmarkPositions = self.getNamedLandmarkPositions(landmarks_node, self.getTableRowIndex(table))
+    self.updateLandmarkTableEntries(table, landmarkPositions)
+
+  @timed()
   def selectNextUnfilledRow(self,table):
     # Find the currently selected row
-    if len(table.selectedIndexes())==0:
+    model = table.model()
+    selectedIndexes = table.selectionModel().selectedIndexes()
+    if len(selectedIndexes)==0:
       row=0 # default to 0 if no selected cell
     else:
-      row = table.selectedIndexes()[0].row() # start from currently selected cell
-    unfilledRowIdx = None
-    for rowIdx in range(row,table.rowCount):
-      if not self.rowIsFilled(table,rowIdx):
-        unfilledRowIdx = rowIdx
-        break
-    # If not found yet, start again at the top of the table
-    if unfilledRowIdx is None:
-      for rowIdx in range(row):
-        if not self.rowIsFilled(table,rowIdx):
-          unfilledRowIdx = rowIdx
-          break
+      row = selectedIndexes[0].row() # start from currently selected cell
+    # First unfilled row from there, starting again at the top of the table if needed
+    unfilledRowIdx = model.nextUnfilledRow(row)
     # Now we've been through the whole table
     if unfilledRowIdx is None:
       # No empty rows!
@@ -858,22 +1766,20 @@ class AirwayLandmarksLogic(ScriptedLoadableModuleLogic):
     else:
       # Unfilled row identified
       # Select this row
-      table.setCurrentItem(table.item(unfilledRowIdx,0))
+      index = model.index(unfilledRowIdx,0)
+      table.setCurrentIndex(index)
+      table.scrollTo(index)
       # Trigger callback as if clicked
-      table.cellClicked(unfilledRowIdx,0)
+      table.clicked(index)
     return unfilledRowIdx # None if none found
 
     
   def rowIsFilled(self,table,rowIdx):
-    # A row is filled if the 3rd column has a coordinate in it (either R or A
-    # depending on whether sag coll is there)
-    text = table.item(rowIdx,2).text()
-    if is_number(text):
-      return True
-    else:
-      return False
+    # A row is filled if its landmark has a position (kept as a bitmap in the table model)
+    return table.model().isFilled(rowIdx)
 
 
+  @timed()
   def fitTableSize(self,table):
     # change the table size to have no scrollbars and be minimal size
     # based on https://stackoverflow.com/questions/8766633/how-to-determine-the-correct-size-of-a-qtablewidget
@@ -883,7 +1789,14 @@ class AirwayLandmarksLogic(ScriptedLoadableModuleLogic):
     table.setHorizontalScrollBarPolicy(qt.Qt.ScrollBarAlwaysOff)
     table.resizeColumnsToContents()
     width = table.horizontalHeader().length()+table.verticalHeader().width
-    height = table.verticalHeader().length()+table.horizontalHeader().height
+    rowCount = table.model().rowCount()
+    if rowCount > self.maxVisibleTableRows:
+      # Long landmark catalogs scroll instead of making the module panel enormous
+      table.setVerticalScrollBarPolicy(qt.Qt.ScrollBarAsNeeded)
+      width += table.verticalScrollBar().sizeHint.width()
+      height = table.verticalHeader().defaultSectionSize*self.maxVisibleTableRows+table.horizontalHeader().height
+    else:
+      height = table.verticalHeader().length()+table.horizontalHeader().height
     table.setFixedSize(width,height)  
 
 
@@ -911,6 +1824,272 @@ class AirwayLandmarksLogic(ScriptedLoadableModuleLogic):
 
 
 
+#
+# LandmarkTableModel
+#
+
+class LandmarkTableModel(qt.QAbstractTableModel):
+  """Model behind a landmark table: one row per landmark, with the columns Landmark,
+  (Mid-Sag,) R, A, S and Reset. Positions are held in an (N x 3) array along with a
+  filled/unfilled bitmap, and cell text is only formatted when the view asks for it,
+  which it does just for the rows on screen.
+  """
+
+  numberFormat = '%0.1f'
+
+  def __init__(self, landmarkNames, midSagBools=None, parent=None):
+    qt.QAbstractTableModel.__init__(self, parent)
+    self.landmarkNames = list(landmarkNames)
+    self.midSag = np.array(midSagBools, dtype=bool) if midSagBools is not None else None
+    self.rowIndex = {name: row for row, name in enumerate(self.landmarkNames)}
+    self.positions = np.full((len(self.landmarkNames), 3), np.nan)
+    self.filled = np.zeros(len(self.landmarkNames), dtype=bool)
+    if self.midSag is None:
+      self.headers = ['Landmark','R','A','S','Reset']
+    else:
+      self.headers = ['Landmark','Mid-Sag','R','A','S','Reset']
+    self.rasColumn = len(self.headers)-4 # R column, followed by A and S
+    self.resetColumn = len(self.headers)-1
+
+  def rowCount(self, parent=None):
+    return len(self.landmarkNames)
+
+  def columnCount(self, parent=None):
+    return len(self.headers)
+
+  def data(self, index, role=qt.Qt.DisplayRole):
+    row = index.row()
+    col = index.column()
+    if role==qt.Qt.DisplayRole:
+      if col==0:
+        return self.landmarkNames[row]
+      if col==self.resetColumn:
+        return '[X]'
+      if col>=self.rasColumn and self.filled[row]:
+        return self.numberFormat % self.positions[row, col-self.rasColumn]
+      return ''
+    if role==qt.Qt.CheckStateRole and self.midSag is not None and col==1:
+      return qt.Qt.Checked if self.midSag[row] else qt.Qt.Unchecked
+    return None
+
+  def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
+    if orientation==qt.Qt.Horizontal and role==qt.Qt.DisplayRole:
+      return self.headers[section]
+    return qt.QAbstractTableModel.headerData(self, section, orientation, role)
+
+  def flags(self, index):
+    if self.midSag is not None and index.column()==1:
+      return qt.Qt.ItemIsEnabled # mid-sag column is for information only
+    return qt.Qt.ItemIsSelectable + qt.Qt.ItemIsEnabled # enabled and selectable, but not editable
+
+  def setLandmarkPositions(self, landmarkPositions):
+    # Set (or clear, for None) positions from {landmark name: RAS}, telling the view once.
+    # Returns the set of landmark names which have no row
+    notFound = set()
+    changedRows = []
+    for landmarkName, landmarkPosition in landmarkPositions.items():
+      row = self.rowIndex.get(landmarkName)
+      if row is None:
+        notFound.add(landmarkName)
+        continue
+      if landmarkPosition is None:
+        self.positions[row] = np.nan
+        self.filled[row] = False
+      else:
+        self.positions[row] = landmarkPosition
+        self.filled[row] = True
+      changedRows.append(row)
+    if changedRows:
+      self.dataChanged(self.index(min(changedRows), self.rasColumn), self.index(max(changedRows), self.rasColumn+2))
+    return notFound
+
+  def landmarkName(self, row):
+    return self.landmarkNames[row]
+
+  def isMidSag(self, row):
+    return self.midSag is not None and bool(self.midSag[row])
+
+  def isFilled(self, row):
+    return bool(self.filled[row])
+
+  def nextUnfilledRow(self, startRow=0):
+    # First unfilled row at or after startRow, wrapping around to the top, or None if all are filled
+    unfilledRows = np.flatnonzero(~self.filled)
+    if len(unfilledRows)==0:
+      return None
+    after = unfilledRows[unfilledRows>=startRow]
+    return int(after[0]) if len(after) else int(unfilledRows[0])
+
+#
+# ControlPointLabelIndex
+#
+
+class ControlPointLabelIndex(object):
+  """Cached label -> control point index lookup for one markups node.
+  The lookup is marked stale whenever points are added, removed or relabeled
+  and is only rebuilt (in one pass over the node) the next time it is used,
+  so a burst of edits costs one rebuild rather than one per edit.
+  """
+
+  def __init__(self, markupsNode):
+    self.markupsNode = markupsNode
+    self.labelToIdx = None # None means stale
+    self.labels = None
+    self.observerTags = [
+      markupsNode.AddObserver(markupsNode.PointAddedEvent, self.invalidate),
+      markupsNode.AddObserver(markupsNode.PointRemovedEvent, self.invalidate),
+      markupsNode.AddObserver(markupsNode.PointModifiedEvent, self.onPointModified),
+    ]
+
+  def removeObservers(self):
+    for tag in self.observerTags:
+      self.markupsNode.RemoveObserver(tag)
+    self.observerTags = []
+
+  def invalidate(self, caller=None, event=None):
+    self.labelToIdx = None
+    self.labels = None
+
+  @vtk.calldata_type(vtk.VTK_INT)
+  def onPointModified(self, caller, event, cpIdx):
+    # Point modified fires for moves as well as label changes, only relabeling makes the lookup stale
+    if self.labels is None:
+      return
+    if cpIdx is None or cpIdx<0 or cpIdx>=len(self.labels):
+      self.invalidate()
+    elif self.markupsNode.GetNthControlPointLabel(cpIdx)!=self.labels[cpIdx]:
+      self.invalidate()
+
+  def rebuild(self):
+    N = self.markupsNode.GetNumberOfControlPoints()
+    self.labels = [self.markupsNode.GetNthControlPointLabel(cpIdx) for cpIdx in range(N)]
+    self.labelToIdx = {}
+    for cpIdx, label in enumerate(self.labels):
+      self.labelToIdx[label] = cpIdx # last match wins if labels are duplicated
+
+  def indexOf(self, label):
+    # Return the control point index for label, or None if not present
+    if self.labelToIdx is None or len(self.labels)!=self.markupsNode.GetNumberOfControlPoints():
+      self.rebuild()
+    return self.labelToIdx.get(label)
+
+#
+# CaseWorklist
+#
+
+class CaseWorklist(object):
+  """Cases to annotate one after another (see AirwayLandmarksLib.worklist).
+  While the current case is annotated the next one is read on a background thread,
+  and loadReadyCases() (called from a UI timer) turns whatever has been read into
+  volume and markups nodes, so moving on only swaps the selectors over.  The nodes
+  of the last `capacity` cases visited or preloaded are kept in the scene (an LRU),
+  older ones have their landmarks saved and are removed.  Cases are keyed by their
+  index in the worklist throughout, never by name.  saved, if given, is called with a
+  case's volume node once its landmarks have been saved.
+  """
+
+  def __init__(self, cases, capacity=3, saved=None):
+    self.cases = list(cases)
+    self.capacity = capacity
+    self.saved = saved
+    self.currentIndex = None
+    self.caseData = PrefetchCache(lambda index: read_case(self.cases[index]), capacity=2) # case index -> CaseData, read in the background
+    self.caseNodes = collections.OrderedDict() # case index -> (volume, FH, landmarks nodes), least recently used first
+
+  @property
+  def currentCase(self):
+    return self.cases[self.currentIndex] if self.currentIndex is not None else None
+
+  def prefetch(self, index):
+    # Start reading the case at index in the background, unless it is loaded already
+    if 0 <= index < len(self.cases) and index not in self.caseNodes:
+      self.caseData.prefetch(index)
+
+  def loadReadyCases(self):
+    # Make nodes for the cases which have been read in the background (on the UI thread)
+    for index in self.caseData.loaded_keys():
+      if index not in self.caseNodes:
+        self.addCaseNodes(index, self.caseData.pop(index))
+        self.evictCases()
+
+  def goTo(self, index):
+    '''Make the case at index the current one, saving the landmarks of the case being left.
+    Returns its (volume, FH, landmarks nodes), waiting for it to be read if it had not been
+    prefetched (raising whatever reading it raised), and starts prefetching the next case.'''
+    if self.currentIndex is not None and self.currentIndex!=index:
+      self.saveCase(self.currentIndex)
+    if index not in self.caseNodes:
+      self.addCaseNodes(index, self.caseData.get(index))
+      self.caseData.pop(index)
+    self.currentIndex = index
+    self.caseNodes.move_to_end(index)
+    # Only the current case's landmarks are shown
+    for caseIndex, (volNode, FHLandmarksNode, landmarksNode) in self.caseNodes.items():
+      for markupsNode in (FHLandmarksNode, landmarksNode):
+        markupsNode.GetDisplayNode().SetVisibility(caseIndex==index)
+    self.prefetch(index + 1)
+    self.evictCases()
+    return self.caseNodes[index]
+
+  def addCaseNodes(self, index, caseData):
+    import sitkUtils
+    case = self.cases[index]
+    volNode = sitkUtils.PushVolumeToSlicer(caseData.image, name=slicer.mrmlScene.GenerateUniqueName(case.name))
+    # A prefetched case's landmarks stay hidden until goTo() makes it the current case
+    visible = index==self.currentIndex
+    FHLandmarksNode = self.makeMarkupsNode(case.name+'_FH_Landmarks', caseData.fh_points, visible)
+    landmarksNode = self.makeMarkupsNode(case.name+'_Airway_Landmarks', caseData.landmark_points, visible)
+    self.caseNodes[index] = (volNode, FHLandmarksNode, landmarksNode)
+
+  def makeMarkupsNode(self, nodeName, points, visible):
+    # Markups node with a locked control point for each of {label: RAS}
+    markupsNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', slicer.mrmlScene.GenerateUniqueName(nodeName))
+    markupsNode.CreateDefaultDisplayNodes()
+    markupsNode.GetDisplayNode().SetVisibility(visible)
+    wasModifying = markupsNode.StartModify()
+    for label, pos in points.items():
+      cpIdx = markupsNode.AddControlPoint(vtk.vtkVector3d(*pos))
+      markupsNode.SetNthControlPointLabel(cpIdx, label)
+      markupsNode.SetNthControlPointLocked(cpIdx, True)
+    markupsNode.EndModify(wasModifying)
+    return markupsNode
+
+  def evictCases(self):
+    # Save and remove the least recently used cases beyond capacity (never the current one)
+    for index in list(self.caseNodes):
+      if len(self.caseNodes) <= self.capacity:
+        break
+      if index==self.currentIndex:
+        continue
+      self.saveCase(index)
+      nodes = list(self.caseNodes.pop(index))
+      fhTransform = nodes[0].GetNodeReference(FH_TRANSFORM_REFERENCE_ROLE)
+      if fhTransform is not None:
+        nodes.append(fhTransform)
+      for node in nodes:
+        slicer.mrmlScene.RemoveNode(node)
+
+  def saveCase(self, index):
+    # Save a case's landmarks to its landmark files (markups files hold local, i.e. original image, coordinates)
+    case = self.cases[index]
+    volNode, FHLandmarksNode, landmarksNode = self.caseNodes[index]
+    allSaved = True
+    for markupsNode, path in ((FHLandmarksNode, case.fh_path), (landmarksNode, case.landmarks_path)):
+      if markupsNode.GetNumberOfControlPoints()==0 and not os.path.exists(path):
+        continue # nothing placed, and nothing to overwrite
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      if not slicer.util.saveNode(markupsNode, path):
+        logging.error('Could not save "%s" to "%s"' % (markupsNode.GetName(), path))
+        allSaved = False
+    if allSaved and self.saved is not None:
+      self.saved(volNode)
+
+  def close(self):
+    # Save the current case and stop prefetching (the loaded nodes stay in the scene)
+    if self.currentIndex is not None and self.currentIndex in self.caseNodes:
+      self.saveCase(self.currentIndex)
+    self.caseData.close()
+
   
 class AirwayLandmarksTest(ScriptedLoadableModuleTest):
   """
@@ -923,164 +2102,150 @@ class AirwayLandmarksTest(ScriptedLoadableModuleTest):
     """ Do whatever is needed to reset the state - typically a scene clear will be enough.
     """
     slicer.mrmlScene.Clear(0)
+    self.tableModels = []
 
   def runTest(self):
     """Run as few or as many tests as needed here.
     """
     self.setUp()
-    self.test_SEEGR1()
-
-  def test_SEEGR1(self):
-    """ Ideally you should have several levels of tests.  At the lowest level
-    tests should exercise the functionality of the logic with different inputs
-    (both valid and invalid).  At higher levels your tests should emulate the
-    way the user would interact with your code and confirm that it still works
-    the way you intended.
-    One of the most important features of the tests is that it should alert other
-    developers when their changes will have an impact on the behavior of your
-    module.  For example, if a developer removes a feature that you depend on,
-    your test should break so they know that the feature is needed.
-    """
+    self.test_AirwayLandmarks1()
+    self.setUp()
+    self.test_AirwayLandmarksTiming()
+
+  def makeLandmarksNode(self, landmarkNames, positions, nodeName='Test_Landmarks'):
+    landmarksNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', nodeName)
+    for name, pos in zip(landmarkNames, positions):
+      if np.isnan(pos).any():
+        continue # missing landmark
+      cpIdx = landmarksNode.AddControlPoint(vtk.vtkVector3d(*pos))
+      landmarksNode.SetNthControlPointLabel(cpIdx, name)
+    return landmarksNode
+
+  def makeLandmarkTable(self, landmarkNames):
+    # Same layout as the FH table: Landmark, R, A, S, Reset
+    model = LandmarkTableModel(landmarkNames)
+    self.tableModels.append(model)
+    table = qt.QTableView()
+    table.setModel(model)
+    return table
 
+  def test_AirwayLandmarks1(self):
+    """ Measures, FH reorientation and the landmark table helpers on a synthetic case
+    (no data download needed).
+    """
+    from AirwayLandmarksLib.benchmark import synthetic_cohort
     self.delayDisplay("Starting the test")
-    #
-    # first, get some data
-    #
-    import SampleData
-    SampleData.downloadFromURL(
-      nodeNames='FA',
-      fileNames='FA.nrrd',
-      uris='http://slicer.kitware.com/midas3/download?items=5767')
-    self.delayDisplay('Finished with download and loading')
-
-    volumeNode = slicer.util.getNode(pattern="FA")
-    logic = SEEGRLogic()
-    self.assertIsNotNone( logic.hasImageData(volumeNode) )
+    logic = AirwayLandmarksLogic()
+    coords, missing, fhPoints = synthetic_cohort(1)
+    landmarksNode = self.makeLandmarksNode(MEASURE_LANDMARK_NAMES, coords[0])
+
+    # Module measures match the cohort calculation on the same coordinates
+    results = logic.calculate_measure_results(landmarksNode)
+    expected = calculate_measures_array(coords, missing)
+    self.assertTrue(np.allclose(results.values, expected, equal_nan=True))
+    self.assertEqual(results.available.tolist(), measures_available(missing).tolist())
+
+    # FH transform rotates by the closed form FH rotation
+    fhNode = self.makeLandmarksNode(FH_LANDMARK_NAMES, fhPoints[0], nodeName='Test_FH_Landmarks')
+    transformNode = make_FH_transform(fhNode)
+    matrix = vtk.vtkMatrix4x4()
+    transformNode.GetMatrixTransformToParent(matrix)
+    self.assertTrue(np.allclose(slicer.util.arrayFromVTKMatrix(matrix)[:3,:3], fh_rotation_matrix(fhPoints[0])))
+    with self.assertRaises(ValueError):
+      make_FH_transform(landmarksNode) # not 3 points
+
+    # Table is filled from the node, and the first missing landmark is the next unfilled row
+    table = self.makeLandmarkTable(MEASURE_LANDMARK_NAMES)
+    logic.updateLandmarkTableFromNode(table, landmarksNode)
+    for row in range(len(MEASURE_LANDMARK_NAMES)):
+      self.assertEqual(logic.rowIsFilled(table, row), not missing[0, row])
+    firstMissing = np.flatnonzero(missing[0])
+    table.clearSelection()
+    self.assertEqual(logic.selectNextUnfilledRow(table), firstMissing[0] if len(firstMissing) else None)
+
+    # Removing a node from the scene drops what the logic cached for it
+    self.assertIn(landmarksNode, logic.controlPointLabelIndexes)
+    slicer.mrmlScene.RemoveNode(landmarksNode)
+    self.assertNotIn(landmarksNode, logic.controlPointLabelIndexes)
+    logic.cleanup()
     self.delayDisplay('Test passed!')
 
+  def test_AirwayLandmarksTiming(self):
+    """ Checks that the Slicer-bound code paths stay interactive with Slicer's own markups
+    nodes and tables at 2000 landmarks (they are benchmarked by the pytest-benchmark suite
+    in tests/test_benchmarks.py).
+    """
+    from AirwayLandmarksLib.benchmark import synthetic_cohort, time_call
+    self.delayDisplay("Starting the timing test")
+    logic = AirwayLandmarksLogic()
+    coords, missing, fhPoints = synthetic_cohort(1, missing_fraction=0)
+    fhNode = self.makeLandmarksNode(FH_LANDMARK_NAMES, fhPoints[0], nodeName='Test_FH_Landmarks')
+    fhTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'Test_FH_Transform')
+    nLandmarks = 2000
+    # The measure landmarks, then extra ones, with the last landmark left unplaced
+    landmarkNames = MEASURE_LANDMARK_NAMES + ['Landmark %d' % i for i in range(nLandmarks - len(MEASURE_LANDMARK_NAMES))]
+    positions = np.concatenate([coords[0], np.random.default_rng(nLandmarks).normal(scale=40.0, size=(nLandmarks - len(MEASURE_LANDMARK_NAMES), 3))])
+    landmarksNode = self.makeLandmarksNode(landmarkNames[:-1], positions[:-1], nodeName='Test_Landmarks')
+    table = self.makeLandmarkTable(landmarkNames)
+    logic.updateLandmarkTableFromNode(table, landmarksNode)
+    def selectNextUnfilledRow():
+      table.clearSelection()
+      logic.selectNextUnfilledRow(table)
+    benchmarks = [
+      ('calculate_measures', lambda: logic.calculate_measures(landmarksNode)),
+      ('make_FH_transform', lambda: make_FH_transform(fhNode, fhTransform)),
+      ('updateLandmarkTableFromNode', lambda: logic.updateLandmarkTableFromNode(table, landmarksNode)),
+      ('selectNextUnfilledRow', selectNextUnfilledRow),
+    ]
+    for name, func in benchmarks:
+      timing = time_call(func, repeat=3)
+      logging.info('%s [%d landmarks]: median %.3g s' % (name, nLandmarks, timing['median']))
+      self.assertLess(timing['median'], 0.5, '%s is too slow for interactive use' % name)
+    logic.cleanup()
+    self.delayDisplay('Timing test passed!')
+
 
 #
 # Helper functions
+# (the geometry helpers project, distance_sag, distance_3D and angle live in
+# AirwayLandmarksLib.geometry, and are imported above so they can still be used from here)
 #
 
-def is_number(text):
-  try:
-    float(text)
-    return True
-  except ValueError:
-    return False
-
-def all_not_none(*args):
-  # Returns True if all inputs are not None, otherwise returns False
-  for arg in args:
-    if arg is None:
-      return False # at least this argument is None
-  return True #all arguments were not None
-
-def project(u, v):
-  # Returns the projection of u onto v
-  proj = np.dot(u,v) / np.linalg.norm(v)**2 * np.array(v) 
-  return proj
-
-def distance_sag(p1, p2):
-    # Find distance between point 1 and 2 ignoring the R coordinate, i.e. projecting
-    # the two into a common sagittal plane before finding the distance between them.
-    p1 = np.array(p1)
-    p2 = np.array(p2)
-    dist_sag = np.sqrt((p1[1]-p2[1])**2 + (p1[2]-p2[2])**2)
-    return dist_sag
-
-def distance_3D(p1,p2):
-  # Find 3D distance between points 1 and 2
-  dist = np.linalg.norm(np.subtract(p2,p1))
-  return dist
-
-def angle(v1,v2):
-  # Find angle between the two given vectors in degrees, 0 to 180
-  ang_deg = 180/np.pi * np.arccos(np.dot(v1, v2)/ (np.linalg.norm(v1) * np.linalg.norm(v2)))
-  return ang_deg
-
-def make_FH_transform(F):
-  assert F.GetNumberOfControlPoints()==3, "There must be exactly 3 fiducial points to reorient to FH, left ear canal, right ear canal, and left orbit base"
+def as_name_list(names):
+  # A single name becomes a one item list, a list of names is left alone
+  if isinstance(names, str):
+    return [names]
+  return list(names)
+
+def make_FH_transform(F, transNode=None):
+  # Set the matrix of linear transform node transNode (a new 'points_FH_Transform' node if None)
+  # to the rotation which brings the FH points in markups node F into the FH plane. The points'
+  # local coordinates are used, so for F under the FH transform itself this gives the full
+  # transform from original image space. Raises ValueError if F does not hold exactly 3 points
+  # defining a plane
+  if F is None or F.GetNumberOfControlPoints()!=3:
+    raise ValueError("There must be exactly 3 fiducial points to reorient to FH, left ear canal, right ear canal, and left orbit base")
   FHpoints = []
   for idx in range(3):
     pos = [0,0,0]
-    F.GetNthControlPointPositionWorld(idx,pos)
+    F.GetNthControlPointPosition(idx,pos)
     FHpoints.append(pos)
+  rm3x3 = fh_rotation_matrix(FHpoints)
 
-  # Identify the orbit as the most anterior point
-  ap_dimension_idx = 1 # RAS has A as the second dimension
-  anterior_coordinates = [point[ap_dimension_idx] for point in FHpoints]
-  orbit_idx = np.argmax(anterior_coordinates)
-  orbit_point = FHpoints.pop(orbit_idx) # remove orbit point from list, leaving only ear points
-  lr_dimension_idx = 0 # RAS has R as the first dimension
-  right_coordinates = [p[lr_dimension_idx] for p in FHpoints]
-  right_ear_idx = np.argmax(right_coordinates)
-  right_ear_point = FHpoints.pop(right_ear_idx)
-  left_ear_point = FHpoints.pop() # last remaining point must be left ear
-
-  vectorA = np.subtract(orbit_point, right_ear_point)
-  vectorB = np.subtract(orbit_point, left_ear_point)
-
-  origNormal = np.cross(vectorA, vectorB)
-  origNormal /= np.linalg.norm(origNormal)
-
-  # Find rotation matrix that brings the original normal to the goal normal (bringing
-  # all three points into a plane with normal [0,0,-1])
-  goalNormal = np.array([0,0,-1])
-  goalNormal = goalNormal/np.linalg.norm(goalNormal)
-
-  import math
-  from scipy.spatial.transform import Rotation
-
-  rotation_axis = np.cross(origNormal,goalNormal)
-  if np.linalg.norm(rotation_axis) > 1e-10:
-    rotation_axis = rotation_axis/np.linalg.norm(rotation_axis) # normalize
-    rotation_angle_radians = math.acos(np.dot(origNormal,goalNormal))
-    rotvec = rotation_axis*rotation_angle_radians
-    r1 = Rotation.from_rotvec(rotvec)
-  else:
-    # origNormal and goalNormal are very close to identical
-    r1 = Rotation.identity()
-
-  # Find intraplanar rotation 
-  # This is the rotation necessary to move the vector pointing from
-  # the right ear point to the left ear point to align with the direction
-  # of the vector [-1,0,0]
-  planarLtEar = r1.apply(left_ear_point)
-  planarRtEar = r1.apply(right_ear_point)    
-  planarLtoR = planarRtEar-planarLtEar
-  planarLtoR = planarLtoR/np.linalg.norm(planarLtoR) # normalize
-  LtoRGoal = [1,0,0]
-
-  r2_rotation_axis = np.cross(planarLtoR,LtoRGoal) 
-  # this cross product gives the perpedicular vector needed such that
-  # right hand rotation around it by the acos value goes from the current
-  # to the goal. This is why we don't need to worry about the sign of the 
-  # angle returned by acos
-  if np.linalg.norm(r2_rotation_axis)>1e-10:
-    r2_rotation_axis = r2_rotation_axis/np.linalg.norm(r2_rotation_axis) #normalize
-    r2_rotation_angle_radians = math.acos(np.dot(planarLtoR,LtoRGoal))
-    rotvec2 = r2_rotation_axis*r2_rotation_angle_radians
-    r2 = Rotation.from_rotvec(rotvec2)
-  else: 
-    r2 = Rotation.identity()
-
-  rtot = r2*r1 # apply r1 then r2, r3 is the combined rotation
-
-  # Make a transform from the calculated rotations
-  transformName = 'points_FH_Transform'
-  transNode = slicer.vtkMRMLLinearTransformNode()
-  transNode.SetName(transformName)
+  # Make a transform from the calculated rotation
+  addNode = transNode is None
+  if addNode:
+    transformName = 'points_FH_Transform'
+    transNode = slicer.vtkMRMLLinearTransformNode()
+    transNode.SetName(transformName)
 
   vtkRotMatrix = vtk.vtkMatrix4x4() # this will hold the rotation matrix
-  rm3x3 = rtot.as_matrix()
-  print('rm3x3='+str(rm3x3))
   for r in range(3):
     for c in range(3):
       vtkRotMatrix.SetElement(r,c,rm3x3[r,c])
   transNode.SetMatrixTransformToParent(vtkRotMatrix)
-  slicer.mrmlScene.AddNode(transNode)
+  if addNode:
+    slicer.mrmlScene.AddNode(transNode)
   return transNode
 
 def sortByForGridNames(gridName):
@@ -0,0 +1 @@
+"""Slicer-independent support code for the Airway Landmarks module."""
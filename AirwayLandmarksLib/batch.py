@@ -0,0 +1,113 @@
+"""Headless batch measurement of saved landmark files.
+
+Runs the same measure calculations as the "Calculate Landmark Measures" button
+over a whole directory tree of saved landmark files (.mrk.json / .fcsv), without
+Slicer, spreading the cases over a process pool and streaming one row per case
+into a results CSV in the same layout as "Create CSV".
+
+Usage:
+  python -m AirwayLandmarksLib.batch <landmarks root dir> <output.csv> [--workers N] [--no-reorient]
+
+The landmark files saved for one volume (see markupsfiles.find_markups_files)
+are one case.  If the case includes the three Frankfurt Horizontal points, the
+landmarks are reoriented to FH first, just as the Reorient button does in the
+module.
+"""
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from AirwayLandmarksLib.geometry import (
+  FH_LANDMARK_NAMES,
+  MEASURE_DEFINITIONS,
+  MEASURE_LANDMARK_NAMES,
+  calculate_measures_array,
+  fh_rotation_matrix,
+  measures_available,
+)
+from AirwayLandmarksLib.markupsfiles import find_markups_files, read_markups_file
+from AirwayLandmarksLib.results import MeasureResults
+
+def measure_case(case, reorient=True):
+  '''Measure one case given as (case name, [markups file paths]).  Returns
+  (case name, [measure value strings, at full precision]), or (case name, None) if it could
+  not be read.'''
+  case_name, paths = case
+  try:
+    points = {}
+    for path in paths:
+      points.update(read_markups_file(path))
+    coords = np.full((len(MEASURE_LANDMARK_NAMES), 3), np.nan)
+    missing = np.ones(len(MEASURE_LANDMARK_NAMES), dtype=bool)
+    for row, landmark_name in enumerate(MEASURE_LANDMARK_NAMES):
+      if landmark_name in points:
+        coords[row] = points[landmark_name]
+        missing[row] = False
+    if reorient and all(name in points for name in FH_LANDMARK_NAMES):
+      rotation = fh_rotation_matrix([points[name] for name in FH_LANDMARK_NAMES])
+      coords = coords @ rotation.T
+    values = calculate_measures_array(coords[np.newaxis], missing[np.newaxis])[0]
+    available = measures_available(missing[np.newaxis])[0]
+  except Exception as e:
+    logging.warning('Skipping case "%s": %s' % (case_name, e))
+    return case_name, None
+  return case_name, MeasureResults(values, available).csv_rows()[0][:-1]
+
+def _measure_case_reoriented(case):
+  return measure_case(case, reorient=True)
+
+def _measure_case_as_is(case):
+  return measure_case(case, reorient=False)
+
+def run_batch(root_dir, csv_filename, workers=None, reorient=True, chunksize=8):
+  '''Measure every case under root_dir and write the results to csv_filename.
+  Rows are written as soon as they come back from the worker pool, in case order.
+  Returns the number of cases written.'''
+  cases = sorted(find_markups_files(root_dir).items())
+  measure = _measure_case_reoriented if reorient else _measure_case_as_is
+  col_names = [definition.name for definition in MEASURE_DEFINITIONS] + ['Volume Name']
+  units = [definition.units for definition in MEASURE_DEFINITIONS]
+  n_written = 0
+  with open(csv_filename, mode='w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(col_names)
+    writer.writerow(units)
+    if workers==1:
+      results = map(measure, cases)
+      pool = None
+    else:
+      pool = multiprocessing.Pool(processes=workers)
+      results = pool.imap(measure, cases, chunksize=chunksize)
+    try:
+      for case_name, vals in results:
+        if vals is None:
+          continue
+        writer.writerow(vals + [case_name])
+        n_written += 1
+    finally:
+      if pool is not None:
+        pool.close()
+        pool.join()
+  return n_written
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Calculate airway landmark measures for a directory tree of saved landmark files')
+  parser.add_argument('root_dir', help='directory tree holding .mrk.json/.fcsv landmark files, one case per volume')
+  parser.add_argument('csv_filename', help='results CSV file to write')
+  parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per core)')
+  parser.add_argument('--no-reorient', action='store_true', help='measure landmarks as saved, without FH reorientation')
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.INFO, format='%(message)s')
+  if not os.path.isdir(args.root_dir):
+    parser.error('"%s" is not a directory' % args.root_dir)
+  n_written = run_batch(args.root_dir, args.csv_filename, workers=args.workers, reorient=not args.no_reorient)
+  logging.info('Wrote %d cases to "%s"' % (n_written, args.csv_filename))
+  return 0
+
+if __name__=='__main__':
+  sys.exit(main())
@@ -0,0 +1,32 @@
+"""Helpers shared by the benchmarks and the module's self tests.
+
+The benchmarks themselves are the pytest-benchmark suite in tests/test_benchmarks.py,
+which times the Slicer-bound code paths (against lightweight stand-ins outside Slicer)
+and the cohort code paths, and saves and compares the timings as JSON.
+"""
+import time
+
+import numpy as np
+
+from AirwayLandmarksLib.geometry import MEASURE_LANDMARK_NAMES
+
+def time_call(func, repeat=5):
+  # Run func repeat times and return its timings in seconds
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    timings.append(time.perf_counter() - start)
+  return {'min': min(timings), 'median': float(np.median(timings)), 'mean': float(np.mean(timings)), 'repeat': repeat}
+
+def synthetic_cohort(n_cases, seed=0, missing_fraction=0.05):
+  '''Random but anatomically laid out cohort: (coords N x L x 3, missing N x L,
+  FH points N x 3 x 3 in left ear, right ear, orbit order).'''
+  rng = np.random.default_rng(seed)
+  template = rng.normal(scale=40.0, size=(len(MEASURE_LANDMARK_NAMES), 3))
+  coords = template + rng.normal(scale=3.0, size=(n_cases,) + template.shape)
+  missing = rng.random(coords.shape[:2]) < missing_fraction
+  coords[missing] = np.nan
+  fh_template = np.array([[-60.0, -10.0, 0.0], [60.0, -10.0, 0.0], [-35.0, 70.0, 5.0]])
+  fh_points = fh_template + rng.normal(scale=3.0, size=(n_cases, 3, 3))
+  return coords, missing, fh_points
@@ -0,0 +1,268 @@
+"""Streaming summary statistics over results CSV files.
+
+Reads results files (as written by "Create CSV"/"Add to CSV" or the batch
+command) in chunks of rows and keeps, for every measure, the count, mean and SD
+(merged chunk by chunk with Welford/Chan updates), min/max and a quantile
+sketch, so the statistics take constant memory however many rows the files
+hold.  A volume measured again has a later row superseding its earlier ones
+(see resultscsv), so only the last row of each volume in a file is counted.
+These are found by a first pass over the volume names, which keeps one entry
+per volume, so reading a file takes O(#volumes) memory on top of that.
+"NotAvailable" values count as missing.  Rows can be split into groups by a key
+derived from the results filename or the volume name.
+
+Usage:
+  python -m AirwayLandmarksLib.cohortstats results1.csv [results2.csv ...] [--group-by file|REGEX] [--out summary.csv]
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+
+import numpy as np
+
+from AirwayLandmarksLib.resultscsv import ResultsHeaderMismatch
+
+SUMMARY_PERCENTILES = (5, 25, 50, 75, 95)
+
+class QuantileSketch(object):
+  '''Approximate quantiles of a stream of values in constant memory: a merging digest of
+  at most about `compression` weighted centroids, kept finer towards the tails.  Estimates
+  are within 1/compression of the requested quantile in rank.'''
+
+  def __init__(self, compression=200):
+    self.compression = compression
+    self.means = np.zeros(0)
+    self.weights = np.zeros(0)
+
+  def add(self, values):
+    values = np.asarray(values, dtype=float).ravel()
+    if len(values)==0:
+      return
+    means = np.concatenate([self.means, values])
+    weights = np.concatenate([self.weights, np.ones(len(values))])
+    order = np.argsort(means, kind='stable')
+    means = means[order]
+    weights = weights[order]
+    # Bucket by quantile on an arcsine scale, so there are more, smaller centroids at the tails
+    centres = (np.cumsum(weights) - weights/2) / weights.sum()
+    buckets = np.floor(self.compression * (np.arcsin(2*centres - 1)/np.pi + 0.5)).astype(int)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    self.weights = np.add.reduceat(weights, starts)
+    self.means = np.add.reduceat(means*weights, starts) / self.weights
+
+  def quantile(self, q, minimum=None, maximum=None):
+    # Approximate quantile(s) q in [0, 1], optionally pinned to the exact min and max at the ends
+    if len(self.means)==0:
+      return np.full(np.shape(q), np.nan)
+    centres = (np.cumsum(self.weights) - self.weights/2) / self.weights.sum()
+    xp = np.concatenate([[0.0], centres, [1.0]])
+    fp = np.concatenate([[self.means[0] if minimum is None else minimum], self.means, [self.means[-1] if maximum is None else maximum]])
+    return np.interp(q, xp, fp)
+
+class MeasureAccumulator(object):
+  # Streaming statistics of M measures, fed (n x M) chunks of values with NaN for missing
+
+  def __init__(self, n_measures, compression=200):
+    self.count = np.zeros(n_measures, dtype=np.int64)
+    self.missing = np.zeros(n_measures, dtype=np.int64)
+    self.mean = np.zeros(n_measures)
+    self.m2 = np.zeros(n_measures) # sum of squared differences from the mean
+    self.min = np.full(n_measures, np.inf)
+    self.max = np.full(n_measures, -np.inf)
+    self.sketches = [QuantileSketch(compression) for _ in range(n_measures)]
+
+  def add(self, values):
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    present = ~np.isnan(values)
+    chunk_count = present.sum(axis=0)
+    self.missing += len(values) - chunk_count
+    has_values = chunk_count > 0
+    if not has_values.any():
+      return
+    with np.errstate(invalid='ignore', divide='ignore'):
+      chunk_mean = np.where(has_values, np.nansum(values, axis=0) / np.maximum(chunk_count, 1), 0.0)
+      chunk_m2 = np.nansum((values - chunk_mean)**2, axis=0)
+    # Chan et al. merge of (count, mean, M2) for the running totals and this chunk
+    total = self.count + chunk_count
+    delta = chunk_mean - self.mean
+    safe_total = np.maximum(total, 1)
+    self.mean = np.where(has_values, self.mean + delta*chunk_count/safe_total, self.mean)
+    self.m2 = np.where(has_values, self.m2 + chunk_m2 + delta**2*self.count*chunk_count/safe_total, self.m2)
+    self.count = total
+    self.min = np.where(has_values, np.fmin(self.min, np.nanmin(np.where(present, values, np.inf), axis=0)), self.min)
+    self.max = np.where(has_values, np.fmax(self.max, np.nanmax(np.where(present, values, -np.inf), axis=0)), self.max)
+    for measure_idx in np.flatnonzero(has_values):
+      self.sketches[measure_idx].add(values[present[:, measure_idx], measure_idx])
+
+  def summary(self, names, percentiles=SUMMARY_PERCENTILES):
+    # {measure name: {count, missing, mean, sd, min, max, p5, ...}} (NaN where there are no values)
+    summary = {}
+    for measure_idx, name in enumerate(names):
+      count = int(self.count[measure_idx])
+      stats = {'count': count, 'missing': int(self.missing[measure_idx])}
+      if count==0:
+        stats.update(mean=np.nan, sd=np.nan, min=np.nan, max=np.nan)
+        stats.update(('p%d' % p, np.nan) for p in percentiles)
+      else:
+        stats.update(mean=float(self.mean[measure_idx]),
+          sd=float(np.sqrt(self.m2[measure_idx]/(count - 1))) if count > 1 else np.nan,
+          min=float(self.min[measure_idx]), max=float(self.max[measure_idx]))
+        quantiles = self.sketches[measure_idx].quantile(np.array(percentiles)/100.0, self.min[measure_idx], self.max[measure_idx])
+        stats.update(('p%d' % p, float(value)) for p, value in zip(percentiles, quantiles))
+      summary[name] = stats
+    return summary
+
+def group_by_file(csv_filename, volume_name):
+  # Group key: the results file name without directory or extension
+  return os.path.splitext(os.path.basename(csv_filename))[0]
+
+def group_by_pattern(pattern):
+  '''Group key function taking the first group (or the whole match) of a regular expression
+  searched for in the volume name, falling back on the results file name.'''
+  regex = re.compile(pattern)
+  def group_key(csv_filename, volume_name):
+    match = regex.search(volume_name) or regex.search(os.path.basename(csv_filename))
+    if match is None:
+      return ''
+    return match.group(1) if regex.groups else match.group(0)
+  return group_key
+
+def parse_values(rows, n_measures):
+  # (n x M) float array from results CSV data rows, NotAvailable (or blank) as NaN
+  strings = np.array([row[:n_measures] for row in rows], dtype=str).reshape(len(rows), n_measures)
+  strings[(strings=='NotAvailable') | (strings=='')] = 'nan'
+  return strings.astype(float)
+
+class CohortStatistics(object):
+
+  def __init__(self, group_key=None, chunk_rows=10000, compression=200):
+    self.group_key = group_key
+    self.chunk_rows = chunk_rows
+    self.compression = compression
+    self.header = None # [names row, units row], from the first file
+    self.groups = {} # group key ('' without grouping) -> MeasureAccumulator
+    self.n_rows = 0
+
+  @property
+  def names(self):
+    return self.header[0][:-1] if self.header is not None else []
+
+  @property
+  def units(self):
+    return self.header[1] if self.header is not None else []
+
+  def add_file(self, csv_filename):
+    # Stream one results file into the statistics, the latest row of each volume only.  Holds
+    # the number of each volume's last row while reading, so memory grows with the volumes
+    with open(csv_filename, newline='') as f:
+      reader = csv.reader(f)
+      header = [next(reader, None), next(reader, None)]
+      if header[0] is None or header[1] is None:
+        return # empty file
+      if self.header is None:
+        self.header = header
+      elif header!=self.header:
+        raise ResultsHeaderMismatch('"%s" holds a different set of measures than the other results files' % csv_filename)
+      last_rows = {} # volume name -> number of its last data row
+      n_rows = 0
+      for row in reader:
+        if len(row)==0:
+          continue
+        last_rows[row[-1]] = n_rows
+        n_rows += 1
+    with open(csv_filename, newline='') as f:
+      reader = csv.reader(f)
+      next(reader, None)
+      next(reader, None)
+      chunk = []
+      row_idx = -1
+      for row in reader:
+        if len(row)==0:
+          continue
+        row_idx += 1
+        if row_idx>=n_rows:
+          break # appended since the first pass
+        if last_rows[row[-1]]!=row_idx:
+          continue # superseded by a later row
+        chunk.append(row)
+        if len(chunk)>=self.chunk_rows:
+          self._add_chunk(csv_filename, chunk)
+          chunk = []
+      if chunk:
+        self._add_chunk(csv_filename, chunk)
+
+  def _add_chunk(self, csv_filename, rows):
+    n_measures = len(self.names)
+    self.n_rows += len(rows)
+    if self.group_key is None:
+      self._accumulator('').add(parse_values(rows, n_measures))
+      return
+    grouped = {}
+    for row in rows:
+      grouped.setdefault(self.group_key(csv_filename, row[-1]), []).append(row)
+    for key, group_rows in grouped.items():
+      self._accumulator(key).add(parse_values(group_rows, n_measures))
+
+  def _accumulator(self, key):
+    accumulator = self.groups.get(key)
+    if accumulator is None:
+      accumulator = self.groups[key] = MeasureAccumulator(len(self.names), self.compression)
+    return accumulator
+
+  def summary(self):
+    # {group key: {measure name: {count, missing, mean, sd, min, max, p5, ...}}}
+    return {key: accumulator.summary(self.names) for key, accumulator in sorted(self.groups.items())}
+
+  def summary_rows(self):
+    # Flat rows (group, measure, units, statistics...), with a header row first
+    stat_names = ['count', 'missing', 'mean', 'sd', 'min', 'max'] + ['p%d' % p for p in SUMMARY_PERCENTILES]
+    rows = [['Group', 'Measure', 'Units'] + stat_names]
+    for key, measures in self.summary().items():
+      for measure_idx, (name, stats) in enumerate(measures.items()):
+        rows.append([key, name, self.units[measure_idx]] + [stats[stat_name] for stat_name in stat_names])
+    return rows
+
+  def report_str(self):
+    # Text report, one "measure: mean (SD) [min, max] n=count" line per measure and group
+    report_str = ''
+    for key, measures in self.summary().items():
+      if key!='' or len(self.groups)>1:
+        report_str += '%s:\n' % key
+      for measure_idx, (name, stats) in enumerate(measures.items()):
+        report_str += '%s: %0.2f (SD %0.2f) [%0.2f, %0.2f] median %0.2f %s, n=%d\n' % (name, stats['mean'], stats['sd'],
+          stats['min'], stats['max'], stats['p50'], self.units[measure_idx], stats['count'])
+    return report_str
+
+  def write_csv(self, filename):
+    with open(filename, mode='w', newline='') as f:
+      csv.writer(f).writerows(self.summary_rows())
+
+def summarize_results_files(csv_filenames, group_key=None, chunk_rows=10000):
+  # CohortStatistics over all the given results files
+  statistics = CohortStatistics(group_key=group_key, chunk_rows=chunk_rows)
+  for csv_filename in csv_filenames:
+    statistics.add_file(csv_filename)
+  return statistics
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Summary statistics of airway measures over results CSV files')
+  parser.add_argument('csv_filenames', nargs='+', help='results CSV files')
+  parser.add_argument('--group-by', help='"file" to group by results file, or a regular expression whose first group (searched for in the volume name) is the group')
+  parser.add_argument('--out', help='write the summary to this CSV file instead of printing it')
+  args = parser.parse_args(argv)
+  group_key = None
+  if args.group_by=='file':
+    group_key = group_by_file
+  elif args.group_by:
+    group_key = group_by_pattern(args.group_by)
+  statistics = summarize_results_files(args.csv_filenames, group_key=group_key)
+  if args.out:
+    statistics.write_csv(args.out)
+  else:
+    print(statistics.report_str())
+  return 0
+
+if __name__=='__main__':
+  sys.exit(main())
@@ -0,0 +1,363 @@
+"""Slicer-independent airway landmark geometry.
+
+Everything in here works on plain NumPy arrays of RAS coordinates so that it can
+be used by the Slicer module, by headless batch processing and by worker processes
+without the Slicer runtime.  It only needs NumPy, so it imports in milliseconds
+(beyond NumPy itself): the FH reorientation is solved in closed form rather than
+with scipy.spatial.transform.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Frankfurt Horizontal defining landmarks
+FH_LANDMARK_NAMES = ['Left ear FH', 'Right ear FH', 'Left orbit FH']
+
+# Landmarks needed by the airway measures, in the default column order of
+# the coordinate arrays handled by calculate_measures_array()
+MEASURE_LANDMARK_NAMES = [
+  'Tongue (superior aspect)',
+  'Tongue (anterior aspect)',
+  'Vallecula (inferior aspect)',
+  'Anterior Nasal Spine',
+  'Hyoid (central point)',
+  'C2 (anterior inferior aspect)',
+  'C3 (anterior aspect)',
+  'Pogonion',
+  'Nasion',
+  'Basion',
+  'Left condylion',
+  'Left gonion',
+  'Right condylion',
+  'Right gonion',
+]
+
+#
+# Row-wise vector helpers, each row is one point or vector
+# These do the same operations in the same order as the single point helpers below, so
+# they round the same, except for the squares: both square with **2, but NumPy squares an
+# array exactly (as x*x), whereas **2 on a NumPy scalar goes through the C library's pow(),
+# which can be 1 ulp off.  Only the squared terms of project() (the hyoid posterior
+# distance) and distance_sag() (the hyoid anterior distance) are affected: those measures
+# can differ from the single point formulas by 1 ulp of the distances involved (about
+# 1.4e-14 mm at 100 mm), and every other measure is bit-identical.
+#
+
+def dot_rows(u, v):
+  # Row-wise dot product of two (N x 3) arrays. Done as a stack of (1x3)@(3x1) products so
+  # that the rounding is identical to np.dot() on a single pair of vectors
+  u = np.asarray(u, dtype=float)
+  v = np.asarray(v, dtype=float)
+  return np.matmul(u[..., np.newaxis, :], v[..., :, np.newaxis])[..., 0, 0]
+
+def norm_rows(u):
+  # Row-wise Euclidean norm of an (N x 3) array
+  return np.sqrt(dot_rows(u, u))
+
+def project_rows(u, v):
+  # Row-wise projection of u onto v
+  return (dot_rows(u, v) / norm_rows(v)**2)[..., np.newaxis] * v
+
+def distance_sag_rows(p1, p2):
+  # Row-wise distance ignoring the R coordinate, i.e. in a common sagittal plane
+  return np.sqrt((p1[...,1]-p2[...,1])**2 + (p1[...,2]-p2[...,2])**2)
+
+def distance_3D_rows(p1, p2):
+  # Row-wise 3D distance between points
+  return norm_rows(np.subtract(p2, p1))
+
+def angle_rows(v1, v2):
+  # Row-wise angle between vectors in degrees, 0 to 180
+  return 180/np.pi * np.arccos(dot_rows(v1, v2) / (norm_rows(v1) * norm_rows(v2)))
+
+#
+# Single point/vector helpers
+#
+
+def project(u, v):
+  # Returns the projection of u onto v
+  proj = np.dot(u,v) / np.linalg.norm(v)**2 * np.array(v)
+  return proj
+
+def distance_sag(p1, p2):
+  # Find distance between point 1 and 2 ignoring the R coordinate, i.e. projecting
+  # the two into a common sagittal plane before finding the distance between them.
+  p1 = np.array(p1)
+  p2 = np.array(p2)
+  dist_sag = np.sqrt((p1[1]-p2[1])**2 + (p1[2]-p2[2])**2)
+  return dist_sag
+
+def distance_3D(p1,p2):
+  # Find 3D distance between points 1 and 2
+  dist = np.linalg.norm(np.subtract(p2,p1))
+  return dist
+
+def angle(v1,v2):
+  # Find angle between the two given vectors in degrees, 0 to 180
+  ang_deg = 180/np.pi * np.arccos(np.dot(v1, v2)/ (np.linalg.norm(v1) * np.linalg.norm(v2)))
+  return ang_deg
+
+#
+# Measure definitions
+#
+
+# RAS coordinate indices
+R=0
+A=1
+S=2
+
+class MeasureDefinition(namedtuple('MeasureDefinition', ['name', 'units', 'number_format', 'landmarks', 'compute'])):
+  '''One airway measure: its name, units and number format for reporting, the landmarks it
+  depends on, and a pure compute function which takes one (N x 3) array of positions per
+  landmark (in the order listed) and returns the (N,) measure values.'''
+  __slots__ = ()
+
+#
+# Measure compute functions
+#
+
+def tongue_height(tongue_superior, vallecula):
+  return tongue_superior[:,S] - vallecula[:,S]
+
+def tongue_anterior_position(tongue_anterior, ans):
+  return ans[:,A] - tongue_anterior[:,A]
+
+def tongue_superior_position(tongue_superior, ans):
+  return ans[:,S] - tongue_superior[:,S]
+
+def hyoid_posterior_distance(hyoid, c2, c3):
+  # Shortest distance from the line connecting c2 and c3 to the hyoid center, found by
+  # subtracting the projection of h-c2 onto c2-c3 from h-c2
+  line_vector = c3 - c2
+  h_to_c2 = c2 - hyoid
+  perp = h_to_c2 - project_rows(h_to_c2, line_vector)
+  return norm_rows(perp)
+
+def hyoid_craniocaudal_position(hyoid, ans):
+  return hyoid[:,S] - ans[:,S]
+
+def vertex_angle(end1, vertex, end2):
+  # Angle at vertex between the vectors from end1 and end2 (as used by the gonial angles)
+  return angle_rows(vertex - end1, vertex - end2)
+
+def pogonial_angle(left_gonion, right_gonion, pog):
+  return angle_rows(left_gonion - pog, right_gonion - pog)
+
+# All the airway measures, in report order. Add new measures here.
+MEASURE_DEFINITIONS = [
+  MeasureDefinition('Tongue height', 'mm', '%0.1f',
+    ('Tongue (superior aspect)', 'Vallecula (inferior aspect)'), tongue_height),
+  MeasureDefinition('Tongue anterior position', 'mm', '%+0.1f',
+    ('Tongue (anterior aspect)', 'Anterior Nasal Spine'), tongue_anterior_position),
+  MeasureDefinition('Tongue superior position (relative to anterior nasal spine)', 'mm', '%+0.1f',
+    ('Tongue (superior aspect)', 'Anterior Nasal Spine'), tongue_superior_position),
+  MeasureDefinition('Hyoid posterior distance (relative to C2-C3)', 'mm', '%0.1f',
+    ('Hyoid (central point)', 'C2 (anterior inferior aspect)', 'C3 (anterior aspect)'), hyoid_posterior_distance),
+  MeasureDefinition('Hyoid anterior distance (relative to pogonion)', 'mm', '%0.1f',
+    ('Hyoid (central point)', 'Pogonion'), distance_sag_rows),
+  MeasureDefinition('Hyoid craniocaudal position (relative to anterior nasal spine)', 'mm', '%+0.1f',
+    ('Hyoid (central point)', 'Anterior Nasal Spine'), hyoid_craniocaudal_position),
+  MeasureDefinition('Nasion to Basion distance', 'mm', '%0.1f',
+    ('Nasion', 'Basion'), distance_3D_rows),
+  MeasureDefinition('Left mandibular ramus height', 'mm', '%0.1f',
+    ('Left condylion', 'Left gonion'), distance_3D_rows),
+  MeasureDefinition('Right mandibular ramus height', 'mm', '%0.1f',
+    ('Right condylion', 'Right gonion'), distance_3D_rows),
+  MeasureDefinition('Inferior pogonial angle', 'degrees', '%0.1f',
+    ('Left gonion', 'Right gonion', 'Pogonion'), pogonial_angle),
+  MeasureDefinition('Bigonial distance', 'mm', '%0.1f',
+    ('Left gonion', 'Right gonion'), distance_3D_rows),
+  MeasureDefinition('Left mandibular body length', 'mm', '%0.1f',
+    ('Left gonion', 'Pogonion'), distance_3D_rows),
+  MeasureDefinition('Right mandibular body length', 'mm', '%0.1f',
+    ('Right gonion', 'Pogonion'), distance_3D_rows),
+  MeasureDefinition('Left mandibular total length (condylion to pogonion line)', 'mm', '%0.1f',
+    ('Left condylion', 'Pogonion'), distance_3D_rows),
+  MeasureDefinition('Right mandibular total length (condylion to pogonion line)', 'mm', '%0.1f',
+    ('Right condylion', 'Pogonion'), distance_3D_rows),
+  MeasureDefinition('Left gonial angle substitute (condyl-gon-pog)', 'degrees', '%0.1f',
+    ('Left condylion', 'Left gonion', 'Pogonion'), vertex_angle),
+  MeasureDefinition('Right gonial angle substitute (condyl-gon-pog)', 'degrees', '%0.1f',
+    ('Right condylion', 'Right gonion', 'Pogonion'), vertex_angle),
+]
+
+MEASURE_NAMES = [definition.name for definition in MEASURE_DEFINITIONS]
+
+def measure_dependency_index(definitions=None):
+  # Return {landmark name: [indices of the measures which depend on it]}
+  if definitions is None:
+    definitions = MEASURE_DEFINITIONS
+  index = {}
+  for measureIdx, definition in enumerate(definitions):
+    for landmark_name in definition.landmarks:
+      index.setdefault(landmark_name, []).append(measureIdx)
+  return index
+
+def compute_measure(definition, get_landmarks):
+  # Evaluate one measure, get_landmarks(name) returning the (N x 3) positions of a landmark
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return definition.compute(*[get_landmarks(landmark_name) for landmark_name in definition.landmarks])
+
+def calculate_measures_array(coords, missing=None, landmark_names=None):
+  '''Calculate every airway measure for a cohort in one vectorized pass.
+  coords is an (N subjects x L landmarks x 3) array of RAS positions and missing is an
+  optional (N x L) boolean mask which is True where a landmark was not placed (NaN
+  coordinates are treated as missing too).  landmark_names gives the landmark in each of
+  the L columns and defaults to MEASURE_LANDMARK_NAMES; extra columns are ignored.
+  Returns an (N x M) array with one column per entry of MEASURE_DEFINITIONS, holding NaN
+  wherever a needed landmark is missing.
+  '''
+  coords, missing, landmark_names = _check_cohort_arrays(coords, missing, landmark_names)
+  N = coords.shape[0]
+  # Blank out missing landmarks so that every measure depending on them comes out NaN
+  coords = np.where(missing[:,:,np.newaxis], np.nan, coords)
+  column = {name: idx for idx, name in enumerate(landmark_names)}
+  def get_landmarks(landmark_name):
+    if landmark_name in column:
+      return coords[:, column[landmark_name], :]
+    return np.full((N,3), np.nan)
+
+  measures = np.empty((N, len(MEASURE_DEFINITIONS)))
+  for measureIdx, definition in enumerate(MEASURE_DEFINITIONS):
+    measures[:,measureIdx] = compute_measure(definition, get_landmarks)
+  return measures
+
+def measures_available(missing, landmark_names=None):
+  '''Given an (N x L) missing landmark mask, return an (N x M) boolean array which is True
+  where all the landmarks needed for a measure are present'''
+  missing = np.asarray(missing, dtype=bool)
+  if landmark_names is None:
+    landmark_names = MEASURE_LANDMARK_NAMES
+  column = {name: idx for idx, name in enumerate(landmark_names)}
+  available = np.zeros((missing.shape[0], len(MEASURE_DEFINITIONS)), dtype=bool)
+  for measureIdx, definition in enumerate(MEASURE_DEFINITIONS):
+    if all(name in column for name in definition.landmarks):
+      available[:,measureIdx] = ~np.any(missing[:, [column[name] for name in definition.landmarks]], axis=1)
+  return available
+
+class IncrementalMeasures(object):
+  '''Airway measures for a single case which are kept up to date as landmarks change.
+  Uses the landmark -> measure dependency index so that moving, placing or removing a
+  landmark only recomputes the measures which depend on it.'''
+
+  def __init__(self, definitions=None):
+    self.definitions = definitions if definitions is not None else MEASURE_DEFINITIONS
+    self.dependents = measure_dependency_index(self.definitions)
+    self.positions = {} # landmark name -> (1 x 3) position array, only for placed landmarks
+    self.values = np.full(len(self.definitions), np.nan)
+    self.available = np.zeros(len(self.definitions), dtype=bool)
+
+  def set_landmarks(self, landmark_positions):
+    '''Update landmarks from {name: RAS position, or None if removed} and recompute just
+    the measures which depend on them.  Returns the sorted indices of recomputed measures.'''
+    affected = set()
+    for landmark_name, position in landmark_positions.items():
+      if landmark_name not in self.dependents:
+        continue # no measure uses this landmark
+      if position is None:
+        self.positions.pop(landmark_name, None)
+      else:
+        self.positions[landmark_name] = np.array(position, dtype=float).reshape(1,3)
+      affected.update(self.dependents[landmark_name])
+    for measureIdx in affected:
+      self.recompute(measureIdx)
+    return sorted(affected)
+
+  def set_landmark(self, landmark_name, position):
+    return self.set_landmarks({landmark_name: position})
+
+  def recompute(self, measureIdx):
+    definition = self.definitions[measureIdx]
+    if all(name in self.positions for name in definition.landmarks):
+      self.values[measureIdx] = compute_measure(definition, self.positions.__getitem__)[0]
+      self.available[measureIdx] = True
+    else:
+      self.values[measureIdx] = np.nan
+      self.available[measureIdx] = False
+
+def _check_cohort_arrays(coords, missing, landmark_names):
+  # Validate and normalize the (N x L x 3) coordinate array and (N x L) missing mask
+  coords = np.asarray(coords, dtype=float)
+  if coords.ndim != 3 or coords.shape[2] != 3:
+    raise ValueError('Landmark coordinates must be an (N x L x 3) array, got shape %s' % (coords.shape,))
+  if landmark_names is None:
+    landmark_names = MEASURE_LANDMARK_NAMES
+  if len(landmark_names) != coords.shape[1]:
+    raise ValueError('Got %d landmark names for %d landmark columns' % (len(landmark_names), coords.shape[1]))
+  nan_mask = np.isnan(coords).any(axis=2)
+  if missing is None:
+    missing = nan_mask
+  else:
+    missing = np.asarray(missing, dtype=bool)
+    if missing.shape != coords.shape[:2]:
+      raise ValueError('Missing mask must have shape %s, got %s' % (coords.shape[:2], missing.shape))
+    missing = missing | nan_mask
+  return coords, missing, landmark_names
+
+#
+# Frankfurt Horizontal reorientation
+#
+
+def sort_fh_points(fh_points):
+  '''Put N sets of three FH points (N x 3 x 3, in any order within each set) into
+  (left ear, right ear, orbit) order.  The orbit is identified as the most anterior
+  point and the right ear as the more rightward of the other two.'''
+  fh_points = np.asarray(fh_points, dtype=float)
+  rows = np.arange(fh_points.shape[0])[:, np.newaxis]
+  # Orbit goes last, then the two ears are ordered left (lower R) to right
+  order = np.argsort(fh_points[:,:,A], axis=1, kind='stable')
+  ears = order[:, :2]
+  ear_order = np.argsort(fh_points[rows, ears, R], axis=1, kind='stable')
+  order = np.concatenate([np.take_along_axis(ears, ear_order, axis=1), order[:, 2:]], axis=1)
+  return fh_points[rows, order]
+
+def fh_rotation_matrices(fh_points, tol=1e-6):
+  '''Vectorized Frankfurt Horizontal reorientation for a cohort.
+  fh_points is an (N x 3 x 3) array holding, for each case, the RAS positions of the left
+  ear canal, right ear canal and left orbit base, in that order.  Returns (rotations, valid):
+  rotations is (N x 3 x 3), each the rotation which brings that case's FH plane to an axial
+  plane (plane normal to [0,0,-1]) with the left to right ear direction along [1,0,0], and
+  valid is an (N,) boolean mask.  Cases where the points are missing (NaN), coincident or
+  collinear within tol (sine of the angle between the orbit-to-ear vectors) do not define
+  a plane; they are marked invalid and get NaN rotations.
+
+  The rotation is built in closed form from the FH frame: its rows are the unit left to
+  right ear vector, the in-plane anterior direction, and the upward plane normal.
+  '''
+  fh_points = np.asarray(fh_points, dtype=float)
+  if fh_points.ndim!=3 or fh_points.shape[1:]!=(3,3):
+    raise ValueError('FH points must be an (N x 3 x 3) array, got shape %s' % (fh_points.shape,))
+  left_ear = fh_points[:,0]
+  right_ear = fh_points[:,1]
+  orbit = fh_points[:,2]
+  vectorA = orbit - right_ear
+  vectorB = orbit - left_ear
+  with np.errstate(invalid='ignore', divide='ignore'):
+    orig_normal = np.cross(vectorA, vectorB)
+    normal_length = norm_rows(orig_normal)
+    sine = normal_length / (norm_rows(vectorA) * norm_rows(vectorB))
+    valid = np.isfinite(sine) & (sine > tol)
+    up = -orig_normal / normal_length[:, np.newaxis] # goes to [0,0,1], i.e. orig_normal goes to [0,0,-1]
+    left_to_right = right_ear - left_ear
+    # Both ears lie in the FH plane, so this is already perpendicular to the normal; the
+    # projection just removes round-off
+    left_to_right = left_to_right - project_rows(left_to_right, up)
+    x_axis = left_to_right / norm_rows(left_to_right)[:, np.newaxis]
+    y_axis = np.cross(up, x_axis)
+  rotations = np.stack([x_axis, y_axis, up], axis=1)
+  rotations[~valid] = np.nan
+  return rotations, valid
+
+def fh_rotation_matrix(FHpoints):
+  '''Return the 3x3 rotation matrix which brings the three Frankfurt Horizontal points
+  (left ear canal, right ear canal and left orbit base, RAS, in any order) into an axial
+  plane with the ears aligned left to right.  The orbit is identified as the most anterior
+  point and the right ear as the more rightward of the other two.  Raises ValueError if
+  the points do not define a plane.'''
+  FHpoints = np.asarray(FHpoints, dtype=float)
+  if FHpoints.shape!=(3,3):
+    raise ValueError("There must be exactly 3 fiducial points to reorient to FH, left ear canal, right ear canal, and left orbit base")
+  rotations, valid = fh_rotation_matrices(sort_fh_points(FHpoints[np.newaxis]))
+  if not valid[0]:
+    raise ValueError("The 3 FH points are coincident or collinear, so they do not define a plane to reorient to")
+  return rotations[0]
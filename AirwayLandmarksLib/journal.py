@@ -0,0 +1,170 @@
+"""Append-only journal of landmark placements, for recovery after a crash.
+
+Every placement, reset and reorientation is appended to a per-volume journal
+file as one short JSON line, e.g.
+
+  {"t":1700000000.1,"op":"place","node":"landmarks","label":"Basion","pos":[1.2,-30.5,12.0]}
+
+by a background thread, so the module never waits on the disk.  Each session
+(each time the journal is opened) starts with a session record naming the
+volume it belongs to, e.g. its file path, and a replay only goes back to the
+last session record, so a journal left over from an earlier session or from
+another volume of the same name is never mixed in.  Once the landmarks are
+saved the journal is truncated, as there is nothing left to recover.
+
+Replaying the last session in order gives back the last state of each landmark.
+Positions are the markups nodes' local coordinates (original image space), so a
+replay is independent of any FH reorientation, which is just redone afterwards.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+SESSION = 'session'
+PLACE = 'place'
+RESET = 'reset'
+REORIENT = 'reorient'
+
+class PlacementJournal(object):
+
+  _STOP = object()
+  _TRUNCATE = object()
+
+  def __init__(self, filename, identity=None):
+    # identity: JSON-able description of the volume (e.g. its file path), written at the start of each session
+    self.filename = filename
+    self.identity = identity
+    self.sessionStarted = False
+    self.error = None # the last error writing the journal, if any
+    self.queue = queue.Queue()
+    self.thread = threading.Thread(target=self._write_records, name='PlacementJournal', daemon=True)
+    self.thread.start()
+
+  def append(self, op, **fields):
+    # Queue a record for writing, returns right away
+    if not self.sessionStarted:
+      # The session record goes in with the first record, so an unused journal stays as it is
+      self.sessionStarted = True
+      self.queue.put({'t': round(time.time(), 3), 'op': SESSION, 'identity': self.identity})
+    record = {'t': round(time.time(), 3), 'op': op}
+    record.update(fields)
+    self.queue.put(record)
+
+  def place(self, node, label, pos):
+    self.append(PLACE, node=node, label=label, pos=[round(float(x), 4) for x in pos])
+
+  def reset(self, node, label):
+    self.append(RESET, node=node, label=label)
+
+  def reorient(self):
+    self.append(REORIENT)
+
+  def truncate(self):
+    # Empty the journal (once the landmarks are saved); later records start a new session
+    self.sessionStarted = False
+    self.queue.put(self._TRUNCATE)
+
+  def flush(self):
+    # Wait until everything queued so far is on disk
+    self.queue.join()
+
+  def close(self):
+    self.queue.put(self._STOP)
+    self.thread.join()
+
+  def _write_records(self):
+    f = None
+    try:
+      while True:
+        records = [self.queue.get()]
+        # Write whatever else has queued up in the same write and fsync
+        while True:
+          try:
+            records.append(self.queue.get_nowait())
+          except queue.Empty:
+            break
+        stop = any(record is self._STOP for record in records)
+        try:
+          f = self._write_batch(f, records)
+        except Exception as e:
+          # Keep going (and keep flush() from waiting forever): a full disk or unwritable
+          # directory only costs the crash recovery of these records
+          self.error = e
+          logging.warning('Could not write placement journal "%s": %s' % (self.filename, e))
+          if f is not None:
+            try:
+              f.close()
+            except OSError:
+              pass
+          f = None
+        finally:
+          for _ in records:
+            self.queue.task_done()
+        if stop:
+          return
+    finally:
+      if f is not None:
+        f.close()
+
+  def _write_batch(self, f, records):
+    # Write a batch of queued records to the journal file f (None if not open yet), returns the open file
+    # Records queued before the last truncation need not be written at all
+    truncate = [idx for idx, record in enumerate(records) if record is self._TRUNCATE]
+    if truncate:
+      records = records[truncate[-1] + 1:]
+      if f is not None:
+        f.close()
+      f = None
+      if os.path.exists(self.filename):
+        open(self.filename, mode='w').close()
+    lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records if record is not self._STOP)
+    if lines:
+      if f is None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        f = open(self.filename, mode='a')
+      f.write(lines)
+      f.flush()
+      os.fsync(f.fileno())
+    return f
+
+def read_journal(filename):
+  # All complete records in a journal file (a line cut short by a crash is skipped)
+  records = []
+  if not os.path.exists(filename):
+    return records
+  with open(filename) as f:
+    for line in f:
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        continue
+  return records
+
+def last_session(records):
+  '''(identity, records) of the last session in a journal's records: the identity its session
+  record gives and the records after it.  Journals written before session records were
+  added are one session with no identity.'''
+  starts = [idx for idx, record in enumerate(records) if record.get('op')==SESSION]
+  if not starts:
+    return None, records
+  return records[starts[-1]].get('identity'), records[starts[-1] + 1:]
+
+def replay_journal(records):
+  '''Replay the records of the last session in order.  Returns ({node: {label: pos}},
+  reoriented), with the final position of each landmark which was placed and not reset
+  since, and whether the landmarks had been reoriented to FH (redoing that uses the
+  recovered FH points).'''
+  positions = {}
+  reoriented = False
+  for record in last_session(records)[1]:
+    op = record.get('op')
+    if op==PLACE:
+      positions.setdefault(record['node'], {})[record['label']] = record['pos']
+    elif op==RESET:
+      positions.setdefault(record['node'], {}).pop(record['label'], None)
+    elif op==REORIENT:
+      reoriented = True
+  return positions, reoriented
@@ -0,0 +1,106 @@
+"""Readers for landmark files saved by Slicer, usable without a Slicer scene.
+
+Both formats are returned as an ordered {label: [R, A, S]} dict so they can be
+fed straight into the geometry functions.
+"""
+import csv
+import json
+import os
+
+MARKUPS_FILE_EXTENSIONS = ('.mrk.json', '.fcsv')
+
+# Landmark files saved for a volume are named "<volume stem><suffix><extension>", e.g.
+# "CT_FH_Landmarks.mrk.json" and "CT_Airway_Landmarks.mrk.json" for "CT.nii.gz"
+FH_LANDMARKS_SUFFIX = '_FH_Landmarks'
+AIRWAY_LANDMARKS_SUFFIX = '_Airway_Landmarks'
+LANDMARKS_SUFFIXES = (FH_LANDMARKS_SUFFIX, AIRWAY_LANDMARKS_SUFFIX)
+
+# Default column layout of .fcsv files, used if the file has no "# columns" line
+FCSV_DEFAULT_COLUMNS = ['id','x','y','z','ow','ox','oy','oz','vis','sel','lock','label','desc','associatedNodeID']
+
+def is_markups_file(filename):
+  return filename.lower().endswith(MARKUPS_FILE_EXTENSIONS)
+
+def read_markups_file(path):
+  '''Read control points from a .mrk.json or .fcsv file into {label: [R, A, S]}.
+  LPS files are converted to RAS.  If a label is repeated, the last point wins.'''
+  if path.lower().endswith('.mrk.json'):
+    return read_mrk_json(path)
+  elif path.lower().endswith('.fcsv'):
+    return read_fcsv(path)
+  raise ValueError('Unrecognized markups file type: "%s"' % path)
+
+def read_mrk_json(path):
+  with open(path) as f:
+    data = json.load(f)
+  points = {}
+  for markup in data.get('markups', []):
+    is_lps = markup.get('coordinateSystem', 'LPS').upper()=='LPS'
+    for control_point in markup.get('controlPoints', []):
+      if control_point.get('positionStatus', 'defined')!='defined':
+        continue # placement was never completed
+      points[control_point.get('label', '')] = to_ras(control_point['position'], is_lps)
+  return points
+
+def read_fcsv(path):
+  points = {}
+  columns = FCSV_DEFAULT_COLUMNS
+  is_lps = False # files older than Slicer 4.11 are RAS
+  with open(path, newline='') as f:
+    for row in csv.reader(f):
+      if len(row)==0:
+        continue
+      if row[0].startswith('#'):
+        header = ','.join(row)[1:].strip()
+        key, _, value = header.partition('=')
+        key = key.strip().lower()
+        value = value.strip()
+        if key=='coordinatesystem':
+          is_lps = value.upper() in ('LPS', '1')
+        elif key=='columns':
+          columns = [column.strip() for column in value.split(',')]
+        continue
+      entry = dict(zip(columns, row))
+      position = [float(entry['x']), float(entry['y']), float(entry['z'])]
+      points[entry.get('label', '')] = to_ras(position, is_lps)
+  return points
+
+def to_ras(position, is_lps):
+  R, A, S = [float(coord) for coord in position]
+  if is_lps:
+    R, A = -R, -A
+  return [R, A, S]
+
+def markups_file_stem(filename):
+  '''Volume stem a landmark file was saved for (see worklist.volume_stem): its name without
+  the extension and the FH/airway landmarks suffix, e.g. "CT" for "CT_FH_Landmarks.mrk.json".
+  '' for files without such a suffix, or saved under just the node name ("FH_Landmarks.mrk.json").'''
+  name = os.path.basename(filename)
+  for extension in MARKUPS_FILE_EXTENSIONS:
+    if name.lower().endswith(extension):
+      name = name[:-len(extension)]
+      break
+  for suffix in LANDMARKS_SUFFIXES:
+    if name.endswith(suffix):
+      return name[:-len(suffix)]
+  return ''
+
+def find_markups_files(root_dir):
+  '''Return {case name: [markups file paths]} for a directory tree.  Landmark files are
+  grouped by the volume stem they were saved for (see markups_file_stem), so the FH and
+  airway landmark files of a volume are measured together even when several volumes'
+  files share a directory; a case is named by its stem's path relative to root_dir, e.g.
+  "pt1/CT".  Files without a volume stem are one case per directory, named by the
+  directory's relative path.'''
+  cases = {}
+  for dirpath, dirnames, filenames in os.walk(root_dir):
+    dirnames.sort()
+    for filename in sorted(filenames):
+      if not is_markups_file(filename):
+        continue
+      stem = markups_file_stem(filename)
+      case_name = os.path.normpath(os.path.relpath(os.path.join(dirpath, stem), root_dir))
+      if case_name=='.':
+        case_name = os.path.basename(os.path.abspath(root_dir))
+      cases.setdefault(case_name, []).append(os.path.join(dirpath, filename))
+  return cases
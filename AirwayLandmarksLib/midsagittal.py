@@ -0,0 +1,180 @@
+"""Least-squares mid-sagittal plane and left/right asymmetry.
+
+The plane is fitted to the landmarks which lie on the midline together with the
+bilateral landmark pairs: the midline landmarks and the midpoint of each pair
+should lie on the plane, and the left-to-right vector of each pair should be
+along its normal.  Both are folded into one 3x3 matrix whose smallest
+eigenvector is the plane normal, and the sums it is built from are updated as
+single landmarks change, so refitting is a 3x3 eigenproblem however the
+landmarks got there.
+"""
+import numpy as np
+
+# Landmarks which lie on the mid-sagittal plane (the Mid-Sag column of the landmarks table)
+MID_SAG_LANDMARK_NAMES = [
+  'C5 (anterior inferior aspect)',
+  'C4 (anterior inferior aspect)',
+  'C2 (anterior inferior aspect)',
+  'Vallecula (inferior aspect)',
+  'Tongue (superior aspect)',
+  'Tongue (anterior aspect)',
+  'C3 (anterior aspect)',
+  'Hyoid (central point)',
+  'Pogonion',
+  'Nasion',
+  'Basion',
+]
+
+# (name, left landmark, right landmark) for the bilateral landmarks
+BILATERAL_PAIRS = [
+  ('Gonion', 'Left gonion', 'Right gonion'),
+  ('Condylion', 'Left condylion', 'Right condylion'),
+]
+
+class MidSagittalPlaneFit(object):
+  '''Mid-sagittal plane of a single case, kept up to date as landmarks change.'''
+
+  def __init__(self, mid_sag_names=None, bilateral_pairs=None):
+    self.mid_sag_names = set(mid_sag_names if mid_sag_names is not None else MID_SAG_LANDMARK_NAMES)
+    self.bilateral_pairs = bilateral_pairs if bilateral_pairs is not None else BILATERAL_PAIRS
+    self.pair_of = {}
+    for pair in self.bilateral_pairs:
+      self.pair_of[pair[1]] = pair
+      self.pair_of[pair[2]] = pair
+    self.positions = {} # landmark name -> position, only for placed landmarks
+    # Running sums over the points which should lie on the plane, and over the pair half-vectors
+    self.n_points = 0
+    self.sum_points = np.zeros(3)
+    self.sum_outer = np.zeros((3,3))
+    self.sum_pair_outer = np.zeros((3,3))
+    self.n_pairs = 0
+    self._plane = None
+    self._stale = False
+
+  def set_landmarks(self, landmark_positions):
+    '''Update landmarks from {name: RAS position, or None if removed}.  Returns True if
+    any of them is used by the fit (so the plane may have moved).'''
+    changed = False
+    for landmark_name, position in landmark_positions.items():
+      pair = self.pair_of.get(landmark_name)
+      if landmark_name not in self.mid_sag_names and pair is None:
+        continue
+      if pair is not None:
+        self._add_pair(pair, -1)
+      if landmark_name in self.mid_sag_names:
+        self._add_point(self.positions.get(landmark_name), -1)
+      if position is None:
+        self.positions.pop(landmark_name, None)
+      else:
+        self.positions[landmark_name] = np.array(position, dtype=float).reshape(3)
+      if landmark_name in self.mid_sag_names:
+        self._add_point(self.positions.get(landmark_name), +1)
+      if pair is not None:
+        self._add_pair(pair, +1)
+      changed = True
+    if changed:
+      self._stale = True
+    return changed
+
+  def set_landmark(self, landmark_name, position):
+    return self.set_landmarks({landmark_name: position})
+
+  def _add_point(self, point, sign):
+    if point is None:
+      return
+    self.n_points += sign
+    self.sum_points += sign*point
+    self.sum_outer += sign*np.outer(point, point)
+
+  def _add_pair(self, pair, sign):
+    # A pair contributes its midpoint as an on-plane point and its half-vector as a normal direction
+    left = self.positions.get(pair[1])
+    right = self.positions.get(pair[2])
+    if left is None or right is None:
+      return
+    self._add_point((left + right)/2, sign)
+    half = (right - left)/2
+    self.sum_pair_outer += sign*np.outer(half, half)
+    self.n_pairs += sign
+
+  @property
+  def plane(self):
+    '''(origin, unit normal) of the fitted plane, with the normal pointing to the right,
+    or None if the placed landmarks do not determine a plane.'''
+    if self._stale:
+      self._plane = self._fit()
+      self._stale = False
+    return self._plane
+
+  def _fit(self):
+    if self.n_points < 1:
+      return None
+    origin = self.sum_points/self.n_points
+    scatter = self.sum_outer - self.n_points*np.outer(origin, origin)
+    # Minimizing the squared point distances to the plane while maximizing the pair vectors' alignment with the normal
+    eigenvalues, eigenvectors = np.linalg.eigh(scatter - self.sum_pair_outer)
+    scale = max(np.abs(eigenvalues).max(), 1.0)
+    if eigenvalues[1] - eigenvalues[0] < 1e-9*scale:
+      return None # normal is not unique (e.g. only collinear midline points)
+    normal = eigenvectors[:,0]
+    if normal[0] < 0:
+      normal = -normal
+    return origin, normal
+
+  def signed_distance(self, point):
+    # Signed distance (positive to the right) of a point from the plane, or None without a plane
+    plane = self.plane
+    if plane is None:
+      return None
+    origin, normal = plane
+    return float(np.dot(np.asarray(point, dtype=float) - origin, normal))
+
+  def asymmetry(self):
+    '''Asymmetry index (%) of each bilateral pair, {name: index}: the difference of the left and
+    right landmarks' distances from the plane as a percentage of their sum (0 is symmetric).
+    Pairs which are not both placed, or all of them without a plane, are left out.'''
+    indexes = {}
+    if self.plane is None:
+      return indexes
+    for name, left_name, right_name in self.bilateral_pairs:
+      if left_name not in self.positions or right_name not in self.positions:
+        continue
+      left = abs(self.signed_distance(self.positions[left_name]))
+      right = abs(self.signed_distance(self.positions[right_name]))
+      total = left + right
+      indexes[name] = 100*abs(left - right)/total if total > 0 else 0.0
+    return indexes
+
+  def report_str(self):
+    # Text lines for the asymmetry indexes
+    asymmetry = self.asymmetry()
+    report_str = ''
+    for name, left_name, right_name in self.bilateral_pairs:
+      if name in asymmetry:
+        report_str += '%s asymmetry index: %0.1f %%\n' % (name, asymmetry[name])
+      else:
+        report_str += '%s asymmetry index: NotAvailable\n' % name
+    return report_str
+
+def plane_slice_to_ras(slice_to_ras, origin, normal):
+  '''Slice-to-RAS matrix (4 x 4) which shows the given plane, starting from a view's current
+  slice_to_ras: the view keeps its up direction as closely as possible and its handedness,
+  and is centred on origin.'''
+  slice_to_ras = np.asarray(slice_to_ras, dtype=float)
+  x_old, y_old, z_old = slice_to_ras[:3,0], slice_to_ras[:3,1], slice_to_ras[:3,2]
+  z = np.asarray(normal, dtype=float)
+  z = z/np.linalg.norm(z)
+  if np.dot(z, z_old) < 0:
+    z = -z
+  y = y_old - np.dot(y_old, z)*z
+  if np.linalg.norm(y) < 1e-6:
+    y = np.cross(z, x_old) # looking along the old up direction, fall back on the old x direction
+  y = y/np.linalg.norm(y)
+  handedness = 1.0 if np.dot(np.cross(x_old, y_old), z_old) >= 0 else -1.0
+  x = handedness*np.cross(y, z)
+  new_slice_to_ras = np.eye(4)
+  new_slice_to_ras[:3,0] = x
+  new_slice_to_ras[:3,1] = y
+  new_slice_to_ras[:3,2] = z
+  new_slice_to_ras[:3,3] = origin
+  return new_slice_to_ras
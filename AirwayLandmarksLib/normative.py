@@ -0,0 +1,130 @@
+"""Normative reference values for the airway measures, for z-scores and percentiles.
+
+A normative table is a CSV file in long format with the columns
+
+  Measure, Sex, Age, Mean, SD
+
+one row per measure, sex (M, F, or blank for both) and age in years.  It is
+loaded once into, for each sex, a sorted age grid with (ages x measures) arrays
+of means and SDs, so scoring a whole cohort is one vectorized interpolation
+whatever its size.  Between tabulated ages the mean and SD are interpolated
+linearly, beyond them they are held at the nearest age.  Sex-specific norms are
+used where available, falling back on the norms for both sexes.
+"""
+import csv
+import re
+
+import numpy as np
+
+BOTH_SEXES = ''
+
+def normalize_sex(sex):
+  # 'M' or 'F' for the usual spellings of male and female, '' (both/unknown) otherwise
+  sex = str(sex).strip().upper() if sex is not None else ''
+  if sex in ('M', 'MALE'):
+    return 'M'
+  if sex in ('F', 'FEMALE'):
+    return 'F'
+  return BOTH_SEXES
+
+def parse_dicom_age(age_string):
+  # Age in years from a DICOM Age String like "045Y", "010M", "003W" or "020D", or None
+  match = re.match(r'^\s*(\d+)\s*([DWMY])\s*$', age_string or '')
+  if match is None:
+    return None
+  days_per_unit = {'D': 1.0, 'W': 7.0, 'M': 365.25/12, 'Y': 365.25}
+  return int(match.group(1)) * days_per_unit[match.group(2)] / 365.25
+
+def normal_cdf(z):
+  # Standard normal CDF, vectorized (Abramowitz and Stegun 7.1.26 erf, error under 1.5e-7)
+  z = np.asarray(z, dtype=float)
+  x = np.abs(z)/np.sqrt(2)
+  t = 1/(1 + 0.3275911*x)
+  erf = 1 - t*(0.254829592 + t*(-0.284496736 + t*(1.421413741 + t*(-1.453152027 + t*1.061405429))))*np.exp(-x*x)
+  return 0.5*(1 + np.sign(z)*erf)
+
+def _interpolate_rows(grid, table, ages):
+  # Linearly interpolate the rows of table (tabulated at the sorted ages in grid) at ages, holding the ends
+  ages = np.clip(ages, grid[0], grid[-1])
+  lower = np.clip(np.searchsorted(grid, ages, side='right') - 1, 0, len(grid) - 1)
+  upper = np.minimum(lower + 1, len(grid) - 1)
+  span = grid[upper] - grid[lower]
+  weight = np.where(span > 0, (ages - grid[lower]) / np.where(span > 0, span, 1), 0.0)[:, np.newaxis]
+  return table[lower]*(1 - weight) + table[upper]*weight
+
+class NormativeTable(object):
+
+  def __init__(self, measures, sexes, ages, means, sds):
+    '''Build the index from long-format arrays, one entry per (measure, sex, age).'''
+    sexes = [normalize_sex(sex) for sex in sexes]
+    ages = np.asarray(ages, dtype=float)
+    means = np.asarray(means, dtype=float)
+    sds = np.asarray(sds, dtype=float)
+    self.measure_names = sorted(set(measures))
+    measure_columns = {name: col for col, name in enumerate(self.measure_names)}
+    self.tables = {} # sex -> (sorted age grid, means (A x M), SDs (A x M)), NaN where a measure has no norms
+    for sex in sorted(set(sexes)):
+      in_sex = np.array([entry_sex==sex for entry_sex in sexes])
+      grid = np.unique(ages[in_sex])
+      sex_means = np.full((len(grid), len(self.measure_names)), np.nan)
+      sex_sds = np.full((len(grid), len(self.measure_names)), np.nan)
+      for name in set(np.asarray(measures)[in_sex]):
+        entries = in_sex & (np.asarray(measures)==name)
+        order = np.argsort(ages[entries])
+        measure_ages = ages[entries][order]
+        sex_means[:, measure_columns[name]] = np.interp(grid, measure_ages, means[entries][order])
+        sex_sds[:, measure_columns[name]] = np.interp(grid, measure_ages, sds[entries][order])
+      self.tables[sex] = (grid, sex_means, sex_sds)
+
+  @classmethod
+  def from_csv(cls, filename):
+    measures, sexes, ages, means, sds = [], [], [], [], []
+    with open(filename, newline='') as f:
+      for row in csv.DictReader(f):
+        measures.append(row['Measure'].strip())
+        sexes.append(row.get('Sex', ''))
+        ages.append(float(row['Age']))
+        means.append(float(row['Mean']))
+        sds.append(float(row['SD']))
+    return cls(measures, sexes, ages, means, sds)
+
+  def lookup(self, ages, sexes=None, names=None):
+    '''Normative (means, SDs), each (N x M), for N cases of the given ages (years) and sexes
+    (None for unknown), for the measures in names (default: the table's own measures).
+    Measures without norms, and cases without an age, get NaN.'''
+    ages = np.atleast_1d(np.asarray(ages, dtype=float))
+    names = list(names) if names is not None else self.measure_names
+    columns = np.array([self.measure_names.index(name) if name in self.measure_names else -1 for name in names], dtype=int)
+    means = np.full((len(ages), len(self.measure_names)), np.nan)
+    sds = np.full((len(ages), len(self.measure_names)), np.nan)
+    has_age = ~np.isnan(ages)
+    if sexes is None:
+      sexes = [BOTH_SEXES] * len(ages)
+    # Normalize each distinct spelling once rather than every case
+    spellings, inverse = np.unique(np.asarray(sexes, dtype=object).astype(str), return_inverse=True)
+    sexes = np.array([normalize_sex(spelling) for spelling in spellings], dtype=str)[inverse.ravel()]
+    # Norms for both sexes first, then overwritten by the sex-specific ones wherever those exist
+    for sex in [BOTH_SEXES] + [sex for sex in self.tables if sex!=BOTH_SEXES]:
+      if sex not in self.tables:
+        continue
+      rows = has_age if sex==BOTH_SEXES else has_age & (sexes==sex)
+      if not rows.any():
+        continue
+      grid, table_means, table_sds = self.tables[sex]
+      sex_means = _interpolate_rows(grid, table_means, ages[rows])
+      sex_sds = _interpolate_rows(grid, table_sds, ages[rows])
+      available = ~np.isnan(sex_means)
+      means[rows] = np.where(available, sex_means, means[rows])
+      sds[rows] = np.where(available, sex_sds, sds[rows])
+    means = np.where(columns >= 0, means[:, columns], np.nan)
+    sds = np.where(columns >= 0, sds[:, columns], np.nan)
+    return means, sds
+
+  def scores(self, values, ages, sexes=None, names=None):
+    '''(z-scores, percentiles), each (N x M), of an (N x M) array of measure values for cases
+    of the given ages and sexes (see lookup).  NaN wherever the value or the norms are missing.'''
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    means, sds = self.lookup(ages, sexes, names)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      z = np.where(sds > 0, (values - means)/sds, np.nan)
+    return z, 100*normal_cdf(z)
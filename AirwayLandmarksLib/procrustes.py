@@ -0,0 +1,188 @@
+"""Cohort landmark QC by generalized Procrustes analysis.
+
+All cases' landmarks, as an (N x L x 3) array with missing landmarks masked,
+are aligned to a common mean shape by generalized Procrustes analysis
+(translation, rotation and optionally scale, fitted on each case's placed
+landmarks only), all cases at once with batched 3x3 SVDs.  Each landmark's
+scatter about the mean shape across the cohort then gives a per-case,
+per-landmark Mahalanobis distance: a landmark far out of its usual place
+relative to the rest of its case stands out with a large score, before it
+shows up as an odd measure.
+
+Usage:
+  python -m AirwayLandmarksLib.procrustes <landmarks root dir> <scores.csv> [--threshold T] [--no-scale]
+"""
+import argparse
+import csv
+import logging
+import sys
+
+import numpy as np
+
+from AirwayLandmarksLib.markupsfiles import find_markups_files, read_markups_file
+
+# sqrt of the 99.9th percentile of chi-squared with 3 degrees of freedom
+DEFAULT_OUTLIER_THRESHOLD = 4.03
+
+def _masked_centroids(coords, present):
+  # (N x 3) centroid of each case's present landmarks
+  weights = present[..., np.newaxis].astype(float)
+  return np.sum(np.where(weights > 0, coords, 0.0), axis=1) / np.maximum(weights.sum(axis=1), 1)
+
+def _normalize_shape(shape, landmark_present):
+  # Centre a mean shape and scale it to unit centroid size (over the landmarks it has)
+  centred = shape - np.nanmean(shape[landmark_present], axis=0)
+  size = np.sqrt(np.nansum(centred[landmark_present]**2))
+  return centred / size if size > 0 else centred
+
+def generalized_procrustes(coords, missing=None, scale=True, excluded=None, max_iter=50, tol=1e-10):
+  '''Align an (N x L x 3) cohort of landmark sets (NaN or `missing` for missing landmarks).
+  Landmarks marked in `excluded` (N x L) are moved with their case but left out of the fit.
+  Returns (aligned, mean_shape, alignable): aligned is (N x L x 3) in the mean shape's frame
+  (NaN where missing), mean_shape (L x 3) has unit centroid size, and alignable (N,) is False
+  for cases with fewer than 3 landmarks to fit, which are left out (all NaN).'''
+  coords = np.asarray(coords, dtype=float)
+  present = ~np.isnan(coords).any(axis=2)
+  if missing is not None:
+    present &= ~np.asarray(missing, dtype=bool)
+  fitted = present & ~np.asarray(excluded, dtype=bool) if excluded is not None else present
+  alignable = fitted.sum(axis=1) >= 3
+  landmark_present = (fitted & alignable[:, np.newaxis]).any(axis=0)
+  weights = (fitted & alignable[:, np.newaxis])[..., np.newaxis]
+  x = np.where(present[..., np.newaxis], coords, 0.0)
+  # Start from the centred cases' mean
+  centred = np.where(weights, x - _masked_centroids(x, weights[..., 0])[:, np.newaxis], np.nan)
+  with np.errstate(invalid='ignore'):
+    mean_shape = _normalize_shape(np.nanmean(centred, axis=0), landmark_present)
+  aligned = centred
+  for iteration in range(max_iter):
+    reference = np.where(weights, np.nan_to_num(mean_shape)[np.newaxis], 0.0)
+    # Centre each case and its matching part of the reference on the landmarks the case has
+    x_centroids = _masked_centroids(x, weights[..., 0])
+    ref_centroids = _masked_centroids(reference, weights[..., 0])
+    x0 = np.where(present[..., np.newaxis], x - x_centroids[:, np.newaxis], 0.0)
+    y0 = np.where(weights, reference - ref_centroids[:, np.newaxis], 0.0)
+    # Batched orthogonal Procrustes: rotation maximizing trace(R^T X0^T Y0), without reflections
+    u, s, vt = np.linalg.svd(np.einsum('nlj,nlk->njk', x0 * weights, y0))
+    d = np.sign(np.linalg.det(u @ vt))
+    d[d==0] = 1
+    s[:, 2] *= d
+    u[:, :, 2] *= d[:, np.newaxis]
+    rotations = u @ vt
+    if scale:
+      sizes = np.einsum('nlj,nlj->n', x0 * weights, x0)
+      scales = np.where(sizes > 0, s.sum(axis=1) / np.where(sizes > 0, sizes, 1), 1.0)
+    else:
+      scales = np.ones(len(x))
+    aligned = np.where(present[..., np.newaxis], scales[:, np.newaxis, np.newaxis] * (x0 @ rotations) + ref_centroids[:, np.newaxis], np.nan)
+    aligned[~alignable] = np.nan
+    with np.errstate(invalid='ignore'):
+      new_mean = np.nanmean(np.where(weights, aligned, np.nan), axis=0)
+    if scale:
+      new_mean = _normalize_shape(new_mean, landmark_present)
+    change = np.nansum((new_mean - mean_shape)**2)
+    mean_shape = new_mean
+    if change < tol:
+      break
+  return aligned, mean_shape, alignable
+
+def landmark_mahalanobis(aligned, mean_shape, reweight=True, regularization=1e-6):
+  '''Per-case, per-landmark Mahalanobis distance (N x L, NaN where missing) of each aligned
+  landmark from the mean shape, using that landmark's 3x3 covariance across the cohort.
+  With reweight, the covariance is estimated again without the cases which came out as
+  outliers the first time, so that gross misplacements do not mask themselves.'''
+  residuals = aligned - mean_shape[np.newaxis]
+  present = ~np.isnan(residuals).any(axis=2)
+  inlier = present.copy()
+  for _ in range(2 if reweight else 1):
+    r = np.where(inlier[..., np.newaxis], residuals, 0.0)
+    counts = np.maximum(inlier.sum(axis=0), 2)
+    centre = r.sum(axis=0) / counts[:, np.newaxis]
+    r = np.where(inlier[..., np.newaxis], residuals - centre[np.newaxis], 0.0)
+    covariances = np.einsum('nlj,nlk->ljk', r, r) / (counts - 1)[:, np.newaxis, np.newaxis]
+    # A little ridge so landmarks with (nearly) no scatter do not blow up
+    ridge = regularization * np.maximum(np.trace(covariances, axis1=1, axis2=2) / 3, 1e-12)
+    covariances += ridge[:, np.newaxis, np.newaxis] * np.eye(3)
+    inverses = np.linalg.inv(covariances)
+    d = np.where(present[..., np.newaxis], residuals - centre[np.newaxis], 0.0)
+    distances = np.sqrt(np.maximum(np.einsum('nlj,ljk,nlk->nl', d, inverses, d), 0))
+    inlier = present & (distances <= DEFAULT_OUTLIER_THRESHOLD)
+  distances[~present] = np.nan
+  return distances
+
+def cohort_qc(coords, missing=None, scale=True, threshold=DEFAULT_OUTLIER_THRESHOLD, max_rounds=3):
+  '''Procrustes QC of an (N x L x 3) cohort: returns (scores N x L, aligned N x L x 3, mean
+  shape L x 3).  Scores are Mahalanobis distances, NaN for missing landmarks and for cases
+  with too few landmarks to align.
+  A least-squares fit spreads one badly misplaced landmark's error over the whole case, so
+  for up to max_rounds rounds each case's worst landmark scoring above threshold is left
+  out of its fit and the cohort realigned, as long as the case keeps 4 landmarks to fit.'''
+  coords = np.asarray(coords, dtype=float)
+  present = ~np.isnan(coords).any(axis=2)
+  if missing is not None:
+    present &= ~np.asarray(missing, dtype=bool)
+  excluded = np.zeros(present.shape, dtype=bool)
+  for round_idx in range(max_rounds + 1):
+    aligned, mean_shape, alignable = generalized_procrustes(coords, ~present, scale=scale, excluded=excluded)
+    scores = landmark_mahalanobis(aligned, mean_shape)
+    scores[~alignable] = np.nan
+    if round_idx==max_rounds:
+      break
+    fit_scores = np.where(excluded, np.nan, scores)
+    with np.errstate(invalid='ignore'):
+      worst = np.argmax(np.nan_to_num(fit_scores, nan=-np.inf), axis=1)
+      exclude = (np.nan_to_num(fit_scores[np.arange(len(worst)), worst]) > threshold) & \
+        ((present & ~excluded).sum(axis=1) > 4)
+    if not exclude.any():
+      break
+    excluded[np.flatnonzero(exclude), worst[exclude]] = True
+  return scores, aligned, mean_shape
+
+def load_cohort(root_dir, landmark_names=None):
+  '''Read every case under root_dir (see markupsfiles.find_markups_files) into (case names,
+  landmark names, coords N x L x 3 with NaN for missing).  landmark_names defaults to every
+  label found, in order of first appearance.'''
+  case_names = []
+  case_points = []
+  for case_name, paths in sorted(find_markups_files(root_dir).items()):
+    points = {}
+    try:
+      for path in paths:
+        points.update(read_markups_file(path))
+    except Exception as e:
+      logging.warning('Skipping case "%s": %s' % (case_name, e))
+      continue
+    case_names.append(case_name)
+    case_points.append(points)
+  if landmark_names is None:
+    landmark_names = list(dict.fromkeys(label for points in case_points for label in points))
+  coords = np.full((len(case_points), len(landmark_names), 3), np.nan)
+  for case_idx, points in enumerate(case_points):
+    for landmark_idx, name in enumerate(landmark_names):
+      if name in points:
+        coords[case_idx, landmark_idx] = points[name]
+  return case_names, landmark_names, coords
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Flag misplaced landmarks across a cohort by generalized Procrustes analysis')
+  parser.add_argument('root_dir', help='directory tree holding .mrk.json/.fcsv landmark files, one case per volume')
+  parser.add_argument('csv_filename', help='CSV file to write the per-landmark outlier scores to')
+  parser.add_argument('--threshold', type=float, default=DEFAULT_OUTLIER_THRESHOLD, help='score above which a landmark is flagged (default: %0.2f)' % DEFAULT_OUTLIER_THRESHOLD)
+  parser.add_argument('--no-scale', action='store_true', help='align without scaling (sizes differ for real, e.g. across ages)')
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.INFO, format='%(message)s')
+  case_names, landmark_names, coords = load_cohort(args.root_dir)
+  scores, aligned, mean_shape = cohort_qc(coords, scale=not args.no_scale, threshold=args.threshold)
+  with open(args.csv_filename, mode='w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Case'] + landmark_names + ['Max Score', 'Flagged Landmarks'])
+    for case_name, case_scores in zip(case_names, scores):
+      flagged = [name for name, score in zip(landmark_names, case_scores) if score > args.threshold]
+      writer.writerow([case_name] + ['' if np.isnan(score) else '%0.2f' % score for score in case_scores]
+        + ['' if np.all(np.isnan(case_scores)) else '%0.2f' % np.nanmax(case_scores), '; '.join(flagged)])
+  n_flagged = int(np.sum(np.nan_to_num(scores) > args.threshold))
+  logging.info('Scored %d cases x %d landmarks, %d landmarks flagged, written to "%s"' % (len(case_names), len(landmark_names), n_flagged, args.csv_filename))
+  return 0
+
+if __name__=='__main__':
+  sys.exit(main())
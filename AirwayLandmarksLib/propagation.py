@@ -0,0 +1,108 @@
+"""Landmark propagation between the frames of a 4D series by local template matching.
+
+For each landmark, a small template patch around its voxel in one frame is
+matched against a slightly larger search patch around the same voxel in the
+next frame, using FFT-based normalized cross-correlation, and the best match
+(refined to sub-voxel precision) gives the proposed position in the next
+frame.  Patches are cut as slices of the frame arrays, so only the patches are
+ever copied, and the landmarks are matched in parallel on a thread pool (the
+FFTs release the GIL).
+
+Arrays are indexed in array order, which for slicer.util.arrayFromVolume is
+(K, J, I).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+def window_sums(array, window_shape):
+  # Sum of array over every position of a window of window_shape which fits inside it
+  sums = array
+  for axis, width in enumerate(window_shape):
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (1, 0)
+    cumulative = np.pad(np.cumsum(sums, axis=axis), pad)
+    n = cumulative.shape[axis]
+    sums = np.take(cumulative, np.arange(width, n), axis=axis) - np.take(cumulative, np.arange(0, n-width), axis=axis)
+  return sums
+
+def normalized_cross_correlation(search, template):
+  '''Normalized cross-correlation of template at every position where it fits inside
+  search (the "valid" positions), computed with FFTs.  Positions where the search
+  window or the template has no contrast get 0.'''
+  search = np.asarray(search, dtype=float)
+  template = np.asarray(template, dtype=float)
+  template = template - template.mean()
+  template_norm = np.sqrt(np.sum(template*template))
+  fft_shape = [s + t - 1 for s, t in zip(search.shape, template.shape)]
+  flipped = template[(slice(None, None, -1),) * template.ndim]
+  axes = tuple(range(search.ndim))
+  full = np.fft.irfftn(np.fft.rfftn(search, fft_shape, axes) * np.fft.rfftn(flipped, fft_shape, axes), fft_shape, axes)
+  numerator = full[tuple(slice(t-1, s) for s, t in zip(search.shape, template.shape))]
+  n = template.size
+  sums = window_sums(search, template.shape)
+  variance = np.maximum(window_sums(search*search, template.shape) - sums*sums/n, 0)
+  denominator = template_norm * np.sqrt(variance)
+  ncc = np.zeros(numerator.shape)
+  ok = denominator > 1e-9 * max(template_norm, 1.0)
+  ncc[ok] = numerator[ok] / denominator[ok]
+  return ncc
+
+def subvoxel_peak(ncc, peak):
+  # Refine the integer location of a maximum by fitting a parabola through it and its neighbours along each axis
+  refined = np.array(peak, dtype=float)
+  for axis in range(ncc.ndim):
+    if peak[axis]==0 or peak[axis]==ncc.shape[axis]-1:
+      continue
+    before = list(peak); before[axis] -= 1
+    after = list(peak); after[axis] += 1
+    f0, f_before, f_after = ncc[tuple(peak)], ncc[tuple(before)], ncc[tuple(after)]
+    curvature = f_before - 2*f0 + f_after
+    if curvature < 0:
+      refined[axis] += np.clip(0.5*(f_before - f_after)/curvature, -0.5, 0.5)
+  return refined
+
+def _as_radius(radius, ndim):
+  radius = np.broadcast_to(np.asarray(radius, dtype=int), (ndim,))
+  if np.any(radius < 1):
+    raise ValueError('Radii must be at least one voxel')
+  return radius
+
+def match_point(fixed, moving, center, template_radius, search_radius):
+  '''Find where the patch of fixed around the voxel center has moved to in moving.
+  Radii are in voxels (a number or one per axis).  Returns (displacement, score):
+  the sub-voxel displacement of the patch (centred on the voxel nearest center, so
+  also of center itself), in array index order, and the normalized
+  cross-correlation at the match (NaN displacement and score if center is outside
+  the volume).'''
+  shape = np.array(fixed.shape)
+  center = np.round(np.asarray(center, dtype=float)).astype(int)
+  if np.any(center < 0) or np.any(center >= shape):
+    return np.full(fixed.ndim, np.nan), np.nan
+  template_radius = _as_radius(template_radius, fixed.ndim)
+  search_radius = _as_radius(search_radius, fixed.ndim)
+  # Slicing gives views, so only these small patches are read out of the frames
+  template_lo = np.maximum(center - template_radius, 0)
+  template_hi = np.minimum(center + template_radius + 1, shape)
+  search_lo = np.maximum(template_lo - search_radius, 0)
+  search_hi = np.minimum(template_hi + search_radius, shape)
+  template = fixed[tuple(slice(lo, hi) for lo, hi in zip(template_lo, template_hi))]
+  search = moving[tuple(slice(lo, hi) for lo, hi in zip(search_lo, search_hi))]
+  ncc = normalized_cross_correlation(search, template)
+  peak = np.unravel_index(np.argmax(ncc), ncc.shape)
+  displacement = search_lo + subvoxel_peak(ncc, peak) - template_lo
+  return displacement, float(ncc[peak])
+
+def propagate_points(fixed, moving, centers, template_radius=5, search_radius=5, workers=None):
+  '''Match each of the (N x ndim) voxel centers from fixed into moving (see match_point),
+  spread over a pool of worker threads.  Returns (N x ndim) new positions, in array
+  index order, and the (N,) match scores.  Each center keeps its sub-voxel offset, so
+  between identical frames the points stay where they are.'''
+  centers = np.asarray(centers, dtype=float).reshape(-1, fixed.ndim)
+  if fixed.shape!=moving.shape:
+    raise ValueError('Frames have different dimensions %s and %s' % (fixed.shape, moving.shape))
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    matches = list(pool.map(lambda center: match_point(fixed, moving, center, template_radius, search_radius), centers))
+  displacements = np.array([displacement for displacement, score in matches]).reshape(centers.shape)
+  scores = np.array([score for displacement, score in matches])
+  return centers + displacements, scores
@@ -0,0 +1,202 @@
+"""Structured, array-backed airway measure results.
+
+A MeasureResults holds the measures for one or more cases as an (N x M) float
+array (NaN where a measure is not available) along with the name, unit and
+number format of each measure.  The text report, CSV, JSON and NumPy files are
+all renderings of the same object, so nothing ever has to be parsed back out
+of formatted text.
+"""
+import csv
+import json
+
+import numpy as np
+
+from AirwayLandmarksLib.geometry import MEASURE_DEFINITIONS
+
+# Landmarks sampled below this (in HU) are flagged in the report as probably placed in air
+AIR_HU = -400
+
+class MeasureResults(object):
+
+  def __init__(self, values, available=None, case_names=None, names=None, units=None, formats=None):
+    '''values is an (N x M) array (a single case may be given as a length M vector),
+    available an optional (N x M) boolean mask (default: wherever values is not NaN),
+    and names/units/formats describe the M measures (default: MEASURE_DEFINITIONS).'''
+    self.values = np.atleast_2d(np.asarray(values, dtype=float))
+    if available is None:
+      available = ~np.isnan(self.values)
+    self.available = np.atleast_2d(np.asarray(available, dtype=bool))
+    n_cases, n_measures = self.values.shape
+    if self.available.shape!=self.values.shape:
+      raise ValueError('Availability mask shape %s does not match values shape %s' % (self.available.shape, self.values.shape))
+    self.names = list(names) if names is not None else [d.name for d in MEASURE_DEFINITIONS]
+    self.units = list(units) if units is not None else [d.units for d in MEASURE_DEFINITIONS]
+    self.formats = list(formats) if formats is not None else [d.number_format for d in MEASURE_DEFINITIONS]
+    if not len(self.names)==len(self.units)==len(self.formats)==n_measures:
+      raise ValueError('Need a name, unit and format for each of the %d measures' % n_measures)
+    if case_names is None:
+      case_names = [''] * n_cases
+    self.case_names = list(case_names)
+    if len(self.case_names)!=n_cases:
+      raise ValueError('Got %d case names for %d cases' % (len(self.case_names), n_cases))
+    self.zscores = None # (N x M) normative z-scores and percentiles, see add_normative_scores()
+    self.percentiles = None
+    self.landmark_names = [] # landmarks with sampled intensities, see add_landmark_intensities()
+    self.intensities = None # (N x L x 3) value at, mean and SD around each landmark (NaN if not sampled)
+
+  def add_normative_scores(self, normative_table, ages, sexes=None):
+    # Score every case against a NormativeTable in one pass (ages and sexes one per case)
+    self.zscores, self.percentiles = normative_table.scores(self.values, ages, sexes, names=self.names)
+    self.zscores[~self.available] = np.nan
+    self.percentiles[~self.available] = np.nan
+    return self
+
+  def add_landmark_intensities(self, landmark_names, values, means, sds):
+    # Image intensities at the landmarks, each (N x L), as sampled by AirwayLandmarksLib.sampling
+    self.landmark_names = list(landmark_names)
+    shape = (len(self), len(self.landmark_names))
+    self.intensities = np.stack([np.asarray(x, dtype=float).reshape(shape) for x in (values, means, sds)], axis=-1)
+    return self
+
+  def has_normative_score(self, measure_idx, case_idx=0):
+    return self.zscores is not None and not np.isnan(self.zscores[case_idx, measure_idx])
+
+  def __len__(self):
+    return self.values.shape[0]
+
+  def value(self, measure_name, case_idx=0):
+    # Value of the named measure, or None if not available
+    measure_idx = self.names.index(measure_name)
+    if not self.available[case_idx, measure_idx]:
+      return None
+    return float(self.values[case_idx, measure_idx])
+
+  def records(self, case_idx=0):
+    # One {name, value, unit, format} dict per measure for one case (value is None if not available),
+    # plus z and percentile where there are normative scores
+    records = []
+    for measure_idx, name in enumerate(self.names):
+      record = {
+        'name': name,
+        'value': float(self.values[case_idx, measure_idx]) if self.available[case_idx, measure_idx] else None,
+        'unit': self.units[measure_idx],
+        'format': self.formats[measure_idx],
+      }
+      if self.has_normative_score(measure_idx, case_idx):
+        record['z'] = float(self.zscores[case_idx, measure_idx])
+        record['percentile'] = float(self.percentiles[case_idx, measure_idx])
+      records.append(record)
+    return records
+
+  def value_strings(self, case_idx=0):
+    # Formatted values for one case, as they appear in the report
+    return [number_format % value if available else 'NotAvailable'
+      for number_format, value, available in zip(self.formats, self.values[case_idx], self.available[case_idx])]
+
+  def report_str(self, case_idx=0):
+    # The text report for one case, one "name: value units" line per measure
+    report_str = ''
+    for measure_idx, value_str in enumerate(self.value_strings(case_idx)):
+      if self.has_normative_score(measure_idx, case_idx):
+        report_str += '%s: %s %s (z %+0.2f, percentile %0.0f)\n' % (self.names[measure_idx], value_str, self.units[measure_idx],
+          self.zscores[case_idx, measure_idx], self.percentiles[case_idx, measure_idx])
+      elif self.available[case_idx, measure_idx]:
+        report_str += '%s: %s %s\n' % (self.names[measure_idx], value_str, self.units[measure_idx])
+      else:
+        report_str += '%s: NotAvailable\n' % self.names[measure_idx]
+    report_str += self.intensity_report_str(case_idx)
+    return report_str
+
+  def intensity_report_str(self, case_idx=0):
+    # Report lines for the landmark intensities of one case ('' if none were sampled)
+    if self.intensities is None or len(self.landmark_names)==0:
+      return ''
+    report_str = 'Landmark intensities (HU): value (sphere mean, SD)\n'
+    for landmark_idx, name in enumerate(self.landmark_names):
+      value, mean, sd = self.intensities[case_idx, landmark_idx]
+      if np.isnan(value):
+        report_str += '%s: NotAvailable\n' % name
+        continue
+      report_str += '%s: %0.0f (%0.0f, %0.0f)%s\n' % (name, value, mean, sd, ' in air?' if value < AIR_HU else '')
+    return report_str
+
+  def series_report_str(self):
+    # Text report across all cases (e.g. the frames of a 4D series), one line per measure
+    report_str = ''
+    for measure_idx, name in enumerate(self.names):
+      value_strs = [self.value_strings(case_idx)[measure_idx] for case_idx in range(len(self))]
+      report_str += '%s (%s): %s\n' % (name, self.units[measure_idx], ', '.join(value_strs))
+    return report_str
+
+  def csv_header(self):
+    # The two header rows of a results CSV: measure names and units
+    return self.names + ['Volume Name'], list(self.units)
+
+  def csv_rows(self, volume_names=None, full_precision=True):
+    '''Data rows for a results CSV, one per case, ending with the volume name.  Values are
+    written at full precision (round-tripping exactly), or with each measure's number
+    format (as in the report) if full_precision is False.'''
+    if volume_names is None:
+      volume_names = self.case_names
+    rows = []
+    for case_idx, volume_name in enumerate(volume_names):
+      if full_precision:
+        vals = [repr(float(value)) if available else 'NotAvailable'
+          for value, available in zip(self.values[case_idx], self.available[case_idx])]
+      else:
+        vals = self.value_strings(case_idx)
+      rows.append(vals + [volume_name])
+    return rows
+
+  def write_csv(self, filename, volume_names=None, full_precision=True):
+    # Write a new results CSV: names row, units row, then one row per case
+    col_names, units = self.csv_header()
+    with open(filename, mode='w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(col_names)
+      writer.writerow(units)
+      writer.writerows(self.csv_rows(volume_names, full_precision))
+
+  def to_json(self):
+    cases = [{'case_name': case_name, 'measures': self.records(case_idx)}
+      for case_idx, case_name in enumerate(self.case_names)]
+    if self.intensities is not None:
+      for case_idx, case in enumerate(cases):
+        case['landmarks'] = [dict(name=name, **{key: None if np.isnan(x) else x for key, x in zip(('value', 'mean', 'sd'), sample)})
+          for name, sample in zip(self.landmark_names, self.intensities[case_idx].tolist())]
+    return json.dumps({'cases': cases})
+
+  @classmethod
+  def from_json(cls, json_str):
+    cases = json.loads(json_str)['cases']
+    if len(cases)==0:
+      return cls(np.zeros((0, len(MEASURE_DEFINITIONS))))
+    records = cases[0]['measures']
+    values = [[np.nan if record['value'] is None else record['value'] for record in case['measures']] for case in cases]
+    results = cls(values, case_names=[case['case_name'] for case in cases],
+      names=[record['name'] for record in records],
+      units=[record['unit'] for record in records],
+      formats=[record['format'] for record in records])
+    if any('z' in record for case in cases for record in case['measures']):
+      results.zscores = np.array([[record.get('z', np.nan) for record in case['measures']] for case in cases], dtype=float)
+      results.percentiles = np.array([[record.get('percentile', np.nan) for record in case['measures']] for case in cases], dtype=float)
+    if 'landmarks' in cases[0]:
+      intensities = np.array([[[record[key] for key in ('value', 'mean', 'sd')] for record in case['landmarks']] for case in cases], dtype=float)
+      results.add_landmark_intensities([record['name'] for record in cases[0]['landmarks']], *np.moveaxis(intensities, -1, 0))
+    return results
+
+  def write_json(self, filename):
+    with open(filename, mode='w') as f:
+      f.write(self.to_json())
+
+  def write_npz(self, filename):
+    # Save the arrays (values, availability) and measure descriptions to a NumPy .npz file
+    np.savez(filename, values=self.values, available=self.available,
+      names=np.array(self.names), units=np.array(self.units), formats=np.array(self.formats),
+      case_names=np.array(self.case_names))
+
+  @classmethod
+  def load_npz(cls, filename):
+    with np.load(filename) as data:
+      return cls(data['values'], data['available'], case_names=data['case_names'].tolist(),
+        names=data['names'].tolist(), units=data['units'].tolist(), formats=data['formats'].tolist())
@@ -0,0 +1,275 @@
+"""Shared results CSV files which several annotators can write to at once.
+
+A results CSV has a row of measure names (ending with "Volume Name"), a row of
+units, then one row per measurement of a volume.  ResultsCSVStore writes
+MeasureResults into such a file under a lock, refuses to mix in rows for a
+different set of measures, and upserts by volume name with last-row-wins
+semantics: every row is appended in a single write, and a volume measured again
+gets a new row which supersedes its earlier ones, so new volumes never need the
+file rewritten.  Anything reading the file takes the last row of each volume
+(latest_rows()).  Once over a tenth of its rows (and more than 50) are
+superseded the file is compacted, keeping only each volume's latest row, so the
+cost of rewriting it is spread over many upserts.  The volume name index is
+kept between calls and only the bytes appended since the last call are scanned,
+so adding rows does not reread the whole file.
+"""
+import csv
+import hashlib
+import io
+import os
+import socket
+import tempfile
+import time
+import uuid
+
+class ResultsFileLockTimeout(Exception):
+  pass
+
+class ResultsHeaderMismatch(Exception):
+  pass
+
+def latest_rows(data_rows):
+  # The last row of each volume (by the "Volume Name" last column), in order of each volume's first row
+  latest = {}
+  for row in data_rows:
+    if len(row)>0:
+      latest[row[-1]] = row
+  return list(latest.values())
+
+class ResultsFileLock(object):
+  '''Exclusive lock on a results file, held as a "<filename>.lock" file next to it.
+  A lock file (rather than fcntl/msvcrt locks) is used because it also works for files
+  on network drives and on every platform.  The lock file holds a token unique to its
+  holder.  Locks older than stale_after seconds are assumed to have been left behind by a
+  crashed writer and are taken over: the stale lock file is renamed out of the way (a
+  rename is atomic, so only one of several waiting writers gets it), and the renamed file
+  is checked to still hold the stale token before it is deleted.  Should another writer
+  have replaced the stale lock in the meantime, its lock is put back.'''
+
+  def __init__(self, filename, timeout=30.0, stale_after=120.0, poll_interval=0.05):
+    self.lock_filename = filename + '.lock'
+    self.timeout = timeout
+    self.stale_after = stale_after
+    self.poll_interval = poll_interval
+    self.token = None
+
+  def _read_token(self, filename):
+    try:
+      with open(filename) as f:
+        return f.read()
+    except OSError:
+      return None
+
+  def acquire(self):
+    deadline = time.time() + self.timeout
+    token = '%s %d %s\n' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+    while True:
+      try:
+        fd = os.open(self.lock_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+      except FileExistsError:
+        if self._take_over_stale_lock():
+          continue # try again right away
+        if time.time() > deadline:
+          raise ResultsFileLockTimeout('Timed out waiting for lock "%s"' % self.lock_filename)
+        time.sleep(self.poll_interval)
+        continue
+      try:
+        os.write(fd, token.encode())
+      finally:
+        os.close(fd)
+      self.token = token
+      return
+
+  def _take_over_stale_lock(self):
+    # Move a stale lock out of the way, returns True if there may be no lock any more
+    try:
+      if time.time() - os.path.getmtime(self.lock_filename) <= self.stale_after:
+        return False
+    except OSError:
+      return True # lock was released in the meantime
+    stale_token = self._read_token(self.lock_filename)
+    if not stale_token:
+      return False # still being written by its holder
+    moved_filename = '%s.%s.stale' % (self.lock_filename, uuid.uuid4().hex)
+    try:
+      os.rename(self.lock_filename, moved_filename)
+    except OSError:
+      return True # another writer took it over (or it was released) first
+    if self._read_token(moved_filename)==stale_token:
+      os.remove(moved_filename)
+      return True
+    # Not the stale lock any more, but a live one taken in the meantime: put it back
+    try:
+      os.link(moved_filename, self.lock_filename)
+    except OSError:
+      pass # taken by yet another writer, which now holds the lock
+    os.remove(moved_filename)
+    return False
+
+  def release(self):
+    if self.token is not None:
+      # Only remove the lock file if it is still ours (it may have been taken over as stale)
+      if self._read_token(self.lock_filename)==self.token:
+        try:
+          os.remove(self.lock_filename)
+        except OSError:
+          pass
+      self.token = None
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.release()
+
+class ResultsCSVStore(object):
+
+  def __init__(self, filename, lock_timeout=30.0, compact_min_rows=50, compact_fraction=0.1):
+    # The file is compacted when it holds more than compact_min_rows superseded rows and these
+    # are more than compact_fraction of its rows
+    self.filename = filename
+    self.lock_timeout = lock_timeout
+    self.compact_min_rows = compact_min_rows
+    self.compact_fraction = compact_fraction
+    self._reset_index()
+
+  def _reset_index(self):
+    self.header = None # [names row, units row]
+    self.volume_rows = {} # volume name -> number of its latest data row (0 is the first row after the header)
+    self.n_rows = 0 # data rows, superseded ones included
+    self._header_bytes = 0
+    self._header_digest = None
+    self._indexed_bytes = 0
+    self._indexed_mtime = None
+    self._last_line = b''
+
+  @property
+  def n_superseded(self):
+    return self.n_rows - len(self.volume_rows)
+
+  def lock(self):
+    return ResultsFileLock(self.filename, timeout=self.lock_timeout)
+
+  def create(self, results, volume_names=None, full_precision=True):
+    # Start a new results file (replacing any existing one) holding these results
+    col_names, units = results.csv_header()
+    with self.lock():
+      self._write_all([col_names, units] + latest_rows(results.csv_rows(volume_names, full_precision)))
+      self._reset_index()
+
+  def upsert(self, results, volume_names=None, full_precision=True):
+    '''Add the rows for these results, all in one append.  A volume already in the file gets
+    a new row superseding its earlier ones (readers take the last row of each volume), and
+    the file is compacted once superseded rows make up a tenth of it.
+    Returns (number of new volumes, number of volumes replaced).'''
+    col_names, units = results.csv_header()
+    rows = latest_rows(results.csv_rows(volume_names, full_precision)) # same volume twice in one batch, last wins
+    with self.lock():
+      self._update_index()
+      if self.header is None:
+        # Empty file, start it off with the header rows
+        self._append_rows([col_names, units])
+      if self.header!=[col_names, units]:
+        raise ResultsHeaderMismatch('"%s" holds a different set of measures than the current results' % self.filename)
+      n_replaced = sum(1 for row in rows if row[-1] in self.volume_rows)
+      if rows:
+        self._append_rows(rows)
+      if self.n_superseded > max(self.compact_min_rows, self.compact_fraction * self.n_rows):
+        self._compact()
+    return len(rows) - n_replaced, n_replaced
+
+  def compact(self):
+    # Rewrite the file with only the latest row of each volume
+    with self.lock():
+      self._compact()
+
+  def read_rows(self, latest=True):
+    # Return (header rows, data rows) of the whole file, only the latest row of each volume unless latest is False
+    with open(self.filename, newline='') as f:
+      all_rows = list(csv.reader(f))
+    return all_rows[:2], latest_rows(all_rows[2:]) if latest else all_rows[2:]
+
+  def _read_bytes(self, start, stop=None):
+    with open(self.filename, 'rb') as f:
+      f.seek(start)
+      return f.read() if stop is None else f.read(stop - start)
+
+  def _index_is_valid(self, stat):
+    '''Whether the bytes indexed so far are still the start of the file.  A file replaced by
+    another writer (e.g. compacted) is told apart by its size and modification time, and
+    otherwise by checksums of its header and of the last line indexed.'''
+    if self._indexed_bytes==0:
+      return True
+    if stat.st_size < self._indexed_bytes:
+      return False
+    if stat.st_size==self._indexed_bytes and stat.st_mtime_ns==self._indexed_mtime:
+      return True
+    if hashlib.sha1(self._read_bytes(0, self._header_bytes)).digest()!=self._header_digest:
+      return False
+    return self._read_bytes(self._indexed_bytes - len(self._last_line), self._indexed_bytes)==self._last_line
+
+  def _update_index(self):
+    # Bring the volume name index up to date, scanning only what was appended since last time
+    stat = os.stat(self.filename)
+    if not self._index_is_valid(stat):
+      self._reset_index() # file was replaced or truncated by someone else
+    if stat.st_size==self._indexed_bytes and self.header is not None:
+      self._indexed_mtime = stat.st_mtime_ns
+      return
+    read_start = self._indexed_bytes
+    new_bytes = self._read_bytes(read_start)
+    complete = new_bytes.rfind(b'\n') + 1 # ignore a partial last line, it will be read next time
+    if complete==0:
+      return
+    for row in csv.reader(io.StringIO(new_bytes[:complete].decode('utf-8'), newline='')):
+      if len(row)==0:
+        continue
+      if self.header is None:
+        self.header = [row]
+      elif len(self.header)==1:
+        self.header.append(row)
+      else:
+        self.volume_rows[row[-1]] = self.n_rows
+        self.n_rows += 1
+    self._indexed_bytes += complete
+    self._indexed_mtime = stat.st_mtime_ns if stat.st_size==self._indexed_bytes else None
+    self._last_line = new_bytes[new_bytes.rfind(b'\n', 0, complete - 1) + 1:complete]
+    if self._header_digest is None and self.header is not None and len(self.header)==2:
+      # The header is the first two lines (measure names and units have no line breaks)
+      start_bytes = new_bytes if read_start==0 else self._read_bytes(0, self._indexed_bytes)
+      self._header_bytes = start_bytes.find(b'\n', start_bytes.find(b'\n') + 1) + 1
+      self._header_digest = hashlib.sha1(start_bytes[:self._header_bytes]).digest()
+
+  def _format_rows(self, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+  def _append_rows(self, rows):
+    with open(self.filename, mode='a', newline='') as f:
+      f.write(self._format_rows(rows))
+      f.flush()
+      os.fsync(f.fileno())
+    self._update_index()
+
+  def _compact(self):
+    header, data_rows = self.read_rows(latest=True)
+    self._write_all(header + data_rows)
+    self._reset_index()
+    self._update_index()
+
+  def _write_all(self, rows):
+    # Write the whole file to a temporary file next to it and swap it into place
+    dirname = os.path.dirname(os.path.abspath(self.filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.csv.tmp')
+    try:
+      with os.fdopen(fd, mode='w', newline='') as f:
+        f.write(self._format_rows(rows))
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_filename, self.filename)
+    except BaseException:
+      if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+      raise
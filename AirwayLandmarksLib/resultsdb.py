@@ -0,0 +1,179 @@
+"""Results database: airway measures and landmark coordinates in SQLite.
+
+Each "Add to Database" is one measurement per case (volume name, annotator,
+timestamp, optional note such as the frame), holding that case's measure values
+and the landmark coordinates they were calculated from.  Nothing is ever
+overwritten, so re-measuring a volume keeps its history; the
+latest_measurements view picks the most recent measurement of each volume.
+Measurements are indexed by volume name, annotator and timestamp, and landmarks
+by label, so queries like "every volume whose latest landmarks lack Basion"
+stay fast however many measurements the database holds.  A whole batch of cases
+is written in one transaction.
+
+Results CSV files (as written by ResultsCSVStore) can still be made from the
+database with export_csv(), which writes the same two header rows and one row
+per volume.
+"""
+import sqlite3
+import time
+
+import numpy as np
+
+from AirwayLandmarksLib.results import MeasureResults
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS measures (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE,
+  units TEXT NOT NULL,
+  number_format TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+  id INTEGER PRIMARY KEY,
+  volume_name TEXT NOT NULL,
+  annotator TEXT NOT NULL DEFAULT '',
+  timestamp REAL NOT NULL,
+  note TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS measurements_volume ON measurements (volume_name, timestamp);
+CREATE INDEX IF NOT EXISTS measurements_annotator ON measurements (annotator, timestamp);
+CREATE INDEX IF NOT EXISTS measurements_timestamp ON measurements (timestamp);
+CREATE TABLE IF NOT EXISTS measure_values (
+  measurement_id INTEGER NOT NULL REFERENCES measurements (id) ON DELETE CASCADE,
+  measure_id INTEGER NOT NULL REFERENCES measures (id),
+  value REAL, -- NULL where the measure is not available
+  PRIMARY KEY (measurement_id, measure_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS landmarks (
+  measurement_id INTEGER NOT NULL REFERENCES measurements (id) ON DELETE CASCADE,
+  label TEXT NOT NULL,
+  r REAL NOT NULL,
+  a REAL NOT NULL,
+  s REAL NOT NULL,
+  PRIMARY KEY (measurement_id, label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS landmarks_label ON landmarks (label, measurement_id);
+CREATE VIEW IF NOT EXISTS latest_measurements AS
+  SELECT * FROM measurements m WHERE m.id = (
+    SELECT id FROM measurements m2 WHERE m2.volume_name = m.volume_name
+    ORDER BY m2.timestamp DESC, m2.id DESC LIMIT 1);
+'''
+
+class ResultsDatabase(object):
+
+  def __init__(self, filename, timeout=30.0):
+    self.filename = filename
+    self.connection = sqlite3.connect(filename, timeout=timeout)
+    # Write-ahead logging lets annotators read while another one writes
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.connection.execute('PRAGMA synchronous=NORMAL')
+    self.connection.execute('PRAGMA foreign_keys=ON')
+    with self.connection:
+      self.connection.executescript(SCHEMA)
+
+  def close(self):
+    self.connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _measure_ids(self, results):
+    # Database ids of the measures in results, adding any the database has not seen yet
+    self.connection.executemany('INSERT OR IGNORE INTO measures (name, units, number_format) VALUES (?, ?, ?)',
+      zip(results.names, results.units, results.formats))
+    ids = dict(self.connection.execute('SELECT name, id FROM measures'))
+    return [ids[name] for name in results.names]
+
+  def add_results(self, results, volume_names=None, annotator='', landmarks=None, notes=None, timestamp=None):
+    '''Add one measurement per case of a MeasureResults, all in one transaction.  landmarks is
+    an optional list (one per case) of {label: RAS position}, None for a landmark not placed;
+    notes an optional list of strings (e.g. the frame of a 4D case).  Returns the new
+    measurement ids.'''
+    if volume_names is None:
+      volume_names = results.case_names
+    if timestamp is None:
+      timestamp = time.time()
+    if notes is None:
+      notes = [''] * len(results)
+    measurement_ids = []
+    with self.connection:
+      measure_ids = self._measure_ids(results)
+      for case_idx, volume_name in enumerate(volume_names):
+        cursor = self.connection.execute('INSERT INTO measurements (volume_name, annotator, timestamp, note) VALUES (?, ?, ?, ?)',
+          (volume_name, annotator, timestamp, notes[case_idx]))
+        measurement_ids.append(cursor.lastrowid)
+      values = np.where(results.available, results.values, np.nan)
+      self.connection.executemany('INSERT INTO measure_values (measurement_id, measure_id, value) VALUES (?, ?, ?)',
+        ((measurement_id, measure_id, None if np.isnan(value) else float(value))
+          for measurement_id, case_values in zip(measurement_ids, values)
+          for measure_id, value in zip(measure_ids, case_values)))
+      if landmarks is not None:
+        self.connection.executemany('INSERT OR REPLACE INTO landmarks (measurement_id, label, r, a, s) VALUES (?, ?, ?, ?, ?)',
+          ((measurement_id, label, float(pos[0]), float(pos[1]), float(pos[2]))
+            for measurement_id, case_landmarks in zip(measurement_ids, landmarks)
+            for label, pos in (case_landmarks or {}).items() if pos is not None))
+    return measurement_ids
+
+  def latest_measurements(self, annotator=None):
+    # [(measurement id, volume name, annotator, timestamp, note)] of each volume's latest measurement, by volume name
+    query = 'SELECT id, volume_name, annotator, timestamp, note FROM latest_measurements'
+    if annotator is not None:
+      # Latest by this annotator, whoever measured the volume last
+      query = '''SELECT id, volume_name, annotator, timestamp, note FROM measurements m WHERE m.id = (
+        SELECT id FROM measurements m2 WHERE m2.volume_name = m.volume_name AND m2.annotator = ?
+        ORDER BY m2.timestamp DESC, m2.id DESC LIMIT 1)'''
+    return self.connection.execute(query + ' ORDER BY volume_name', () if annotator is None else (annotator,)).fetchall()
+
+  def volume_history(self, volume_name):
+    # [(measurement id, annotator, timestamp, note)] of every measurement of a volume, oldest first
+    return self.connection.execute('SELECT id, annotator, timestamp, note FROM measurements WHERE volume_name = ? ORDER BY timestamp, id',
+      (volume_name,)).fetchall()
+
+  def volumes_missing_landmark(self, label):
+    # Names of the volumes whose latest measurement has no position for the landmark label
+    return [row[0] for row in self.connection.execute('''SELECT volume_name FROM latest_measurements m
+      WHERE NOT EXISTS (SELECT 1 FROM landmarks l WHERE l.measurement_id = m.id AND l.label = ?)
+      ORDER BY volume_name''', (label,))]
+
+  def landmark_positions(self, measurement_id):
+    # {label: [R, A, S]} stored with one measurement
+    return {label: [r, a, s] for label, r, a, s in self.connection.execute(
+      'SELECT label, r, a, s FROM landmarks WHERE measurement_id = ?', (measurement_id,))}
+
+  def results(self, measurement_ids):
+    '''MeasureResults for the given measurements (in that order), with every measure the
+    database knows, case names being the volume names.'''
+    measure_rows = self.connection.execute('SELECT id, name, units, number_format FROM measures ORDER BY id').fetchall()
+    columns = {measure_id: col for col, (measure_id, _, _, _) in enumerate(measure_rows)}
+    rows = {measurement_id: row for row, measurement_id in enumerate(measurement_ids)}
+    values = np.full((len(measurement_ids), len(measure_rows)), np.nan)
+    volume_names = [''] * len(measurement_ids)
+    # Fetch in chunks, staying under SQLite's limit on query parameters
+    measurement_ids = list(measurement_ids)
+    for start in range(0, len(measurement_ids), 500):
+      chunk = measurement_ids[start:start + 500]
+      placeholders = ','.join('?' * len(chunk))
+      entries = self.connection.execute('SELECT measurement_id, measure_id, value FROM measure_values WHERE measurement_id IN (%s)' % placeholders, chunk).fetchall()
+      if entries:
+        entries = np.array(entries, dtype=float) # NULL values come out as NaN
+        row_idx = np.array([rows[int(measurement_id)] for measurement_id in entries[:, 0]])
+        col_idx = np.array([columns[int(measure_id)] for measure_id in entries[:, 1]])
+        values[row_idx, col_idx] = entries[:, 2]
+      for measurement_id, volume_name in self.connection.execute('SELECT id, volume_name FROM measurements WHERE id IN (%s)' % placeholders, chunk):
+        volume_names[rows[measurement_id]] = volume_name
+    return MeasureResults(values, case_names=volume_names,
+      names=[row[1] for row in measure_rows], units=[row[2] for row in measure_rows], formats=[row[3] for row in measure_rows])
+
+  def latest_results(self, annotator=None):
+    # MeasureResults of the latest measurement of each volume (see latest_measurements)
+    return self.results([row[0] for row in self.latest_measurements(annotator)])
+
+  def export_csv(self, filename, annotator=None):
+    '''Write a results CSV (as "Create CSV" does) with the latest measurement of each volume.
+    Returns the number of volumes written.'''
+    results = self.latest_results(annotator)
+    results.write_csv(filename)
+    return len(results)
@@ -0,0 +1,61 @@
+"""Image intensities at landmarks, for spotting landmarks placed in the wrong tissue.
+
+All landmarks are sampled at once: trilinear interpolation gathers the eight
+voxels around every point with one fancy-indexing read each, and the sphere
+statistics gather a precomputed set of voxel offsets around every point, so
+only the voxels actually used are read out of the volume array (which can be
+a zero-copy view of the volume).  Points, or sphere voxels, outside the volume
+count as missing.
+
+Arrays are indexed in array order, which for slicer.util.arrayFromVolume is
+(K, J, I).
+"""
+import numpy as np
+
+def trilinear(array, points):
+  '''Trilinearly interpolated values of a 3D array at (N x 3) fractional array indices,
+  NaN for points outside the array.'''
+  points = np.atleast_2d(np.asarray(points, dtype=float))
+  shape = np.array(array.shape)
+  inside = np.all((points >= 0) & (points <= shape - 1), axis=1)
+  values = np.full(len(points), np.nan)
+  if not inside.any():
+    return values
+  p = points[inside]
+  # Lower corner, kept one voxel from the far edge so that the upper corner is inside too
+  lower = np.minimum(np.floor(p).astype(int), np.maximum(shape - 2, 0))
+  upper = np.minimum(lower + 1, shape - 1)
+  fraction = p - lower
+  result = np.zeros(len(p))
+  for corner in range(8):
+    bits = [(corner >> axis) & 1 for axis in range(3)]
+    index = tuple(np.where(bit, upper[:, axis], lower[:, axis]) for axis, bit in enumerate(bits))
+    weight = np.prod([fraction[:, axis] if bit else 1 - fraction[:, axis] for axis, bit in enumerate(bits)], axis=0)
+    result += weight * array[index]
+  values[inside] = result
+  return values
+
+def sphere_offsets(radius_mm, spacing):
+  # (K x 3) integer array index offsets of the voxels within radius_mm of a voxel centre
+  spacing = np.asarray(spacing, dtype=float)
+  extent = np.floor(radius_mm / spacing).astype(int)
+  grid = np.stack(np.meshgrid(*[np.arange(-e, e + 1) for e in extent], indexing='ij'), axis=-1).reshape(-1, 3)
+  return grid[np.sum((grid * spacing)**2, axis=1) <= radius_mm**2]
+
+def sphere_statistics(array, points, radius_mm, spacing):
+  '''(means, SDs), each (N,), of the voxels within radius_mm of each of (N x 3) array index
+  points (about the nearest voxel centre), spacing being the voxel size along each array axis.
+  Voxels outside the array are left out; NaN where none are inside.'''
+  points = np.atleast_2d(np.asarray(points, dtype=float))
+  voxels = np.round(points).astype(int)[:, np.newaxis, :] + sphere_offsets(radius_mm, spacing)[np.newaxis] # N x K x 3
+  shape = np.array(array.shape)
+  inside = np.all((voxels >= 0) & (voxels < shape), axis=2)
+  clipped = np.clip(voxels, 0, shape - 1)
+  samples = np.where(inside, array[clipped[..., 0], clipped[..., 1], clipped[..., 2]], 0.0)
+  counts = inside.sum(axis=1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    means = samples.sum(axis=1) / counts
+    variances = np.where(inside, (samples - means[:, np.newaxis])**2, 0.0).sum(axis=1) / (counts - 1)
+  sds = np.sqrt(np.where(counts > 1, variances, np.nan))
+  means[counts==0] = np.nan
+  return means, sds
@@ -0,0 +1,128 @@
+"""Opt-in timing of the module's hot paths.
+
+Functions decorated with @timed() report their wall-clock duration to the
+shared CALL_TIMINGS registry, which keeps the most recent durations of each in
+a ring buffer for rolling percentiles, and can optionally run the calls under
+cProfile.  While CALL_TIMINGS is disabled (the default) a timed function costs
+one attribute check on top of the plain call.
+"""
+import cProfile
+import functools
+import io
+import json
+import pstats
+import time
+
+import numpy as np
+
+class DurationRingBuffer(object):
+  # The last `capacity` durations (in seconds) of one timed function, plus running totals
+
+  def __init__(self, capacity=1024):
+    self.durations = np.zeros(capacity)
+    self.next = 0
+    self.count = 0 # all calls, including those which have dropped out of the buffer
+    self.total = 0.0
+
+  def add(self, duration):
+    self.durations[self.next] = duration
+    self.next = (self.next + 1) % len(self.durations)
+    self.count += 1
+    self.total += duration
+
+  def recent(self):
+    return self.durations[:min(self.count, len(self.durations))]
+
+  def summary(self, percentiles=(50, 90, 99)):
+    recent = self.recent()
+    summary = {'count': self.count, 'total': self.total, 'mean': self.total/self.count if self.count else 0.0,
+      'max': float(recent.max()) if len(recent) else 0.0}
+    values = np.percentile(recent, percentiles) if len(recent) else np.zeros(len(percentiles))
+    for percentile, value in zip(percentiles, values):
+      summary['p%d' % percentile] = float(value)
+    return summary
+
+class CallTimings(object):
+
+  def __init__(self, capacity=1024):
+    self.enabled = False
+    self.capacity = capacity
+    self.buffers = {} # name -> DurationRingBuffer
+    self.profiling = False
+    self.profiler = None # cProfile.Profile holding the stats since profiling was first switched on
+    self._depth = 0 # timed calls in progress, only the outermost one is profiled
+
+  def set_profiling(self, on):
+    # Run timed calls under cProfile (keeping the collected stats when switched off)
+    if on and self.profiler is None:
+      self.profiler = cProfile.Profile()
+    self.profiling = on
+
+  def call(self, name, func, args, kwargs):
+    profiler = self.profiler if self.profiling and self._depth==0 else None
+    self._depth += 1
+    start = time.perf_counter()
+    try:
+      if profiler is not None:
+        return profiler.runcall(func, *args, **kwargs)
+      return func(*args, **kwargs)
+    finally:
+      duration = time.perf_counter() - start
+      self._depth -= 1
+      buffer = self.buffers.get(name)
+      if buffer is None:
+        buffer = self.buffers[name] = DurationRingBuffer(self.capacity)
+      buffer.add(duration)
+
+  def reset(self):
+    self.buffers = {}
+    self.profiler = cProfile.Profile() if self.profiling else None
+
+  def summary(self):
+    # {name: {count, total, mean, max, p50, p90, p99}}, durations in seconds
+    return {name: buffer.summary() for name, buffer in sorted(self.buffers.items())}
+
+  def profile_str(self, limit=30):
+    # The cumulative-time cProfile report (top `limit` entries), or '' if nothing was profiled
+    if self.profiler is None:
+      return ''
+    stream = io.StringIO()
+    try:
+      pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+    except TypeError:
+      return '' # no calls profiled yet
+    return stream.getvalue()
+
+  def report_str(self):
+    # Text table of the summary, durations in milliseconds
+    lines = ['%-32s %6s %9s %9s %9s %9s' % ('Function', 'Calls', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')]
+    for name, summary in self.summary().items():
+      lines.append('%-32s %6d %9.2f %9.2f %9.2f %9.2f' % (name, summary['count'],
+        1000*summary['p50'], 1000*summary['p90'], 1000*summary['p99'], 1000*summary['max']))
+    return '\n'.join(lines)
+
+  def to_json(self):
+    return json.dumps({'timings': self.summary(), 'profile': self.profile_str()}, indent=1)
+
+  def write_json(self, filename):
+    with open(filename, mode='w') as f:
+      f.write(self.to_json())
+
+CALL_TIMINGS = CallTimings()
+
+def timed(name=None, timings=None):
+  '''Decorator reporting each call's duration to timings (default CALL_TIMINGS) under name
+  (default the function's qualified name), while timing is enabled.
+  Do not connect a decorated method to a Qt signal directly: the wrapper takes *args, so
+  PythonQt passes it every signal argument (e.g. the checked flag of clicked(bool)), which
+  the method does not accept.  Connect it through a lambda instead.'''
+  def decorator(func):
+    timing_name = name if name is not None else func.__qualname__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      registry = timings if timings is not None else CALL_TIMINGS
+      if not registry.enabled:
+        return func(*args, **kwargs)
+      return registry.call(timing_name, func, args, kwargs)
+    return wrapper
+  return decorator
@@ -0,0 +1,132 @@
+"""Worklist of cases to annotate, with the next case read in the background.
+
+A worklist is a CSV file with a header row and one case per row:
+
+  Volume, FH Landmarks, Landmarks, Name
+
+Only Volume (an image file, or a directory holding one DICOM series) is
+required.  The landmark files are where the case's FH and airway landmarks are
+loaded from, if they exist, and saved back to; they default to
+"<volume>_FH_Landmarks.mrk.json" and "<volume>_Airway_Landmarks.mrk.json" next
+to the volume.  Relative paths are relative to the worklist file.
+
+PrefetchCache reads cases on a background thread into a bounded LRU, so that
+while one case is annotated the next one is already read from disk.
+"""
+import csv
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from AirwayLandmarksLib.markupsfiles import AIRWAY_LANDMARKS_SUFFIX, FH_LANDMARKS_SUFFIX, read_markups_file
+
+WorklistCase = namedtuple('WorklistCase', ['name', 'volume_path', 'fh_path', 'landmarks_path'])
+
+# Case data read in the background: the volume as a SimpleITK image, and {label: RAS} for the
+# FH and airway landmarks ({} where there is no file yet)
+CaseData = namedtuple('CaseData', ['case', 'image', 'fh_points', 'landmark_points'])
+
+VOLUME_EXTENSIONS = ('.nii.gz', '.nii', '.nrrd', '.nhdr', '.mha', '.mhd')
+
+def volume_stem(volume_path):
+  # Volume path without its (possibly double) extension, or the directory path for a DICOM series
+  volume_path = volume_path.rstrip('/\\')
+  for extension in VOLUME_EXTENSIONS:
+    if volume_path.lower().endswith(extension):
+      return volume_path[:-len(extension)]
+  return volume_path
+
+def read_worklist(filename):
+  '''List of WorklistCase from a worklist CSV file.  Raises ValueError if two cases share a
+  name or a volume (cases named after their volume files, like ".../pt1/CT.nrrd" and
+  ".../pt2/CT.nrrd", need a Name column), as their landmarks would be mixed up.'''
+  base_dir = os.path.dirname(os.path.abspath(filename))
+  def resolve(path):
+    path = (path or '').strip()
+    return os.path.normpath(os.path.join(base_dir, path)) if path else ''
+  cases = []
+  with open(filename, newline='') as f:
+    for row in csv.DictReader(f):
+      volume_path = resolve(row.get('Volume'))
+      if not volume_path:
+        continue
+      stem = volume_stem(volume_path)
+      cases.append(WorklistCase(
+        name=(row.get('Name') or '').strip() or os.path.basename(stem),
+        volume_path=volume_path,
+        fh_path=resolve(row.get('FH Landmarks')) or stem+FH_LANDMARKS_SUFFIX+'.mrk.json',
+        landmarks_path=resolve(row.get('Landmarks')) or stem+AIRWAY_LANDMARKS_SUFFIX+'.mrk.json'))
+  for field in ('name', 'volume_path', 'fh_path', 'landmarks_path'):
+    seen = set()
+    for case in cases:
+      value = getattr(case, field)
+      if value in seen:
+        raise ValueError('More than one case in "%s" has the %s "%s"' % (filename, field.replace('_', ' '), value))
+      seen.add(value)
+  return cases
+
+def read_volume(volume_path):
+  '''Read a volume file, or the first DICOM series in a directory, into a SimpleITK image.
+  SimpleITK releases the GIL while reading, so this runs well on a background thread.'''
+  import SimpleITK as sitk
+  if os.path.isdir(volume_path):
+    reader = sitk.ImageSeriesReader()
+    series_ids = reader.GetGDCMSeriesIDs(volume_path)
+    if not series_ids:
+      raise ValueError('No DICOM series in "%s"' % volume_path)
+    reader.SetFileNames(reader.GetGDCMSeriesFileNames(volume_path, series_ids[0]))
+    return reader.Execute()
+  return sitk.ReadImage(volume_path)
+
+def read_case(case):
+  # CaseData for a WorklistCase: its volume and whichever landmark files already exist
+  def read_points(path):
+    return read_markups_file(path) if path and os.path.exists(path) else {}
+  return CaseData(case, read_volume(case.volume_path), read_points(case.fh_path), read_points(case.landmarks_path))
+
+class PrefetchCache(object):
+  '''Bounded LRU of values loaded on a background thread, keyed by anything hashable.
+  prefetch() starts a load and returns right away, get() waits for it (loading first if it
+  was never requested).  Beyond `capacity` entries the least recently used are dropped,
+  cancelling loads which have not started yet.  Meant to be used from one (the UI) thread.'''
+
+  def __init__(self, load, capacity=2, workers=1):
+    self.load = load
+    self.capacity = capacity
+    self.entries = OrderedDict() # key -> Future, least recently used first
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='PrefetchCache')
+
+  def prefetch(self, key):
+    future = self.entries.get(key)
+    if future is None:
+      future = self.entries[key] = self.executor.submit(self.load, key)
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.capacity:
+      _, oldest = self.entries.popitem(last=False)
+      oldest.cancel()
+    return future
+
+  def get(self, key, timeout=None):
+    # The loaded value (raising whatever the load raised)
+    return self.prefetch(key).result(timeout)
+
+  def loaded_keys(self):
+    # Keys whose loads have finished without error, least recently used first
+    return [key for key, future in self.entries.items()
+      if future.done() and not future.cancelled() and future.exception() is None]
+
+  def pop(self, key):
+    # Remove an entry, returning its value if it had finished loading without error (else None)
+    future = self.entries.pop(key, None)
+    if future is None:
+      return None
+    if not future.done() or future.cancelled() or future.exception() is not None:
+      future.cancel()
+      return None
+    return future.result()
+
+  def close(self):
+    for future in self.entries.values():
+      future.cancel()
+    self.entries.clear()
+    self.executor.shutdown(wait=False)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+  import slicer # inside Slicer's Python, use the real thing
+except ImportError:
+  sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+  import standins
+  standins.install()
@@ -0,0 +1,470 @@
+"""Lightweight stand-ins for Slicer, Qt and VTK, so that the module's Slicer-bound code
+paths (the landmark table helpers, measures from a markups node, the FH transform) can
+be run and timed on a bare Linux box.
+
+Only what those code paths use is provided: markups nodes hold their control points
+in plain lists, transformable nodes can sit under a hierarchy of linear transforms (for
+migrating and reorienting to FH), and a landmark table is a view with just enough of QTableView's
+interface for updateLandmarkTableEntries/fitTableSize and selectNextUnfilledRow.
+install() puts the stand-in modules in sys.modules; it is only called (from
+conftest.py) where the real slicer module cannot be imported.
+"""
+import sys
+import types
+
+import numpy as np
+
+#
+# vtk
+#
+
+class vtkCommand(object):
+  ModifiedEvent = 33
+
+class vtkVector3d(tuple):
+  def __new__(cls, x, y, z):
+    return tuple.__new__(cls, (x, y, z))
+
+class vtkMatrix4x4(object):
+
+  def __init__(self):
+    self.elements = np.eye(4)
+
+  def SetElement(self, row, col, value):
+    self.elements[row, col] = value
+
+  def GetElement(self, row, col):
+    return float(self.elements[row, col])
+
+  def DeepCopy(self, other):
+    self.elements = other.elements.copy()
+
+def calldata_type(calldata_type):
+  # Only matters to the real VTK's Python wrapping, where it marks an observer taking call data
+  def decorator(func):
+    func.CallDataType = calldata_type
+    return func
+  return decorator
+
+#
+# qt
+#
+
+class Qt(object):
+  DisplayRole = 0
+  CheckStateRole = 10
+  Horizontal = 1
+  Vertical = 2
+  Unchecked = 0
+  Checked = 2
+  ItemIsSelectable = 1
+  ItemIsEnabled = 32
+  ScrollBarAsNeeded = 0
+  ScrollBarAlwaysOff = 1
+
+class QModelIndex(object):
+
+  def __init__(self, row=-1, column=-1):
+    self._row = row
+    self._column = column
+
+  def row(self):
+    return self._row
+
+  def column(self):
+    return self._column
+
+  def isValid(self):
+    return self._row >= 0 and self._column >= 0
+
+class QAbstractTableModel(object):
+
+  def __init__(self, parent=None):
+    self.dataChangedCount = 0
+
+  def index(self, row, column, parent=None):
+    return QModelIndex(row, column)
+
+  def dataChanged(self, topLeft, bottomRight):
+    # A signal in Qt, here it just counts the emissions
+    self.dataChangedCount += 1
+
+  def headerData(self, section, orientation, role=Qt.DisplayRole):
+    return None
+
+class QSize(object):
+
+  def __init__(self, width=0, height=0):
+    self._width = width
+    self._height = height
+
+  def width(self):
+    return self._width
+
+  def height(self):
+    return self._height
+
+class _HeaderView(object):
+  # Fixed size header, as the table's headers are; length() is what the visible sections add up to
+
+  def __init__(self, table, orientation, sectionSize):
+    self.table = table
+    self.orientation = orientation
+    self.defaultSectionSize = sectionSize
+    self.width = 40
+    self.height = 24
+
+  def length(self):
+    model = self.table.model()
+    count = model.columnCount() if self.orientation==Qt.Horizontal else model.rowCount()
+    return count * self.defaultSectionSize
+
+class _ScrollBar(object):
+  sizeHint = QSize(16, 16)
+
+class _SelectionModel(object):
+
+  def __init__(self):
+    self.indexes = []
+
+  def selectedIndexes(self):
+    return list(self.indexes)
+
+class _Signal(object):
+  # Callable like an emitted Qt signal, also connectable
+
+  def __init__(self):
+    self.slots = []
+
+  def connect(self, slot):
+    self.slots.append(slot)
+
+  def __call__(self, *args):
+    for slot in self.slots:
+      slot(*args)
+
+class QTableView(object):
+
+  def __init__(self):
+    self._model = None
+    self._selectionModel = _SelectionModel()
+    self._horizontalHeader = _HeaderView(self, Qt.Horizontal, 60)
+    self._verticalHeader = _HeaderView(self, Qt.Vertical, 20)
+    self._verticalScrollBar = _ScrollBar()
+    self.clicked = _Signal()
+    self.fixedSize = None
+    self.scrolledTo = None
+
+  def setModel(self, model):
+    self._model = model
+
+  def model(self):
+    return self._model
+
+  def selectionModel(self):
+    return self._selectionModel
+
+  def clearSelection(self):
+    self._selectionModel.indexes = []
+
+  def setCurrentIndex(self, index):
+    self._selectionModel.indexes = [index]
+
+  def scrollTo(self, index):
+    self.scrolledTo = index
+
+  def horizontalHeader(self):
+    return self._horizontalHeader
+
+  def verticalHeader(self):
+    return self._verticalHeader
+
+  def verticalScrollBar(self):
+    return self._verticalScrollBar
+
+  def setSizePolicy(self, horizontal, vertical):
+    pass
+
+  def setVerticalScrollBarPolicy(self, policy):
+    pass
+
+  def setHorizontalScrollBarPolicy(self, policy):
+    pass
+
+  def resizeColumnsToContents(self):
+    pass
+
+  def setFixedSize(self, width, height):
+    self.fixedSize = (width, height)
+
+#
+# slicer
+#
+
+class _Observable(object):
+
+  def __init__(self):
+    self.observers = {} # tag -> (event, callback)
+    self.nextTag = 1
+
+  def AddObserver(self, event, callback, priority=0.0):
+    tag = self.nextTag
+    self.nextTag += 1
+    self.observers[tag] = (event, callback)
+    return tag
+
+  def RemoveObserver(self, tag):
+    self.observers.pop(tag, None)
+
+  def InvokeEvent(self, event, callData=None):
+    for observedEvent, callback in list(self.observers.values()):
+      if observedEvent==event:
+        if callData is None:
+          callback(self, event)
+        else:
+          callback(self, event, callData)
+
+class vtkMRMLNode(_Observable):
+
+  def __init__(self, name=''):
+    _Observable.__init__(self)
+    self.name = name
+    self.attributes = {}
+    self.references = {} # role -> node ID
+
+  def GetID(self):
+    return 'vtkMRMLNode%d' % id(self)
+
+  def GetName(self):
+    return self.name
+
+  def SetName(self, name):
+    self.name = name
+
+  def GetAttribute(self, name):
+    return self.attributes.get(name)
+
+  def SetAttribute(self, name, value):
+    self.attributes[name] = value
+
+  def SetNodeReferenceID(self, role, nodeID):
+    self.references[role] = nodeID
+
+  def GetNodeReference(self, role):
+    return _scene.GetNodeByID(self.references.get(role))
+
+class vtkMRMLTransformableNode(vtkMRMLNode):
+  # A node which can be put under a (linear) transform node in the scene
+  TransformModifiedEvent = 15000
+
+  def __init__(self, name=''):
+    vtkMRMLNode.__init__(self, name)
+    self.transformNodeID = None
+
+  def SetAndObserveTransformNodeID(self, transformNodeID):
+    self.transformNodeID = transformNodeID
+    self.InvokeEvent(self.TransformModifiedEvent)
+
+  def GetTransformNodeID(self):
+    return self.transformNodeID
+
+  def GetParentTransformNode(self):
+    return _scene.GetNodeByID(self.transformNodeID)
+
+  def _matrixToWorld(self):
+    # 4 x 4 array taking local to world coordinates, through all the parent transforms
+    parentNode = self.GetParentTransformNode()
+    if parentNode is None:
+      return np.eye(4)
+    return parentNode._matrixToWorld() @ parentNode.matrixToParent.elements
+
+class vtkMRMLLinearTransformNode(vtkMRMLTransformableNode):
+
+  def __init__(self, name=''):
+    vtkMRMLTransformableNode.__init__(self, name)
+    self.matrixToParent = vtkMatrix4x4()
+
+  def IsLinear(self):
+    return True
+
+  def SetMatrixTransformToParent(self, matrix):
+    self.matrixToParent.DeepCopy(matrix)
+
+  def GetMatrixTransformToParent(self, matrix):
+    matrix.DeepCopy(self.matrixToParent)
+
+  def GetMatrixTransformToWorld(self, matrix):
+    matrix.elements = self._matrixToWorld() @ self.matrixToParent.elements
+
+class vtkMRMLScalarVolumeNode(vtkMRMLTransformableNode):
+  pass
+
+class vtkMRMLMarkupsFiducialNode(vtkMRMLTransformableNode):
+  # Control points as parallel lists of labels and local positions
+  PointAddedEvent = 14001
+  PointRemovedEvent = 14002
+  PointModifiedEvent = 14003
+  PointPositionDefinedEvent = 14004
+
+  def __init__(self, name=''):
+    vtkMRMLTransformableNode.__init__(self, name)
+    self.labels = []
+    self.positions = []
+
+  def GetNumberOfControlPoints(self):
+    return len(self.labels)
+
+  def AddControlPoint(self, pos, label=''):
+    self.labels.append(label)
+    self.positions.append([float(x) for x in pos])
+    self.InvokeEvent(self.PointAddedEvent, len(self.labels) - 1)
+    return len(self.labels) - 1
+
+  def AddControlPointWorld(self, pos, label=''):
+    return self.AddControlPoint(pos, label)
+
+  def RemoveNthControlPoint(self, cpIdx):
+    del self.labels[cpIdx]
+    del self.positions[cpIdx]
+    self.InvokeEvent(self.PointRemovedEvent, cpIdx)
+
+  def GetNthControlPointLabel(self, cpIdx):
+    return self.labels[cpIdx]
+
+  def SetNthControlPointLabel(self, cpIdx, label):
+    self.labels[cpIdx] = label
+    self.InvokeEvent(self.PointModifiedEvent, cpIdx)
+
+  def GetNthControlPointPosition(self, cpIdx, pos):
+    pos[:] = self.positions[cpIdx]
+
+  def GetNthControlPointPositionWorld(self, cpIdx, pos):
+    if self.transformNodeID is None:
+      pos[:] = self.positions[cpIdx]
+    else:
+      pos[:] = (self._matrixToWorld() @ np.append(self.positions[cpIdx], 1.0))[:3].tolist()
+
+  def SetNthControlPointPosition(self, cpIdx, x, y, z):
+    self.positions[cpIdx] = [float(x), float(y), float(z)]
+    self.InvokeEvent(self.PointModifiedEvent, cpIdx)
+
+  def SetNthControlPointPositionWorld(self, cpIdx, x, y, z):
+    if self.transformNodeID is not None:
+      x, y, z = (np.linalg.inv(self._matrixToWorld()) @ [x, y, z, 1.0])[:3]
+    self.SetNthControlPointPosition(cpIdx, x, y, z)
+
+def makeMarkupsNode(labels, positions, name='Landmarks'):
+  # Markups node holding a control point for each label with a position (NaN positions are left out)
+  markupsNode = vtkMRMLMarkupsFiducialNode(name)
+  for label, pos in zip(labels, positions):
+    if not np.isnan(pos).any():
+      markupsNode.AddControlPoint(pos, label)
+  return markupsNode
+
+class _InteractionNode(object):
+  Place = 1
+  ViewTransform = 2
+
+  def __init__(self):
+    self.mode = self.ViewTransform
+
+  def GetCurrentInteractionMode(self):
+    return self.mode
+
+  def SetCurrentInteractionMode(self, mode):
+    self.mode = mode
+
+class _ApplicationLogic(object):
+
+  def __init__(self):
+    self.interactionNode = _InteractionNode()
+
+  def GetInteractionNode(self):
+    return self.interactionNode
+
+class _Application(object):
+  temporaryPath = '/tmp'
+
+  def __init__(self):
+    self._applicationLogic = _ApplicationLogic()
+
+  def applicationLogic(self):
+    return self._applicationLogic
+
+class _Scene(_Observable):
+  NodeAddedEvent = 66000
+  NodeRemovedEvent = 66001
+  EndSaveEvent = 66007
+
+  def __init__(self):
+    _Observable.__init__(self)
+    self.nodes = []
+
+  def AddNode(self, node):
+    self.nodes.append(node)
+    self.InvokeEvent(self.NodeAddedEvent, node)
+    return node
+
+  def AddNewNodeByClass(self, className, name=''):
+    return self.AddNode(_NODE_CLASSES[className](name))
+
+  def GetNodeByID(self, nodeID):
+    for node in self.nodes:
+      if node.GetID()==nodeID:
+        return node
+    return None
+
+  def RemoveNode(self, node):
+    if node in self.nodes:
+      self.nodes.remove(node)
+      self.InvokeEvent(self.NodeRemovedEvent, node)
+
+  def GenerateUniqueName(self, name):
+    return name
+
+  def Clear(self, removeSingletons=0):
+    for node in list(self.nodes):
+      self.RemoveNode(node)
+
+_NODE_CLASSES = {nodeClass.__name__: nodeClass for nodeClass in
+  (vtkMRMLLinearTransformNode, vtkMRMLMarkupsFiducialNode, vtkMRMLScalarVolumeNode)}
+
+_scene = _Scene()
+
+class ScriptedLoadableModule(object):
+  def __init__(self, parent):
+    self.parent = parent
+
+class ScriptedLoadableModuleWidget(object):
+  def __init__(self, parent=None):
+    self.parent = parent
+
+class ScriptedLoadableModuleLogic(object):
+  def __init__(self, parent=None):
+    pass
+
+class ScriptedLoadableModuleTest(object):
+  pass
+
+def _module(name, **attributes):
+  module = types.ModuleType(name)
+  module.__dict__.update(attributes)
+  return module
+
+def install():
+  # Put stand-in vtk, qt, ctk and slicer modules in sys.modules
+  vtk = _module('vtk', vtkCommand=vtkCommand, vtkVector3d=vtkVector3d, vtkMatrix4x4=vtkMatrix4x4,
+    calldata_type=calldata_type, VTK_INT=6, VTK_OBJECT=13)
+  qt = _module('qt', Qt=Qt, QModelIndex=QModelIndex, QAbstractTableModel=QAbstractTableModel, QTableView=QTableView, QSize=QSize)
+  ctk = _module('ctk')
+  scriptedLoadableModule = _module('slicer.ScriptedLoadableModule', ScriptedLoadableModule=ScriptedLoadableModule,
+    ScriptedLoadableModuleWidget=ScriptedLoadableModuleWidget, ScriptedLoadableModuleLogic=ScriptedLoadableModuleLogic,
+    ScriptedLoadableModuleTest=ScriptedLoadableModuleTest)
+  scriptedLoadableModule.__all__ = ['ScriptedLoadableModule', 'ScriptedLoadableModuleWidget', 'ScriptedLoadableModuleLogic', 'ScriptedLoadableModuleTest']
+  slicer = _module('slicer', app=_Application(), mrmlScene=_scene, util=_module('slicer.util'),
+    ScriptedLoadableModule=scriptedLoadableModule, vtkMRMLNode=vtkMRMLNode, vtkMRMLTransformableNode=vtkMRMLTransformableNode,
+    vtkMRMLLinearTransformNode=vtkMRMLLinearTransformNode, vtkMRMLMarkupsFiducialNode=vtkMRMLMarkupsFiducialNode,
+    vtkMRMLScalarVolumeNode=vtkMRMLScalarVolumeNode)
+  slicer.__path__ = [] # a package, so that "from slicer.ScriptedLoadableModule import *" works
+  sys.modules.update({'vtk': vtk, 'qt': qt, 'ctk': ctk, 'slicer': slicer, 'slicer.util': slicer.util,
+    'slicer.ScriptedLoadableModule': scriptedLoadableModule})
@@ -0,0 +1,98 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.batch import run_batch
+from AirwayLandmarksLib.geometry import FH_LANDMARK_NAMES, MEASURE_LANDMARK_NAMES, calculate_measures_array
+from AirwayLandmarksLib.markupsfiles import find_markups_files, read_fcsv, read_mrk_json
+
+# FH points already in an axial plane with the ears along R, so FH reorientation leaves them be
+FH_POINTS = [[-70.0, 0.0, 0.0], [70.0, 0.0, 0.0], [-35.0, 80.0, 0.0]]
+
+def tilt():
+  # A rotation by 20 degrees about [1, 1, 1]
+  axis = np.ones(3) / np.sqrt(3)
+  K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+  theta = np.radians(20.0)
+  return np.eye(3) + np.sin(theta)*K + (1 - np.cos(theta))*K@K
+
+def write_mrk_json(path, points, coordinate_system='LPS'):
+  # points {label: [R, A, S]}, saved in the given coordinate system like Slicer does
+  sign = np.array([-1.0, -1.0, 1.0]) if coordinate_system=='LPS' else np.ones(3)
+  control_points = [{'label': label, 'position': list(sign*position), 'positionStatus': 'defined'}
+    for label, position in points.items()]
+  control_points.append({'label': 'Never placed', 'position': [0.0, 0.0, 0.0], 'positionStatus': 'undefined'})
+  with open(path, 'w') as f:
+    json.dump({'markups': [{'type': 'Fiducial', 'coordinateSystem': coordinate_system, 'controlPoints': control_points}]}, f)
+
+def write_fcsv(path, points):
+  # points {label: [R, A, S]}, saved as LPS with the columns in a non-default order
+  with open(path, 'w', newline='') as f:
+    f.write('# Markups fiducial file version = 4.11\n# CoordinateSystem = LPS\n# columns = label,x,y,z,desc\n')
+    writer = csv.writer(f)
+    for label, (R, A, S) in points.items():
+      writer.writerow([label, -R, -A, S, ''])
+
+@pytest.fixture
+def landmarks():
+  # {label: [R, A, S]} for every measure landmark, in an FH oriented head
+  coords = np.random.default_rng(6).normal(scale=40.0, size=(len(MEASURE_LANDMARK_NAMES), 3))
+  return dict(zip(MEASURE_LANDMARK_NAMES, coords))
+
+def test_readers_convert_lps_to_ras(tmp_path, landmarks):
+  write_mrk_json(str(tmp_path / 'a.mrk.json'), landmarks)
+  write_fcsv(str(tmp_path / 'a.fcsv'), landmarks)
+  write_mrk_json(str(tmp_path / 'b.mrk.json'), landmarks, coordinate_system='RAS')
+  for points in (read_mrk_json(str(tmp_path / 'a.mrk.json')), read_fcsv(str(tmp_path / 'a.fcsv')),
+      read_mrk_json(str(tmp_path / 'b.mrk.json'))):
+    assert list(points)==list(landmarks)
+    for label, position in landmarks.items():
+      np.testing.assert_allclose(points[label], position, rtol=1e-15)
+
+def test_files_are_grouped_by_volume_stem(tmp_path):
+  os.makedirs(str(tmp_path / 'pt1'))
+  os.makedirs(str(tmp_path / 'pt2'))
+  filenames = ['pt1/CT_FH_Landmarks.mrk.json', 'pt1/CT_Airway_Landmarks.fcsv', 'pt1/MR_Airway_Landmarks.mrk.json',
+    'pt2/FH_Landmarks.mrk.json', 'pt2/Airway.fcsv', 'pt2/notes.txt']
+  for filename in filenames:
+    open(str(tmp_path / filename), 'w').close()
+  cases = find_markups_files(str(tmp_path))
+  assert {case_name: sorted(os.path.relpath(path, str(tmp_path)) for path in paths) for case_name, paths in cases.items()}=={
+    os.path.join('pt1', 'CT'): [os.path.join('pt1', 'CT_Airway_Landmarks.fcsv'), os.path.join('pt1', 'CT_FH_Landmarks.mrk.json')],
+    os.path.join('pt1', 'MR'): [os.path.join('pt1', 'MR_Airway_Landmarks.mrk.json')],
+    'pt2': [os.path.join('pt2', 'Airway.fcsv'), os.path.join('pt2', 'FH_Landmarks.mrk.json')],
+  }
+
+def test_batch_reorients_only_cases_with_all_fh_points(tmp_path, landmarks):
+  # The same tilted head saved for three volumes: CT with all three FH points, MR with two
+  # of them, and US with none
+  rotation = tilt()
+  tilted = {label: rotation@position for label, position in landmarks.items()}
+  tilted_fh = {label: rotation@np.array(position) for label, position in zip(FH_LANDMARK_NAMES, FH_POINTS)}
+  write_mrk_json(str(tmp_path / 'CT_FH_Landmarks.mrk.json'), tilted_fh)
+  write_fcsv(str(tmp_path / 'CT_Airway_Landmarks.fcsv'), tilted)
+  write_mrk_json(str(tmp_path / 'MR_FH_Landmarks.mrk.json'), dict(list(tilted_fh.items())[:2]))
+  write_mrk_json(str(tmp_path / 'MR_Airway_Landmarks.mrk.json'), tilted)
+  del tilted['Pogonion']
+  write_fcsv(str(tmp_path / 'US_Airway_Landmarks.fcsv'), tilted)
+  csv_filename = str(tmp_path / 'results.csv')
+  assert run_batch(str(tmp_path), csv_filename, workers=1)==3
+  with open(csv_filename, newline='') as f:
+    rows = list(csv.reader(f))
+  assert rows[0][-1]=='Volume Name' and len(rows[1])==len(rows[0]) - 1
+  assert [row[-1] for row in rows[2:]]==['CT', 'MR', 'US']
+  upright = calculate_measures_array(np.array([list(landmarks.values())]))[0]
+  as_saved = calculate_measures_array(np.array([[rotation@position for position in landmarks.values()]]))[0]
+  np.testing.assert_allclose([float(value) for value in rows[2][:-1]], upright, rtol=1e-9, atol=1e-9)
+  np.testing.assert_allclose([float(value) for value in rows[3][:-1]], as_saved, rtol=1e-9, atol=1e-9)
+  assert not np.allclose(upright, as_saved)
+  # Measures needing the missing landmark are not available
+  assert 'NotAvailable' in rows[4] and 'NotAvailable' not in rows[3]
+  # Without reorientation the CT is measured as saved too
+  run_batch(str(tmp_path), csv_filename, workers=1, reorient=False)
+  with open(csv_filename, newline='') as f:
+    rows = list(csv.reader(f))
+  np.testing.assert_allclose([float(value) for value in rows[2][:-1]], as_saved, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,136 @@
+"""Benchmarks of the module's hot paths, run with pytest-benchmark:
+
+  python -m pytest tests --benchmark-json=new.json
+  python -m pytest tests --benchmark-compare=<earlier run> --benchmark-compare-fail=median:25%
+
+The Slicer-bound code paths run against the stand-ins in standins.py, at 20, 200 and
+2000 landmarks; the cohort code paths at 1, 1000 and 100000 cases.  This is the one
+benchmark harness; the module's self test only checks that the Slicer-bound paths stay
+fast with Slicer's own markups nodes and tables.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import qt
+import standins
+from AirwayLandmarks import AirwayLandmarksLogic, LandmarkTableModel, make_FH_transform
+from AirwayLandmarksLib.benchmark import synthetic_cohort
+from AirwayLandmarksLib.geometry import FH_LANDMARK_NAMES, MEASURE_LANDMARK_NAMES, calculate_measures_array, fh_rotation_matrices, measures_available
+from AirwayLandmarksLib.refinement import snap_point
+from AirwayLandmarksLib.results import MeasureResults
+from AirwayLandmarksLib.resultscsv import ResultsCSVStore
+
+LANDMARK_COUNTS = (20, 200, 2000)
+COHORT_SIZES = (1, 1000, 100000)
+
+def landmark_catalog(nLandmarks):
+  # The measure landmarks then extra ones, with positions, the last landmark left unplaced
+  coords, missing, fhPoints = synthetic_cohort(1, missing_fraction=0)
+  nExtra = nLandmarks - len(MEASURE_LANDMARK_NAMES)
+  names = MEASURE_LANDMARK_NAMES + ['Landmark %d' % i for i in range(nExtra)]
+  positions = np.concatenate([coords[0], np.random.default_rng(nLandmarks).normal(scale=40.0, size=(nExtra, 3))])
+  positions[-1] = np.nan
+  return names, positions, fhPoints[0]
+
+def landmark_table(names):
+  table = qt.QTableView()
+  table.setModel(LandmarkTableModel(names))
+  return table
+
+@pytest.fixture(scope='module')
+def logic():
+  return AirwayLandmarksLogic()
+
+@pytest.fixture(scope='module')
+def cohorts():
+  # size -> (MeasureResults of a synthetic cohort, coords, missing, FH points)
+  cohorts = {}
+  for size in COHORT_SIZES:
+    coords, missing, fhPoints = synthetic_cohort(size)
+    results = MeasureResults(calculate_measures_array(coords, missing), measures_available(missing), case_names=['case_%d' % i for i in range(size)])
+    cohorts[size] = (results, coords, missing, fhPoints)
+  return cohorts
+
+@pytest.mark.parametrize('nLandmarks', LANDMARK_COUNTS)
+def test_calculate_measures(benchmark, logic, nLandmarks):
+  names, positions, _ = landmark_catalog(nLandmarks)
+  landmarksNode = standins.makeMarkupsNode(names, positions)
+  report = benchmark(logic.calculate_measures, landmarksNode)
+  assert 'NotAvailable' not in report
+
+@pytest.mark.parametrize('nLandmarks', LANDMARK_COUNTS)
+def test_make_FH_transform(benchmark, nLandmarks):
+  _, _, fhPoints = landmark_catalog(nLandmarks)
+  fhNode = standins.makeMarkupsNode(FH_LANDMARK_NAMES, fhPoints, name='FH_Landmarks')
+  transformNode = standins.vtkMRMLLinearTransformNode('FH_Transform')
+  benchmark(make_FH_transform, fhNode, transformNode)
+
+@pytest.mark.parametrize('nLandmarks', LANDMARK_COUNTS)
+def test_updateLandmarkTableFromNode(benchmark, logic, nLandmarks):
+  names, positions, _ = landmark_catalog(nLandmarks)
+  landmarksNode = standins.makeMarkupsNode(names, positions)
+  table = landmark_table(names)
+  benchmark(logic.updateLandmarkTableFromNode, table, landmarksNode)
+  filled = [logic.rowIsFilled(table, row) for row in range(nLandmarks)]
+  assert filled==[True]*(nLandmarks - 1) + [False]
+
+@pytest.mark.parametrize('nLandmarks', LANDMARK_COUNTS)
+def test_selectNextUnfilledRow(benchmark, logic, nLandmarks):
+  names, positions, _ = landmark_catalog(nLandmarks)
+  table = landmark_table(names)
+  logic.updateLandmarkTableFromNode(table, standins.makeMarkupsNode(names, positions))
+  def selectNextUnfilledRow():
+    table.clearSelection()
+    return logic.selectNextUnfilledRow(table)
+  assert benchmark(selectNextUnfilledRow)==nLandmarks - 1
+
+@pytest.mark.parametrize('size', COHORT_SIZES)
+def test_calculate_measures_array(benchmark, cohorts, size):
+  _, coords, missing, _ = cohorts[size]
+  benchmark(calculate_measures_array, coords, missing)
+
+@pytest.mark.parametrize('size', COHORT_SIZES)
+def test_measures_available(benchmark, cohorts, size):
+  missing = cohorts[size][2]
+  benchmark(measures_available, missing)
+
+@pytest.mark.parametrize('size', COHORT_SIZES)
+def test_fh_rotation_matrices(benchmark, cohorts, size):
+  fhPoints = cohorts[size][3]
+  benchmark(fh_rotation_matrices, fhPoints)
+
+@pytest.mark.parametrize('size', COHORT_SIZES)
+def test_write_csv(benchmark, cohorts, tmp_path, size):
+  results = cohorts[size][0]
+  benchmark.pedantic(results.write_csv, args=(str(tmp_path / 'results.csv'),), rounds=3 if size>=100000 else 10)
+
+@pytest.mark.parametrize('size', COHORT_SIZES)
+def test_create(benchmark, cohorts, tmp_path, size):
+  store = ResultsCSVStore(str(tmp_path / 'results.csv'))
+  benchmark.pedantic(store.create, args=(cohorts[size][0],), rounds=3 if size>=100000 else 10)
+
+@pytest.mark.parametrize('size', COHORT_SIZES)
+def test_upsert(benchmark, cohorts, tmp_path, size):
+  # Adding one case to a results file of `size` cases, alternately a new volume and one measured again
+  results = cohorts[size][0]
+  store = ResultsCSVStore(str(tmp_path / 'results.csv'))
+  store.create(results)
+  caseNumbers = itertools.count()
+  def upsert():
+    caseNumber = next(caseNumbers)
+    caseName = 'new case %d' % caseNumber if caseNumber % 2 else 'case_0'
+    store.upsert(MeasureResults(results.values[:1], results.available[:1], case_names=[caseName]))
+  benchmark(upsert)
+
+@pytest.mark.parametrize('mode, lowest, highest', [('edge', 239, 240), ('bright', 239.5, 245), ('dark', 219, 239.5)])
+def test_snap_point(benchmark, mode, lowest, highest):
+  # A 5 mm snap in a CT sized volume (300 slices of 512 x 512, 0.625 x 0.45 x 0.45 mm voxels), clicked
+  # 4.5 mm in front of a bright block's face at J = 239.5; a snap should take well under 10 ms
+  array = np.zeros((300, 512, 512), dtype=np.int16)
+  array[140:160, 240:280, 240:280] = 1000
+  snapped, _ = benchmark(snap_point, array, [150.0, 230.0, 256.0], 5.0, (0.625, 0.45, 0.45), mode)
+  assert lowest <= snapped[1] <= highest
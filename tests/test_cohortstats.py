@@ -0,0 +1,70 @@
+import csv
+
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.cohortstats import (
+  MeasureAccumulator,
+  QuantileSketch,
+  group_by_pattern,
+  parse_values,
+  summarize_results_files,
+)
+
+def test_chunked_mean_and_sd_match_numpy():
+  # Uneven chunks, missing values and a large offset, which a naive sum of squares would lose precision on
+  rng = np.random.default_rng(0)
+  values = 1e6 + rng.normal(scale=3.0, size=(5000, 3))
+  values[rng.random(values.shape) < 0.1] = np.nan
+  values[:, 2] = np.nan
+  accumulator = MeasureAccumulator(3)
+  for chunk in np.split(values, [1, 7, 500, 2048, 4999]):
+    accumulator.add(chunk)
+  summary = accumulator.summary(['a', 'b', 'c'])
+  for measure_idx, name in enumerate(['a', 'b']):
+    present = values[:, measure_idx][~np.isnan(values[:, measure_idx])]
+    assert summary[name]['count']==len(present)
+    assert summary[name]['missing']==len(values) - len(present)
+    assert summary[name]['mean']==pytest.approx(np.mean(present), rel=1e-14)
+    assert summary[name]['sd']==pytest.approx(np.std(present, ddof=1), rel=1e-9)
+    assert summary[name]['min']==present.min() and summary[name]['max']==present.max()
+  assert summary['c']['count']==0 and np.isnan(summary['c']['mean'])
+
+@pytest.mark.parametrize('chunk_size', [100, 10000])
+def test_quantile_sketch_within_its_rank_error(chunk_size):
+  values = np.random.default_rng(1).lognormal(size=100000)
+  sketch = QuantileSketch(compression=200)
+  for start in range(0, len(values), chunk_size):
+    sketch.add(values[start:start + chunk_size])
+  q = np.linspace(0, 1, 101)
+  estimates = sketch.quantile(q, values.min(), values.max())
+  ranks = np.searchsorted(np.sort(values), estimates) / len(values)
+  assert np.all(np.abs(ranks - q) <= 1/200)
+  assert estimates[0]==values.min() and estimates[-1]==values.max()
+  assert np.allclose(estimates[50], np.quantile(values, 0.5), rtol=0.02)
+
+def test_parse_values():
+  rows = [['1.5', 'NotAvailable', 'vol1'], ['', '2', 'vol2']]
+  assert np.array_equal(parse_values(rows, 2), [[1.5, np.nan], [np.nan, 2.0]], equal_nan=True)
+
+def test_summary_counts_the_latest_row_of_each_volume(tmp_path):
+  filename = str(tmp_path / 'results.csv')
+  with open(filename, 'w', newline='') as f:
+    csv.writer(f).writerows([['Width', 'Volume Name'], ['mm'],
+      ['1.0', 'vol1'], ['2.0', 'vol2'], ['5.0', 'vol1'], ['NotAvailable', 'vol3']])
+  statistics = summarize_results_files([filename], chunk_rows=2)
+  stats = statistics.summary()['']['Width']
+  assert (stats['count'], stats['missing'])==(2, 1)
+  assert stats['mean']==3.5 and (stats['min'], stats['max'])==(2.0, 5.0)
+
+def test_superseded_rows_in_earlier_chunks_are_not_counted(tmp_path):
+  # Each volume's earlier rows fall in other chunks than its last row, and in another group's file
+  filename = str(tmp_path / 'results.csv')
+  rows = [['%d' % value, 'vol%d' % (value % 3)] for value in range(10)]
+  with open(filename, 'w', newline='') as f:
+    csv.writer(f).writerows([['Width', 'Volume Name'], ['mm']] + rows)
+  statistics = summarize_results_files([filename], group_key=group_by_pattern(r'vol(\d)'), chunk_rows=3)
+  assert statistics.n_rows==3
+  summary = statistics.summary()
+  assert {key: (measures['Width']['count'], measures['Width']['mean']) for key, measures in summary.items()}=={
+    '0': (1, 9.0), '1': (1, 7.0), '2': (1, 8.0)}
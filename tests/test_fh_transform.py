@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import slicer
+import vtk
+from AirwayLandmarks import FH_TRANSFORM_REFERENCE_ROLE, AirwayLandmarksLogic
+from AirwayLandmarksLib.benchmark import synthetic_cohort
+from AirwayLandmarksLib.geometry import FH_LANDMARK_NAMES, MEASURE_LANDMARK_NAMES, fh_rotation_matrix
+
+@pytest.fixture
+def scene():
+  slicer.mrmlScene.Clear(0)
+  yield slicer.mrmlScene
+  slicer.mrmlScene.Clear(0)
+
+def markups_node(labels, positions, name):
+  markupsNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', name)
+  for label, pos in zip(labels, positions):
+    markupsNode.SetNthControlPointLabel(markupsNode.AddControlPoint(vtk.vtkVector3d(*pos)), label)
+  return markupsNode
+
+def positions(markupsNode, world=False):
+  get = markupsNode.GetNthControlPointPositionWorld if world else markupsNode.GetNthControlPointPosition
+  result = np.zeros((markupsNode.GetNumberOfControlPoints(), 3))
+  for cpIdx in range(len(result)):
+    pos = [0]*3
+    get(cpIdx, pos)
+    result[cpIdx] = pos
+  return result
+
+def matrix_to_world(transformNode):
+  matrix = vtk.vtkMatrix4x4()
+  transformNode.GetMatrixTransformToWorld(matrix)
+  return np.array([[matrix.GetElement(row, col) for col in range(4)] for row in range(4)])
+
+def baseline_scene():
+  '''A case reoriented by the version which hardened the landmarks: the volume (and another
+  case's volume) under the shared volume_FH_Transform, with no FH points hash, and the FH
+  points and landmarks hardened into FH space.  Returns (volume, other volume, FH node,
+  landmarks node, legacy transform, rotation, FH points and landmarks in image space).'''
+  coords, _, fhPoints = synthetic_cohort(1, missing_fraction=0)
+  rotation = fh_rotation_matrix(fhPoints[0])
+  legacyTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'volume_FH_Transform')
+  matrix = vtk.vtkMatrix4x4()
+  for row in range(3):
+    for col in range(3):
+      matrix.SetElement(row, col, rotation[row, col])
+  legacyTransform.SetMatrixTransformToParent(matrix)
+  volNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'CT')
+  otherVolNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'CT2')
+  for node in (volNode, otherVolNode):
+    node.SetAndObserveTransformNodeID(legacyTransform.GetID())
+  FHNode = markups_node(FH_LANDMARK_NAMES, fhPoints[0] @ rotation.T, 'FH_Landmarks')
+  landmarksNode = markups_node(MEASURE_LANDMARK_NAMES, coords[0] @ rotation.T, 'Airway_Landmarks')
+  return volNode, otherVolNode, FHNode, landmarksNode, legacyTransform, rotation, fhPoints[0], coords[0]
+
+def test_baseline_scene_keeps_volume_and_landmarks_aligned(scene):
+  volNode, otherVolNode, FHNode, landmarksNode, legacyTransform, rotation, fhPoints, coords = baseline_scene()
+  worldLandmarks = positions(landmarksNode, world=True)
+  logic = AirwayLandmarksLogic()
+  assert logic.reorientToFH(volNode, FHNode, [landmarksNode])
+  fhTransform = volNode.GetParentTransformNode()
+  assert fhTransform is not legacyTransform
+  assert volNode.GetNodeReference(FH_TRANSFORM_REFERENCE_ROLE) is fhTransform
+  # The volume is still rotated into FH space, and the landmarks have not moved with respect to it
+  np.testing.assert_allclose(matrix_to_world(fhTransform)[:3, :3], rotation, atol=1e-12)
+  np.testing.assert_allclose(positions(landmarksNode, world=True), worldLandmarks, atol=1e-9)
+  # The hardened points are back in image space under the volume's own transform
+  for markupsNode, imagePositions in ((FHNode, fhPoints), (landmarksNode, coords)):
+    assert markupsNode.GetParentTransformNode() is fhTransform
+    np.testing.assert_allclose(positions(markupsNode), imagePositions, atol=1e-9)
+  # The other case's volume is left under the shared transform, which is unchanged
+  assert otherVolNode.GetParentTransformNode() is legacyTransform
+  np.testing.assert_allclose(matrix_to_world(legacyTransform)[:3, :3], rotation, atol=0)
+  # Unchanged FH points: nothing left to do
+  assert not logic.reorientToFH(volNode, FHNode, [landmarksNode])
+  assert volNode.GetParentTransformNode() is fhTransform
+  logic.cleanup()
+
+def test_new_volume_gets_its_own_transform(scene):
+  coords, _, fhPoints = synthetic_cohort(1, missing_fraction=0)
+  volNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'CT')
+  FHNode = markups_node(FH_LANDMARK_NAMES, fhPoints[0], 'FH_Landmarks')
+  landmarksNode = markups_node(MEASURE_LANDMARK_NAMES, coords[0], 'Airway_Landmarks')
+  logic = AirwayLandmarksLogic()
+  assert logic.reorientToFH(volNode, FHNode, [landmarksNode])
+  fhTransform = volNode.GetParentTransformNode()
+  assert fhTransform.GetName()=='CT_FH_Transform'
+  np.testing.assert_allclose(matrix_to_world(fhTransform)[:3, :3], fh_rotation_matrix(fhPoints[0]), atol=1e-12)
+  np.testing.assert_array_equal(positions(landmarksNode), coords[0])
+  logic.cleanup()
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.geometry import (
+  MEASURE_DEFINITIONS,
+  MEASURE_LANDMARK_NAMES,
+  angle,
+  calculate_measures_array,
+  distance_3D,
+  distance_sag,
+  fh_rotation_matrices,
+  fh_rotation_matrix,
+  measures_available,
+  project,
+  sort_fh_points,
+)
+
+HYOID_POSTERIOR = 3
+HYOID_ANTERIOR = 4
+
+def scalar_measures(points):
+  # The measures of one case as the single point formulas give them, points being {landmark name: [R, A, S]}
+  A, S = 1, 2
+  p = {name: list(pos) for name, pos in points.items()}
+  h_to_c2 = np.subtract(p['C2 (anterior inferior aspect)'], p['Hyoid (central point)'])
+  line_vector = np.subtract(p['C3 (anterior aspect)'], p['C2 (anterior inferior aspect)'])
+  lgon, rgon, pog = p['Left gonion'], p['Right gonion'], p['Pogonion']
+  lcon, rcon = p['Left condylion'], p['Right condylion']
+  return [
+    p['Tongue (superior aspect)'][S] - p['Vallecula (inferior aspect)'][S],
+    p['Anterior Nasal Spine'][A] - p['Tongue (anterior aspect)'][A],
+    p['Anterior Nasal Spine'][S] - p['Tongue (superior aspect)'][S],
+    np.linalg.norm(h_to_c2 - project(h_to_c2, line_vector)),
+    distance_sag(p['Hyoid (central point)'], pog),
+    p['Hyoid (central point)'][S] - p['Anterior Nasal Spine'][S],
+    distance_3D(p['Nasion'], p['Basion']),
+    distance_3D(lcon, lgon),
+    distance_3D(rcon, rgon),
+    angle(np.subtract(lgon, pog), np.subtract(rgon, pog)),
+    distance_3D(lgon, rgon),
+    distance_3D(lgon, pog),
+    distance_3D(rgon, pog),
+    distance_3D(lcon, pog),
+    distance_3D(rcon, pog),
+    angle(np.subtract(lgon, lcon), np.subtract(lgon, pog)),
+    angle(np.subtract(rgon, rcon), np.subtract(rgon, pog)),
+  ]
+
+def test_batch_matches_single_point_formulas():
+  coords = np.random.default_rng(0).normal(scale=50.0, size=(5000, len(MEASURE_LANDMARK_NAMES), 3))
+  batch = calculate_measures_array(coords)
+  scalar = np.array([scalar_measures(dict(zip(MEASURE_LANDMARK_NAMES, case))) for case in coords])
+  assert batch.shape==(len(coords), len(MEASURE_DEFINITIONS))
+  # Bit-identical, except for the two measures squaring NumPy scalars with pow() (see geometry.py)
+  exact = np.ones(batch.shape[1], dtype=bool)
+  exact[[HYOID_POSTERIOR, HYOID_ANTERIOR]] = False
+  np.testing.assert_array_equal(batch[:, exact], scalar[:, exact])
+  np.testing.assert_array_max_ulp(batch[:, HYOID_ANTERIOR], scalar[:, HYOID_ANTERIOR], maxulp=1)
+  hyoid = coords[:, MEASURE_LANDMARK_NAMES.index('Hyoid (central point)')]
+  c2 = coords[:, MEASURE_LANDMARK_NAMES.index('C2 (anterior inferior aspect)')]
+  hyoid_to_c2 = np.linalg.norm(c2 - hyoid, axis=1)
+  assert np.all(np.abs(batch[:, HYOID_POSTERIOR] - scalar[:, HYOID_POSTERIOR]) <= np.spacing(hyoid_to_c2))
+
+def test_single_case_matches_cohort():
+  coords = np.random.default_rng(1).normal(scale=50.0, size=(20, len(MEASURE_LANDMARK_NAMES), 3))
+  batch = calculate_measures_array(coords)
+  for case_idx in range(len(coords)):
+    np.testing.assert_array_equal(calculate_measures_array(coords[case_idx:case_idx + 1])[0], batch[case_idx])
+
+def test_missing_landmarks_give_nan():
+  coords = np.random.default_rng(2).normal(scale=50.0, size=(3, len(MEASURE_LANDMARK_NAMES), 3))
+  missing = np.zeros(coords.shape[:2], dtype=bool)
+  missing[0, MEASURE_LANDMARK_NAMES.index('Pogonion')] = True
+  coords[1, MEASURE_LANDMARK_NAMES.index('Nasion')] = np.nan
+  measures = calculate_measures_array(coords, missing)
+  available = measures_available(missing | np.isnan(coords).any(axis=2))
+  assert np.array_equal(np.isnan(measures), ~available)
+  assert available[2].all() and not available[0].all() and not available[1].all()
+
+def rodrigues(axis, theta):
+  # Rotation by theta about the unit vector axis
+  K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+  return np.eye(3) + np.sin(theta)*K + (1 - np.cos(theta))*K@K
+
+def reference_fh_rotation(left_ear, right_ear, orbit):
+  # The two chained axis-angle rotations the closed form replaced: the FH plane normal to
+  # [0,0,-1], then the ears in that plane to [1,0,0]
+  normal = np.cross(orbit - right_ear, orbit - left_ear)
+  normal /= np.linalg.norm(normal)
+  goal = np.array([0.0, 0.0, -1.0])
+  axis = np.cross(normal, goal)
+  r1 = rodrigues(axis/np.linalg.norm(axis), np.arccos(np.dot(normal, goal))) if np.linalg.norm(axis) > 1e-10 else np.eye(3)
+  left_to_right = r1@(right_ear - left_ear)
+  left_to_right /= np.linalg.norm(left_to_right)
+  axis = np.cross(left_to_right, [1.0, 0.0, 0.0])
+  r2 = rodrigues(axis/np.linalg.norm(axis), np.arccos(left_to_right[0])) if np.linalg.norm(axis) > 1e-10 else np.eye(3)
+  return r2@r1
+
+def random_fh_points(rng, n):
+  # Ears about 140 mm apart and an orbit about 80 mm in front of them, randomly tilted
+  return np.array([[-70.0, 0.0, 0.0], [70.0, 0.0, 0.0], [-35.0, 80.0, 0.0]]) + rng.normal(scale=10.0, size=(n, 3, 3))
+
+def test_fh_rotations_match_axis_angle_reference():
+  fh_points = random_fh_points(np.random.default_rng(3), 200)
+  rotations, valid = fh_rotation_matrices(fh_points)
+  assert valid.all()
+  for case_points, rotation in zip(fh_points, rotations):
+    np.testing.assert_allclose(rotation, reference_fh_rotation(*case_points), atol=1e-12)
+    np.testing.assert_allclose(rotation@rotation.T, np.eye(3), atol=1e-12)
+    assert np.linalg.det(rotation)==pytest.approx(1.0)
+  # The FH points end up in an axial plane, the ears along R
+  rotated = np.einsum('nij,nkj->nki', rotations, fh_points)
+  np.testing.assert_allclose(rotated[:, :, 2] - rotated[:, :1, 2], 0.0, atol=1e-10)
+  np.testing.assert_allclose(rotated[:, 1, 1] - rotated[:, 0, 1], 0.0, atol=1e-10)
+  assert np.all(rotated[:, 1, 0] > rotated[:, 0, 0])
+
+def test_degenerate_fh_points_give_nan_rotations():
+  fh_points = random_fh_points(np.random.default_rng(4), 4)
+  fh_points[0, 1] = fh_points[0, 0] # coincident ears
+  fh_points[1, 2] = (fh_points[1, 0] + 3*fh_points[1, 1]) / 4 # orbit on the line through the ears
+  fh_points[2, 2, 1] = np.nan
+  rotations, valid = fh_rotation_matrices(fh_points)
+  assert valid.tolist()==[False, False, False, True]
+  assert np.isnan(rotations[:3]).all() and np.isfinite(rotations[3]).all()
+
+def test_empty_fh_batch():
+  rotations, valid = fh_rotation_matrices(np.zeros((0, 3, 3)))
+  assert rotations.shape==(0, 3, 3) and valid.shape==(0,)
+  with pytest.raises(ValueError):
+    fh_rotation_matrices(np.zeros((2, 3)))
+
+def test_fh_rotation_matrix_sorts_points_and_rejects_degenerate_ones():
+  fh_points = random_fh_points(np.random.default_rng(5), 1)[0]
+  expected = reference_fh_rotation(*fh_points)
+  np.testing.assert_allclose(fh_rotation_matrix(fh_points[[2, 1, 0]]), expected, atol=1e-12)
+  np.testing.assert_array_equal(sort_fh_points(fh_points[np.newaxis, [1, 2, 0]])[0], fh_points)
+  with pytest.raises(ValueError):
+    fh_rotation_matrix(fh_points[:2])
+  for degenerate in ([fh_points[0]]*3, [fh_points[0], fh_points[1], 2*fh_points[1] - fh_points[0]],
+      [fh_points[0], fh_points[1], [np.nan, 0.0, 0.0]]):
+    with pytest.raises(ValueError):
+      fh_rotation_matrix(degenerate)
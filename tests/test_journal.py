@@ -0,0 +1,78 @@
+import os
+import threading
+
+import pytest
+
+from AirwayLandmarksLib.journal import PlacementJournal, last_session, read_journal, replay_journal
+
+@pytest.fixture
+def filename(tmp_path):
+  return str(tmp_path / 'journals' / 'CT.journal')
+
+def test_replay_after_a_crash(filename):
+  # An earlier session, of another volume, left behind in the same journal
+  old_journal = PlacementJournal(filename, identity='/old/CT.nii.gz')
+  old_journal.place('landmarks', 'Basion', [9.0, 9.0, 9.0])
+  old_journal.close()
+  journal = PlacementJournal(filename, identity='/data/CT.nii.gz')
+  journal.place('fh', 'Left Porion', [1.0, 2.0, 3.0])
+  journal.place('landmarks', 'Basion', [4.0, 5.0, 6.0])
+  journal.place('landmarks', 'Sella', [7.0, 8.0, 9.0])
+  journal.reorient()
+  journal.place('landmarks', 'Basion', [4.5, 5.5, 6.5])
+  journal.reset('landmarks', 'Sella')
+  journal.flush()
+  # Crash: the journal is never closed, and the last write was cut short
+  with open(filename, 'a') as f:
+    f.write('{"t":1700000000.1,"op":"place","node":"landmarks","lab')
+  records = read_journal(filename)
+  identity, _ = last_session(records)
+  assert identity=='/data/CT.nii.gz'
+  positions, reoriented = replay_journal(records)
+  assert positions=={'fh': {'Left Porion': [1.0, 2.0, 3.0]}, 'landmarks': {'Basion': [4.5, 5.5, 6.5]}}
+  assert reoriented
+  journal.close()
+
+def test_truncate_then_new_session(filename):
+  journal = PlacementJournal(filename, identity='/data/CT.nii.gz')
+  journal.place('landmarks', 'Basion', [4.0, 5.0, 6.0])
+  journal.flush()
+  assert len(read_journal(filename))==2
+  journal.truncate() # landmarks saved
+  journal.flush()
+  assert os.path.getsize(filename)==0
+  assert replay_journal(read_journal(filename))==({}, False)
+  journal.place('landmarks', 'Sella', [7.0, 8.0, 9.0])
+  journal.close()
+  records = read_journal(filename)
+  assert [record['op'] for record in records]==['session', 'place']
+  assert replay_journal(records)==({'landmarks': {'Sella': [7.0, 8.0, 9.0]}}, False)
+
+def test_unwritable_journal_does_not_block(tmp_path):
+  # The journal directory cannot be created, as a file is in the way
+  (tmp_path / 'journals').write_text('')
+  journal = PlacementJournal(str(tmp_path / 'journals' / 'CT.journal'), identity='/data/CT.nii.gz')
+  journal.place('landmarks', 'Basion', [4.0, 5.0, 6.0])
+  flushed = threading.Thread(target=journal.flush, daemon=True)
+  flushed.start()
+  flushed.join(5)
+  assert not flushed.is_alive()
+  assert isinstance(journal.error, OSError)
+  # Later records are still taken off the queue, and the journal closes
+  journal.place('landmarks', 'Sella', [7.0, 8.0, 9.0])
+  journal.truncate()
+  closed = threading.Thread(target=journal.close, daemon=True)
+  closed.start()
+  closed.join(5)
+  assert not closed.is_alive()
+
+def test_unused_journal_writes_nothing(filename):
+  journal = PlacementJournal(filename, identity='/data/CT.nii.gz')
+  journal.close()
+  assert not os.path.exists(filename)
+  assert read_journal(filename)==[]
+
+def test_journal_without_session_records():
+  records = [{'op': 'place', 'node': 'landmarks', 'label': 'Basion', 'pos': [1, 2, 3]}]
+  assert last_session(records)==(None, records)
+  assert replay_journal(records)==({'landmarks': {'Basion': [1, 2, 3]}}, False)
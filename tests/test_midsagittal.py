@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.midsagittal import BILATERAL_PAIRS, MID_SAG_LANDMARK_NAMES, MidSagittalPlaneFit, plane_slice_to_ras
+
+BILATERAL_NAMES = [name for pair in BILATERAL_PAIRS for name in pair[1:]]
+
+# Slicer's sagittal view: slice x along A, y along S, z along R
+SAGITTAL_SLICE_TO_RAS = np.array([[0, 0, 1, 0], [1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=float)
+
+def symmetric_head(rng, midline_r=5.0):
+  # {name: RAS position}: midline landmarks on the plane R = midline_r, each bilateral pair mirrored in it
+  positions = {name: np.array([midline_r, *rng.normal(scale=40.0, size=2)]) for name in MID_SAG_LANDMARK_NAMES}
+  for _, left_name, right_name in BILATERAL_PAIRS:
+    offset, a, s = rng.uniform(20.0, 60.0), *rng.normal(scale=40.0, size=2)
+    positions[left_name] = np.array([midline_r - offset, a, s])
+    positions[right_name] = np.array([midline_r + offset, a, s])
+  return positions
+
+def fit_state(fit):
+  return fit.n_points, fit.sum_points, fit.sum_outer, fit.sum_pair_outer, fit.n_pairs
+
+def test_incremental_updates_match_a_fresh_fit():
+  rng = np.random.default_rng(8)
+  names = MID_SAG_LANDMARK_NAMES + BILATERAL_NAMES
+  incremental = MidSagittalPlaneFit()
+  for name in names:
+    incremental.set_landmark(name, rng.normal(scale=40.0, size=3))
+  # Move and remove landmarks at random, some removed ones placed again later
+  for _ in range(200):
+    name = names[rng.integers(len(names))]
+    incremental.set_landmark(name, None if rng.random() < 0.2 else rng.normal(scale=40.0, size=3))
+  # Not a landmark the fit uses
+  assert not incremental.set_landmark('Left ear FH', [1.0, 2.0, 3.0])
+  fresh = MidSagittalPlaneFit()
+  fresh.set_landmarks(dict(incremental.positions))
+  for incremental_sum, fresh_sum in zip(fit_state(incremental), fit_state(fresh)):
+    np.testing.assert_allclose(incremental_sum, fresh_sum, rtol=1e-9, atol=1e-6)
+  for incremental_part, fresh_part in zip(incremental.plane, fresh.plane):
+    np.testing.assert_allclose(incremental_part, fresh_part, atol=1e-9)
+
+def test_mirrored_pairs_have_no_asymmetry():
+  fit = MidSagittalPlaneFit()
+  fit.set_landmarks(symmetric_head(np.random.default_rng(9)))
+  origin, normal = fit.plane
+  np.testing.assert_allclose(normal, [1.0, 0.0, 0.0], atol=1e-12)
+  assert origin[0]==pytest.approx(5.0)
+  assert fit.asymmetry()==pytest.approx({'Gonion': 0.0, 'Condylion': 0.0}, abs=1e-9)
+  assert fit.signed_distance([8.0, 0.0, 0.0])==pytest.approx(3.0)
+  # Moving the right gonion further out moves the gonion midpoint, and the plane a little, to the right
+  fit.set_landmarks({'Left gonion': [-25.0, 0.0, 0.0], 'Right gonion': [35.0, 0.0, 0.0]})
+  fit.set_landmark('Right gonion', [45.0, 0.0, 0.0])
+  assert fit.plane[0][0] > 5.0
+  left = -fit.signed_distance([-25.0, 0.0, 0.0])
+  right = fit.signed_distance([45.0, 0.0, 0.0])
+  assert right > left > 0
+  assert fit.asymmetry()['Gonion']==pytest.approx(100*(right - left)/(right + left))
+
+def test_collinear_midline_points_give_no_plane():
+  fit = MidSagittalPlaneFit()
+  assert fit.plane is None
+  direction = np.array([0.0, 0.6, 0.8])
+  fit.set_landmarks({name: 10.0*idx*direction for idx, name in enumerate(MID_SAG_LANDMARK_NAMES)})
+  assert fit.plane is None
+  assert fit.asymmetry()=={} and fit.signed_distance([0.0, 0.0, 0.0]) is None
+  assert fit.report_str()=='Gonion asymmetry index: NotAvailable\nCondylion asymmetry index: NotAvailable\n'
+  # One point off the line determines the plane
+  fit.set_landmark(MID_SAG_LANDMARK_NAMES[0], [0.0, 10.0, 0.0])
+  assert fit.plane is not None
+
+@pytest.mark.parametrize('handedness', [1.0, -1.0])
+def test_plane_slice_to_ras_keeps_handedness(handedness):
+  slice_to_ras = SAGITTAL_SLICE_TO_RAS.copy()
+  slice_to_ras[:3, 0] *= handedness
+  origin = np.array([3.0, -20.0, 40.0])
+  normal = np.array([1.0, 0.2, -0.1])
+  for signed_normal in (normal, -normal):
+    new_slice_to_ras = plane_slice_to_ras(slice_to_ras, origin, signed_normal)
+    rotation = new_slice_to_ras[:3, :3]
+    np.testing.assert_allclose(rotation.T@rotation, np.eye(3), atol=1e-12)
+    assert np.linalg.det(rotation)==pytest.approx(handedness)
+    # The slice normal points the same way as before, and up stays up
+    np.testing.assert_allclose(rotation[:, 2], normal/np.linalg.norm(normal), atol=1e-12)
+    assert rotation[2, 1] > 0.99
+    np.testing.assert_array_equal(new_slice_to_ras[:3, 3], origin)
+    np.testing.assert_array_equal(new_slice_to_ras[3], [0, 0, 0, 1])
+  # A plane facing the old up direction falls back on the old x direction
+  new_slice_to_ras = plane_slice_to_ras(slice_to_ras, origin, [0.0, 0.0, 1.0])
+  assert np.linalg.det(new_slice_to_ras[:3, :3])==pytest.approx(handedness)
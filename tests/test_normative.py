@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.normative import NormativeTable, normal_cdf, normalize_sex, parse_dicom_age
+
+def norms():
+  # Width tabulated at ages 2, 4 and 10 for both sexes, and at 2 and 10 for boys only; no norms for Height in girls
+  return NormativeTable(
+    measures=['Width', 'Width', 'Width', 'Width', 'Width', 'Height'],
+    sexes=['', '', '', 'M', 'male', 'M'],
+    ages=[4, 2, 10, 2, 10, 5],
+    means=[12.0, 10.0, 20.0, 11.0, 21.0, 30.0],
+    sds=[2.0, 1.0, 4.0, 1.0, 5.0, 3.0])
+
+def test_interpolation_at_and_between_grid_ages():
+  means, sds = norms().lookup([2, 3, 4, 7, 10], names=['Width'])
+  assert np.allclose(means[:, 0], [10.0, 11.0, 12.0, 16.0, 20.0])
+  assert np.allclose(sds[:, 0], [1.0, 1.5, 2.0, 3.0, 4.0])
+
+def test_held_beyond_the_grid():
+  means, sds = norms().lookup([0.5, 40], names=['Width'])
+  assert np.allclose(means[:, 0], [10.0, 20.0])
+  assert np.allclose(sds[:, 0], [1.0, 4.0])
+
+def test_sex_specific_norms_fall_back_on_both_sexes():
+  means, _ = norms().lookup([6, 6, 6, np.nan], sexes=['M', 'F', None, 'M'], names=['Width', 'Height', 'Depth'])
+  assert np.allclose(means[0], [16.0, 30.0, np.nan], equal_nan=True)
+  assert np.allclose(means[1], [12.0 + 8/3, np.nan, np.nan], equal_nan=True)
+  assert np.allclose(means[2], [12.0 + 8/3, np.nan, np.nan], equal_nan=True)
+  assert np.isnan(means[3]).all()
+
+def test_scores():
+  z, percentiles = norms().scores([[12.0], [8.0], [np.nan]], [4, 4, 4], names=['Width'])
+  assert np.allclose(z[:, 0], [0.0, -2.0, np.nan], equal_nan=True)
+  assert np.allclose(percentiles[:2, 0], [50.0, 2.275], atol=1e-3)
+
+def test_normal_cdf():
+  # Known values of the standard normal CDF
+  z = [-3.0, -1.96, -1.0, 0.0, 0.5, 1.0, 1.644854, 2.326348]
+  expected = [0.0013499, 0.0249979, 0.1586553, 0.5, 0.6914625, 0.8413447, 0.95, 0.99]
+  assert np.allclose(normal_cdf(z), expected, atol=1.5e-7)
+
+@pytest.mark.parametrize('age_string, years', [
+  ('034Y', 34.0), ('006M', 0.5), ('012W', 12*7/365.25), ('003D', 3/365.25), (' 045Y ', 45.0)])
+def test_parse_dicom_age(age_string, years):
+  assert parse_dicom_age(age_string)==pytest.approx(years)
+
+@pytest.mark.parametrize('age_string', [None, '', '34', 'Y', '034X', '34 years'])
+def test_parse_dicom_age_rejects(age_string):
+  assert parse_dicom_age(age_string) is None
+
+def test_normalize_sex():
+  assert [normalize_sex(sex) for sex in ['M', ' female ', 'O', None, 'Male']]==['M', 'F', '', '', 'M']
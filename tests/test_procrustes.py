@@ -0,0 +1,53 @@
+import numpy as np
+
+from AirwayLandmarksLib.procrustes import DEFAULT_OUTLIER_THRESHOLD, cohort_qc, generalized_procrustes
+
+def rotation(axis, angle):
+  # Rotation matrix (acting on row vectors, as x @ R) about a unit axis by Rodrigues' formula
+  axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+  k = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+  return (np.eye(3) + np.sin(angle)*k + (1 - np.cos(angle))*k @ k).T
+
+def cohort(n_cases, n_landmarks=10, noise=0.0, seed=0):
+  # Copies of one shape with noise, each rotated, scaled and translated by a known amount
+  rng = np.random.default_rng(seed)
+  base = rng.normal(scale=20.0, size=(n_landmarks, 3))
+  coords = np.empty((n_cases, n_landmarks, 3))
+  for case_idx in range(n_cases):
+    shape = base + rng.normal(scale=noise, size=base.shape)
+    r = rotation(rng.normal(size=3), rng.uniform(-np.pi, np.pi))
+    coords[case_idx] = rng.uniform(0.5, 2.0) * shape @ r + rng.normal(scale=100.0, size=3)
+  return base, coords
+
+def test_recovers_rotation_scale_and_translation():
+  base, coords = cohort(1)
+  r = rotation([1, 2, 3], 2.5)
+  moved = 1.7 * coords[0] @ r + [40.0, -12.0, 7.0]
+  moved[2] = np.nan # a missing landmark in the moved case
+  aligned, mean_shape, alignable = generalized_procrustes(np.stack([coords[0], moved, base]))
+  assert alignable.all()
+  assert np.allclose(np.sum((mean_shape - mean_shape.mean(axis=0))**2), 1.0)
+  # Every case lands on the same shape, in the mean shape's frame
+  placed = np.arange(len(base))!=2
+  assert np.allclose(aligned[1, placed], aligned[0, placed], atol=1e-5)
+  assert np.isnan(aligned[1, 2]).all()
+  assert np.allclose(aligned[2], aligned[0], atol=1e-5)
+  assert np.allclose(aligned[0], mean_shape, atol=1e-5)
+
+def test_too_few_landmarks_are_not_aligned():
+  _, coords = cohort(3)
+  coords[1, 2:] = np.nan
+  aligned, _, alignable = generalized_procrustes(coords)
+  assert alignable.tolist()==[True, False, True]
+  assert np.isnan(aligned[1]).all()
+
+def test_flags_a_misplaced_landmark():
+  _, coords = cohort(40, noise=0.3, seed=1)
+  scores, _, _ = cohort_qc(coords)
+  assert np.nanmax(scores) < DEFAULT_OUTLIER_THRESHOLD
+  # Move one landmark of one case well out of place
+  case_idx, landmark_idx = 7, 4
+  coords[case_idx, landmark_idx] += 8.0 * (coords[case_idx, 1] - coords[case_idx, 0]) / np.linalg.norm(coords[case_idx, 1] - coords[case_idx, 0])
+  scores, _, _ = cohort_qc(coords)
+  flagged = np.argwhere(scores > DEFAULT_OUTLIER_THRESHOLD)
+  assert flagged.tolist()==[[case_idx, landmark_idx]]
@@ -0,0 +1,29 @@
+import numpy as np
+
+from AirwayLandmarksLib.propagation import propagate_points
+
+# The parabola fit through the correlation peak is off by a few hundredths of a voxel
+SUBVOXEL_TOLERANCE = 0.05
+
+def smooth_volume(shape, seed=0):
+  # Random blobs, smooth enough for the sub-voxel parabola fit to work on
+  rng = np.random.default_rng(seed)
+  volume = rng.normal(size=shape)
+  for axis in range(volume.ndim):
+    for _ in range(3):
+      volume = (np.roll(volume, 1, axis) + 2*volume + np.roll(volume, -1, axis)) / 4
+  return volume
+
+def test_identical_frames_keep_subvoxel_positions():
+  frame = smooth_volume((40, 40, 40))
+  centers = np.array([[10.4, 12.3, 14.45], [20.0, 20.5, 19.7], [25.25, 15.6, 22.9]])
+  positions, scores = propagate_points(frame, frame.copy(), centers, template_radius=4, search_radius=3)
+  assert np.allclose(positions, centers, atol=SUBVOXEL_TOLERANCE)
+  assert np.allclose(scores, 1.0)
+
+def test_shifted_frame_moves_points_by_the_shift():
+  frame = smooth_volume((40, 40, 40), seed=1)
+  moved = np.roll(frame, (2, -1, 1), axis=(0, 1, 2))
+  centers = np.array([[15.3, 18.8, 20.1], [22.6, 21.4, 17.5]])
+  positions, scores = propagate_points(frame, moved, centers, template_radius=4, search_radius=3)
+  assert np.allclose(positions, centers + [2, -1, 1], atol=SUBVOXEL_TOLERANCE)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.refinement import snap_point
+
+SPACING = (1.0, 1.0, 1.0)
+
+@pytest.fixture
+def cube():
+  # A bright 10 voxel cube, voxels 15 to 24 along every axis, in a dark 40 voxel volume
+  array = np.zeros((40, 40, 40), dtype=np.int16)
+  array[15:25, 15:25, 15:25] = 1000
+  return array
+
+def test_bright_snaps_into_the_cube(cube):
+  snapped, value = snap_point(cube, [11.0, 20.0, 20.0], 5.0, SPACING, mode='bright')
+  assert 15 <= snapped[0] <= 17
+  assert np.allclose(snapped[1:], 20.0)
+  assert value==1000
+
+def test_dark_snaps_out_of_the_cube(cube):
+  snapped, value = snap_point(cube, [20.0, 20.0, 22.0], 5.0, SPACING, mode='dark')
+  assert snapped[2] > 24.5 and np.linalg.norm(snapped - [20.0, 20.0, 22.0]) <= 5.0
+  assert value==0
+
+def test_edge_snaps_to_the_cube_face(cube):
+  # The face lies halfway between voxels 14 and 15
+  snapped, value = snap_point(cube, [11.3, 19.6, 20.2], 5.0, SPACING, mode='edge')
+  assert abs(snapped[0] - 14.5) <= 0.5
+  assert np.allclose(snapped[1:], [20.0, 20.0], atol=0.5)
+  assert value > 0
+  # Anisotropic voxels: 2 mm along the first axis, so the face is two voxels from the click
+  snapped, _ = snap_point(cube, [12.6, 20.0, 20.0], 5.0, (2.0, 1.0, 1.0), mode='edge')
+  assert abs(snapped[0] - 14.5) <= 0.5
+
+def test_snap_stays_within_the_radius(cube):
+  # Nothing but background near the click
+  center = np.array([5.2, 5.0, 4.8])
+  for mode in ('edge', 'bright', 'dark'):
+    snapped, _ = snap_point(cube, center, 3.0, SPACING, mode=mode)
+    # The best voxel is within the radius, the sub-voxel fit moves it at most half a voxel along each axis
+    assert np.linalg.norm(snapped - center) <= 3.0 + np.sqrt(3)/2
+
+def test_click_outside_the_array(cube):
+  snapped, value = snap_point(cube, [-3.0, 20.0, 20.0], 5.0, SPACING)
+  assert np.array_equal(snapped, [-3.0, 20.0, 20.0]) and np.isnan(value)
+  snapped, value = snap_point(cube, [20.0, 40.0, 20.0], 5.0, SPACING)
+  assert np.array_equal(snapped, [20.0, 40.0, 20.0]) and np.isnan(value)
+
+def test_unknown_mode(cube):
+  with pytest.raises(ValueError):
+    snap_point(cube, [20.0, 20.0, 20.0], 5.0, SPACING, mode='brightest')
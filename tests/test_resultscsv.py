@@ -0,0 +1,168 @@
+import glob
+import os
+import time
+
+import pytest
+
+from AirwayLandmarksLib.results import MeasureResults
+from AirwayLandmarksLib.resultscsv import ResultsCSVStore, ResultsFileLock, ResultsHeaderMismatch
+
+def measured(volume_names, value=1.0, names=('Width', 'Height')):
+  # MeasureResults with the same value for every measure of every volume
+  return MeasureResults([[value] * len(names)] * len(volume_names), case_names=volume_names,
+    names=names, units=['mm'] * len(names), formats=['%.2f'] * len(names))
+
+def latest_values(store):
+  # volume name -> first measure of its latest row
+  _, rows = store.read_rows()
+  return {row[-1]: float(row[0]) for row in rows}
+
+@pytest.fixture
+def filename(tmp_path):
+  # An empty results file, which the first upsert starts off with the header rows
+  filename = str(tmp_path / 'results.csv')
+  open(filename, 'w').close()
+  return filename
+
+def test_two_stores_appending_to_one_file(filename):
+  store_a, store_b = ResultsCSVStore(filename), ResultsCSVStore(filename)
+  assert store_a.upsert(measured(['vol1', 'vol2'], 1.0))==(2, 0)
+  assert store_b.upsert(measured(['vol3', 'vol1'], 2.0))==(1, 1)
+  # store_a picks up store_b's rows before appending its own
+  assert store_a.upsert(measured(['vol3', 'vol4'], 3.0))==(1, 1)
+  assert store_a.volume_rows=={'vol1': 3, 'vol2': 1, 'vol3': 4, 'vol4': 5}
+  assert store_b.upsert(measured(['vol2'], 4.0))==(0, 1)
+  assert store_b.volume_rows=={'vol1': 3, 'vol2': 6, 'vol3': 4, 'vol4': 5}
+  assert store_b.n_rows==7 and store_b.n_superseded==3
+  assert latest_values(store_a)=={'vol1': 2.0, 'vol2': 4.0, 'vol3': 3.0, 'vol4': 3.0}
+
+def test_index_resets_after_another_writer_compacts(filename):
+  store_a, store_b = ResultsCSVStore(filename), ResultsCSVStore(filename)
+  store_a.upsert(measured(['vol1', 'vol2'], 1.0))
+  store_a.upsert(measured(['vol1', 'vol2'], 2.0))
+  store_b.compact() # the file is now shorter than what store_a has indexed
+  assert store_a.upsert(measured(['vol2', 'vol3'], 3.0))==(1, 1)
+  assert store_a.volume_rows=={'vol1': 0, 'vol2': 2, 'vol3': 3}
+  assert store_a.n_rows==4
+
+def test_index_resets_after_file_replaced_at_the_same_size(filename):
+  store_a, store_b = ResultsCSVStore(filename), ResultsCSVStore(filename)
+  store_a.upsert(measured(['vol1', 'vol2'], 1.0))
+  store_b.create(measured(['vol3', 'vol4'], 1.0))
+  # Same size, and make sure the modification time differs even on a coarse clock
+  stat = os.stat(filename)
+  assert stat.st_size==store_a._indexed_bytes
+  os.utime(filename, ns=(stat.st_atime_ns, store_a._indexed_mtime + 1000000000))
+  assert store_a.upsert(measured(['vol4'], 2.0))==(0, 1)
+  assert store_a.volume_rows=={'vol3': 0, 'vol4': 2}
+
+def test_index_resets_after_file_replaced_with_another_header(filename):
+  store_a, store_b = ResultsCSVStore(filename), ResultsCSVStore(filename)
+  store_a.upsert(measured(['vol1'], 1.0, names=('Width', 'Height')))
+  store_b.create(measured(['vol1', 'vol2', 'vol3'], 1.0, names=('Depth', 'Height')))
+  with pytest.raises(ResultsHeaderMismatch):
+    store_a.upsert(measured(['vol4'], 2.0, names=('Width', 'Height')))
+  assert store_a.header[0]==['Depth', 'Height', 'Volume Name']
+  assert store_a.volume_rows=={'vol1': 0, 'vol2': 1, 'vol3': 2}
+
+def test_unchanged_file_is_not_read_again(filename, monkeypatch):
+  store = ResultsCSVStore(filename)
+  store.upsert(measured(['vol1', 'vol2']))
+  def read_bytes(start, stop=None):
+    raise AssertionError('Read %d: bytes of an unchanged file' % start)
+  monkeypatch.setattr(store, '_read_bytes', read_bytes)
+  store._update_index()
+  assert store.volume_rows=={'vol1': 0, 'vol2': 1}
+
+def test_header_mismatch(filename):
+  store = ResultsCSVStore(filename)
+  store.upsert(measured(['vol1']))
+  with open(filename, 'rb') as f:
+    before = f.read()
+  with pytest.raises(ResultsHeaderMismatch):
+    store.upsert(measured(['vol2'], names=('Width', 'Depth')))
+  with open(filename, 'rb') as f:
+    assert f.read()==before
+  assert not os.path.exists(filename + '.lock')
+
+def test_partial_last_line_is_left_for_next_time(filename):
+  store = ResultsCSVStore(filename)
+  store.upsert(measured(['vol1']))
+  size = os.path.getsize(filename)
+  with open(filename, 'a', newline='') as f:
+    f.write('5.0,5.0,vo') # another writer's row, half written
+  store._update_index()
+  assert store.volume_rows=={'vol1': 0}
+  assert store._indexed_bytes==size
+  with open(filename, 'a', newline='') as f:
+    f.write('l2\r\n')
+  store._update_index()
+  assert store.volume_rows=={'vol1': 0, 'vol2': 1}
+  assert store._indexed_bytes==os.path.getsize(filename)
+
+def test_compacts_once_superseded_rows_pile_up(filename):
+  store = ResultsCSVStore(filename, compact_min_rows=4, compact_fraction=0.5)
+  store.upsert(measured(['vol1', 'vol2']))
+  for value in range(4):
+    store.upsert(measured(['vol1'], float(value)))
+  assert store.n_rows==6 and store.n_superseded==4
+  store.upsert(measured(['vol1'], 9.0))
+  assert store.n_rows==2 and store.n_superseded==0
+  _, rows = store.read_rows(latest=False)
+  assert [row[-1] for row in rows]==['vol1', 'vol2']
+  assert latest_values(store)=={'vol1': 9.0, 'vol2': 1.0}
+
+def test_compaction_leaves_one_row_per_volume(filename):
+  # With the default thresholds: compacted once more than 50, and a tenth, of the rows are superseded
+  store = ResultsCSVStore(filename)
+  volume_names = ['vol%d' % idx for idx in range(100)]
+  store.upsert(measured(volume_names, 1.0))
+  for idx in range(50):
+    store.upsert(measured([volume_names[idx % 3]], 2.0))
+  assert store.n_rows==150 and store.n_superseded==50
+  assert store.upsert(measured(['vol7'], 3.0))==(0, 1)
+  _, rows = store.read_rows(latest=False)
+  assert [row[-1] for row in rows]==volume_names
+  assert store.n_rows==100 and store.n_superseded==0
+  assert [float(row[0]) for row in rows[:4]]==[2.0, 2.0, 2.0, 1.0] and float(rows[7][0])==3.0
+
+def make_stale_lock(lock, token):
+  with open(lock.lock_filename, 'w') as f:
+    f.write(token)
+  old = time.time() - 2*lock.stale_after
+  os.utime(lock.lock_filename, (old, old))
+
+def test_stale_lock_is_taken_over(filename):
+  lock = ResultsFileLock(filename, timeout=1.0, stale_after=10.0)
+  make_stale_lock(lock, 'crashed-host 1 0\n')
+  with lock:
+    with open(lock.lock_filename) as f:
+      assert f.read()==lock.token
+  assert not os.path.exists(lock.lock_filename)
+  assert glob.glob(lock.lock_filename + '.*')==[]
+
+def test_live_lock_taken_meanwhile_is_put_back(filename, monkeypatch):
+  lock = ResultsFileLock(filename, timeout=1.0, stale_after=10.0)
+  make_stale_lock(lock, 'crashed-host 1 0\n')
+  read_token = lock._read_token
+  def read_token_then_replace(lock_filename):
+    # Another writer takes the stale lock over and holds a live one, just after the stale token is read
+    token = read_token(lock_filename)
+    monkeypatch.setattr(lock, '_read_token', read_token)
+    os.remove(lock.lock_filename)
+    with open(lock.lock_filename, 'w') as f:
+      f.write('other-host 2 1\n')
+    return token
+  monkeypatch.setattr(lock, '_read_token', read_token_then_replace)
+  assert not lock._take_over_stale_lock()
+  with open(lock.lock_filename) as f:
+    assert f.read()=='other-host 2 1\n'
+  assert glob.glob(lock.lock_filename + '.*')==[]
+
+def test_release_leaves_a_lock_taken_over(filename):
+  lock = ResultsFileLock(filename)
+  lock.acquire()
+  with open(lock.lock_filename, 'w') as f:
+    f.write('other-host 2 1\n')
+  lock.release()
+  assert os.path.exists(lock.lock_filename)
@@ -0,0 +1,54 @@
+import csv
+
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.results import MeasureResults
+from AirwayLandmarksLib.resultsdb import ResultsDatabase
+
+def measured(volume_names, value):
+  return MeasureResults([[value, np.nan]] * len(volume_names), case_names=volume_names,
+    names=['Width', 'Height'], units=['mm', 'mm'], formats=['%.2f', '%.2f'])
+
+@pytest.fixture
+def db(tmp_path):
+  with ResultsDatabase(str(tmp_path / 'results.sqlite')) as db:
+    # Added out of time order, and vol2 twice at the same time (the later addition wins)
+    db.add_results(measured(['vol1', 'vol2'], 1.0), annotator='ann', timestamp=100.0,
+      landmarks=[{'Basion': [1.0, 2.0, 3.0], 'Sella': None}, {'Sella': [4.0, 5.0, 6.0]}])
+    db.add_results(measured(['vol1'], 3.0), annotator='bob', timestamp=300.0, landmarks=[{'Sella': [7.0, 8.0, 9.0]}])
+    db.add_results(measured(['vol1'], 2.0), annotator='ann', timestamp=200.0, notes=['frame 2'])
+    db.add_results(measured(['vol2'], 4.0), annotator='bob', timestamp=100.0)
+    yield db
+
+def test_latest_measurement_of_each_volume(db):
+  latest = db.latest_measurements()
+  assert [(volume, annotator, timestamp) for _, volume, annotator, timestamp, _ in latest]==[
+    ('vol1', 'bob', 300.0), ('vol2', 'bob', 100.0)]
+  assert db.latest_results().values[:, 0].tolist()==[3.0, 4.0]
+
+def test_latest_measurement_per_annotator(db):
+  latest = db.latest_measurements(annotator='ann')
+  assert [(volume, timestamp, note) for _, volume, _, timestamp, note in latest]==[
+    ('vol1', 200.0, 'frame 2'), ('vol2', 100.0, '')]
+  assert db.latest_results(annotator='ann').values[:, 0].tolist()==[2.0, 1.0]
+
+def test_history_and_landmarks(db):
+  history = db.volume_history('vol1')
+  assert [(annotator, timestamp) for _, annotator, timestamp, _ in history]==[('ann', 100.0), ('ann', 200.0), ('bob', 300.0)]
+  assert db.landmark_positions(history[0][0])=={'Basion': [1.0, 2.0, 3.0]}
+  assert db.volumes_missing_landmark('Sella')==['vol2']
+  assert db.volumes_missing_landmark('Basion')==['vol1', 'vol2']
+
+def test_results_keep_unavailable_measures(db):
+  results = db.latest_results()
+  assert results.names==['Width', 'Height'] and results.case_names==['vol1', 'vol2']
+  assert not results.available[:, 1].any()
+
+def test_export_csv(db, tmp_path):
+  filename = str(tmp_path / 'results.csv')
+  assert db.export_csv(filename)==2
+  with open(filename, newline='') as f:
+    rows = list(csv.reader(f))
+  assert rows[0]==['Width', 'Height', 'Volume Name']
+  assert [(float(row[0]), row[1], row[-1]) for row in rows[2:]]==[(3.0, 'NotAvailable', 'vol1'), (4.0, 'NotAvailable', 'vol2')]
@@ -0,0 +1,53 @@
+import numpy as np
+
+from AirwayLandmarksLib.sampling import sphere_offsets, sphere_statistics, trilinear
+
+def ramp(shape):
+  # A linear function of the array indices, which trilinear interpolation reproduces exactly
+  k, j, i = np.indices(shape)
+  return 2.0*k + 3.0*j - 1.5*i + 5.0
+
+def test_trilinear_is_exact_on_a_ramp():
+  array = ramp((10, 12, 14))
+  points = np.random.default_rng(7).uniform(0, [9, 11, 13], size=(500, 3))
+  np.testing.assert_allclose(trilinear(array, points), 2.0*points[:, 0] + 3.0*points[:, 1] - 1.5*points[:, 2] + 5.0, rtol=1e-12)
+
+def test_trilinear_on_and_beyond_the_edges():
+  array = ramp((10, 12, 14))
+  points = [[9.0, 11.0, 13.0], [9.0, 5.5, 0.0], [0.0, 0.0, 0.0], [-0.01, 5.0, 5.0], [9.01, 5.0, 5.0], [5.0, 5.0, 13.5]]
+  values = trilinear(array, points)
+  np.testing.assert_allclose(values[:3], [2.0*9 + 3.0*11 - 1.5*13 + 5.0, 2.0*9 + 3.0*5.5 + 5.0, 5.0], rtol=1e-12)
+  assert np.isnan(values[3:]).all()
+  # A single slice thick volume, and a single point not in an (N x 3) array
+  assert trilinear(array[:1], [[0.0, 2.5, 3.0]])[0]==3.0*2.5 - 1.5*3.0 + 5.0
+  assert trilinear(array, [1.0, 1.0, 1.0])[0]==8.5
+
+def test_sphere_statistics_inside_the_volume():
+  array = ramp((20, 20, 20))
+  spacing = (2.0, 1.0, 1.0)
+  offsets = sphere_offsets(3.0, spacing)
+  # The voxels within 3 mm: 29 in the centre slice (within 3 voxels), 21 in each 2 mm away (within sqrt(5))
+  assert np.all(np.abs(offsets) <= [1, 3, 3]) and np.all(np.sum((offsets*spacing)**2, axis=1) <= 9.0)
+  assert len(offsets)==29 + 2*21
+  means, sds = sphere_statistics(array, [[10.0, 10.0, 10.0], [5.2, 6.7, 8.4]], 3.0, spacing)
+  for point, mean, sd in zip([[10, 10, 10], [5, 7, 8]], means, sds):
+    samples = array[tuple((np.array(point) + offsets).T)]
+    assert np.isclose(mean, np.mean(samples), rtol=1e-14)
+    assert np.isclose(sd, np.std(samples, ddof=1), rtol=1e-12)
+  # The ramp is symmetric about the centre voxel
+  assert means[0]==array[10, 10, 10]
+
+def test_sphere_statistics_partly_outside_the_volume():
+  array = ramp((20, 20, 20))
+  offsets = sphere_offsets(2.0, (1.0, 1.0, 1.0))
+  point = np.array([0, 19, 10])
+  voxels = point + offsets
+  voxels = voxels[np.all((voxels >= 0) & (voxels < 20), axis=1)]
+  samples = array[tuple(voxels.T)]
+  means, sds = sphere_statistics(array, [point, [-5.0, 10.0, 10.0], [10.0, 10.0, 10.0]], 2.0, (1.0, 1.0, 1.0))
+  assert np.isclose(means[0], np.mean(samples)) and np.isclose(sds[0], np.std(samples, ddof=1))
+  assert means[0]!=array[0, 19, 10]
+  assert np.isnan(means[1]) and np.isnan(sds[1])
+  # A sphere smaller than a voxel holds only the centre voxel, which has no SD
+  means, sds = sphere_statistics(array, [[10.0, 10.0, 10.0]], 0.5, (1.0, 1.0, 1.0))
+  assert means[0]==array[10, 10, 10] and np.isnan(sds[0])
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from AirwayLandmarksLib.timing import CallTimings, DurationRingBuffer, timed
+
+def profile_entries(profile_str):
+  # The function rows of a pstats report
+  lines = profile_str.splitlines()
+  header = next(idx for idx, line in enumerate(lines) if line.strip().startswith('ncalls'))
+  return [line for line in lines[header + 1:] if line.strip()]
+
+def test_ring_buffer_keeps_the_last_calls():
+  buffer = DurationRingBuffer(capacity=4)
+  assert buffer.summary()=={'count': 0, 'total': 0.0, 'mean': 0.0, 'max': 0.0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0}
+  for duration in range(1, 11):
+    buffer.add(float(duration))
+  assert sorted(buffer.recent())==[7.0, 8.0, 9.0, 10.0]
+  summary = buffer.summary(percentiles=(50, 90))
+  # Count and mean over every call, max and percentiles over the last four
+  assert (summary['count'], summary['total'], summary['mean'])==(10, 55.0, 5.5)
+  assert summary['max']==10.0
+  assert summary['p50']==np.percentile([7.0, 8.0, 9.0, 10.0], 50)==8.5
+  assert summary['p90']==pytest.approx(9.7)
+
+def test_timed_calls_are_recorded_while_enabled():
+  timings = CallTimings(capacity=8)
+  @timed(timings=timings)
+  def add(a, b=0):
+    return a + b
+  @timed('failing', timings=timings)
+  def fail():
+    raise KeyError('missing')
+  assert add.__name__=='add'
+  assert add(1, b=2)==3
+  assert timings.buffers=={} # disabled, so passed straight through
+  timings.enabled = True
+  for value in range(20):
+    assert add(value, b=1)==value + 1
+  with pytest.raises(KeyError):
+    fail()
+  summary = timings.summary()
+  assert list(summary)==['failing', add.__qualname__]
+  assert summary[add.__qualname__]['count']==20 and len(timings.buffers[add.__qualname__].recent())==8
+  assert summary['failing']['count']==1
+  assert 'failing' in timings.report_str()
+  timings.reset()
+  assert timings.summary()=={}
+
+def test_profile_capture_is_bounded():
+  timings = CallTimings()
+  timings.enabled = True
+  @timed('inner', timings=timings)
+  def inner(value):
+    return sum(range(value))
+  @timed('outer', timings=timings)
+  def outer(value):
+    # A timed call inside a profiled one is timed but not profiled a second time
+    return inner(value) + sorted([value, 1])[0]
+  assert timings.profile_str()==''
+  timings.set_profiling(True)
+  for value in range(50):
+    assert outer(value)==sum(range(value)) + min(value, 1)
+  assert timings.summary()['inner']['count']==50
+  # One row per function profiled, however many calls, and at most `limit` of them reported
+  full = profile_entries(timings.profile_str(limit=1000))
+  assert len(full) < 20
+  assert len(profile_entries(timings.profile_str(limit=3)))==3
+  assert any(line.split()[0]=='50' for line in full) # ncalls of the functions called once per outer call
+  # Switched off, calls are timed but the profile no longer grows
+  timings.set_profiling(False)
+  outer(3)
+  assert profile_entries(timings.profile_str(limit=1000))==full
+  timings.reset()
+  assert timings.profile_str()==''
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pytest
+
+from AirwayLandmarksLib.worklist import PrefetchCache, read_worklist
+
+def write_worklist(path, rows):
+  with open(path, 'w', newline='') as f:
+    f.write('\n'.join(rows) + '\n')
+
+def test_default_landmark_paths_are_next_to_the_volume(tmp_path):
+  os.makedirs(str(tmp_path / 'lists'))
+  filename = str(tmp_path / 'lists' / 'worklist.csv')
+  write_worklist(filename, ['Volume,FH Landmarks,Landmarks,Name',
+    '../pt1/CT.nii.gz,,,',
+    '../pt2/dicom/,fh.fcsv,,Patient 2',
+    ',,,no volume'])
+  cases = read_worklist(filename)
+  assert [case.name for case in cases]==['CT', 'Patient 2']
+  pt1 = os.path.join(str(tmp_path), 'pt1')
+  assert cases[0].volume_path==os.path.join(pt1, 'CT.nii.gz')
+  assert cases[0].fh_path==os.path.join(pt1, 'CT_FH_Landmarks.mrk.json')
+  assert cases[0].landmarks_path==os.path.join(pt1, 'CT_Airway_Landmarks.mrk.json')
+  # A DICOM directory, with an FH file given relative to the worklist
+  dicom = os.path.join(str(tmp_path), 'pt2', 'dicom')
+  assert cases[1].volume_path==dicom
+  assert cases[1].fh_path==os.path.join(str(tmp_path), 'lists', 'fh.fcsv')
+  assert cases[1].landmarks_path==dicom + '_Airway_Landmarks.mrk.json'
+
+def test_duplicate_cases_are_rejected(tmp_path):
+  filename = str(tmp_path / 'worklist.csv')
+  # Named after their volume files, both cases would be "CT"
+  write_worklist(filename, ['Volume', 'pt1/CT.nrrd', 'pt2/CT.nrrd'])
+  with pytest.raises(ValueError, match='name "CT"'):
+    read_worklist(filename)
+  write_worklist(filename, ['Volume,Name', 'pt1/CT.nrrd,pt1', 'pt2/CT.nrrd,pt2'])
+  assert [case.name for case in read_worklist(filename)]==['pt1', 'pt2']
+  # The same volume under two names would share its landmark files
+  write_worklist(filename, ['Volume,Name', 'pt1/CT.nrrd,first', 'pt1/CT.nrrd,second'])
+  with pytest.raises(ValueError, match='volume path'):
+    read_worklist(filename)
+
+def test_eviction_cancels_pending_loads():
+  started = threading.Event()
+  release = threading.Event()
+  loaded = []
+  def load(key):
+    if key=='a':
+      started.set()
+      release.wait(5)
+    loaded.append(key)
+    return key.upper()
+  cache = PrefetchCache(load, capacity=2, workers=1)
+  try:
+    a = cache.prefetch('a')
+    assert started.wait(5) # 'a' is loading, so the others wait in the queue
+    b = cache.prefetch('b')
+    c = cache.prefetch('c')
+    assert list(cache.entries)==['b', 'c'] and not a.cancelled() # a load already running is not cancelled
+    cache.prefetch('b') # now the most recently used
+    cache.prefetch('d')
+    assert list(cache.entries)==['b', 'd']
+    assert c.cancelled() and not b.cancelled()
+    release.set()
+    assert cache.get('d', timeout=5)=='D' and cache.get('b', timeout=5)=='B'
+    assert 'c' not in loaded
+    assert cache.loaded_keys()==['d', 'b']
+  finally:
+    release.set()
+    cache.close()
+
+def test_pop_returns_only_loaded_values():
+  def load(key):
+    if key=='bad':
+      raise IOError('cannot read "%s"' % key)
+    return key.upper()
+  cache = PrefetchCache(load, capacity=3)
+  try:
+    with pytest.raises(IOError):
+      cache.get('bad', timeout=5)
+    cache.get('good', timeout=5)
+    assert cache.loaded_keys()==['good']
+    assert cache.pop('bad') is None
+    assert cache.pop('good')=='GOOD'
+    assert cache.pop('good') is None and cache.pop('never requested') is None
+    assert cache.entries=={}
+  finally:
+    cache.close()